@@ -27,24 +27,43 @@ bl_info = {
 # handle reloading
 if "bpy" in locals():
 	import imp
+	imp.reload(build_pool)
+	imp.reload(build_profiler)
 	imp.reload(core)
+	imp.reload(csg)
 	imp.reload(export_map)
+	imp.reload(export_pool)
+	imp.reload(import_dae)
+	imp.reload(import_lwo)
+	imp.reload(import_map)
+	imp.reload(import_md5anim)
 	imp.reload(import_md5mesh)
 	imp.reload(lexer)
+	imp.reload(map_geometry)
+	imp.reload(map_writer)
+	imp.reload(mesh_utils)
+	imp.reload(temp_data)
+	imp.reload(thumbnails)
+	imp.reload(vertex_cache)
 else:
-	from . import core, export_map, import_md5mesh, lexer
-	
-import bpy
+	try:
+		import bpy
+	except ImportError:
+		bpy = None # imported by an export worker process, which runs blender's python without bpy. see export_pool.py.
+	if bpy:
+		from . import build_pool, build_profiler, core, csg, export_map, export_pool, import_dae, import_lwo, import_map, import_md5anim, import_md5mesh, lexer, map_geometry, map_writer, mesh_utils, temp_data, thumbnails, vertex_cache
 	
 def register():
 	bpy.utils.register_module(__name__)
 	core.register()
 	export_map.register()
+	import_map.register()
 
 def unregister():
 	bpy.utils.unregister_module(__name__)
 	core.unregister()
 	export_map.unregister()
+	import_map.unregister()
 
 if __name__ == "__main__":
 	register()
@@ -0,0 +1,93 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# build and export many .blend maps concurrently, each in its own background blender running cli.py
+# usage: python batch_build.py [--blender path] [--jobs N] [--output-dir dir] [--summary summary.json] [-- cli.py options] map.blend ...
+# doesn't need blender's python, any python 3 will do
+
+import argparse, json, os, subprocess, sys, tempfile, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+def build(blender, blend, output_dir, cli_args):
+	"""Build and export one map. Returns a summary OrderedDict."""
+	cli = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cli.py")
+	output = os.path.join(output_dir, os.path.splitext(os.path.basename(blend))[0] + ".json")
+	(fd, result_filename) = tempfile.mkstemp(suffix=".json")
+	os.close(fd)
+	start_time = time.perf_counter()
+	try:
+		args = [blender, "-b", blend, "--python", cli, "--", "--output", output, "--result", result_filename] + cli_args
+		process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+		try:
+			with open(result_filename) as f:
+				result = json.load(f, object_pairs_hook=OrderedDict)
+		except ValueError:
+			result = OrderedDict([("blend", blend), ("output", output)]) # blender failed before cli.py wrote anything
+		result["seconds"] = time.perf_counter() - start_time
+		result["exit_code"] = process.returncode
+		if process.returncode != 0:
+			result.setdefault("error", "blender exited with code %d" % process.returncode)
+			result["log"] = process.stdout[-4000:]
+		return result
+	finally:
+		os.remove(result_filename)
+
+def main():
+	argv = sys.argv[1:]
+	cli_args = []
+	if "--" in argv:
+		# everything after -- up to the first .blend is passed to cli.py
+		i = argv.index("--")
+		rest = argv[i + 1:]
+		num_cli_args = next((j for j, a in enumerate(rest) if a.endswith(".blend")), len(rest))
+		cli_args = rest[:num_cli_args]
+		argv = argv[:i] + rest[num_cli_args:]
+	parser = argparse.ArgumentParser(description="Build and export BFG Forge maps concurrently")
+	parser.add_argument("maps", nargs="+", help=".blend files")
+	parser.add_argument("--blender", default="blender", help="blender executable")
+	parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of maps to build at once")
+	parser.add_argument("--output-dir", default=".", help="directory the exported maps are written to")
+	parser.add_argument("--summary", help="save the summary to this .json file")
+	args = parser.parse_args(argv)
+	os.makedirs(args.output_dir, exist_ok=True)
+
+	start_time = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+		results = list(executor.map(lambda blend: build(args.blender, blend, args.output_dir, cli_args), args.maps))
+	failures = [r for r in results if r.get("exit_code") != 0]
+	summary = OrderedDict([
+		("seconds", time.perf_counter() - start_time),
+		("maps", len(results)),
+		("failures", len(failures)),
+		("results", results)
+	])
+
+	print("%-40s %10s %10s %10s  %s" % ("map", "build (s)", "total (s)", "triangles", "status"))
+	for r in results:
+		status = r.get("error", "ok")
+		if r.get("warnings"):
+			status += " (%d warnings)" % len(r["warnings"])
+		print("%-40s %10.2f %10.2f %10s  %s" % (os.path.basename(r["blend"]), r.get("build_seconds", 0), r["seconds"], r.get("triangles", "-"), status))
+	print("%d maps, %d failed, %.2f seconds" % (len(results), len(failures), summary["seconds"]))
+	if args.summary:
+		with open(args.summary, "w") as f:
+			json.dump(summary, f, indent="\t")
+	return 1 if failures else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,187 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# times Build Map on generated maps: a grid of slightly overlapping box rooms, each with a pillar brush
+# usage: blender -b --factory-startup --python benchmark.py -- addon_parent_dir addon_package [num_rooms ...]
+# or compare the operator based build helpers with the data level ones the build pipeline uses:
+# blender -b --factory-startup --python benchmark.py -- addon_parent_dir addon_package overhead [num_objects]
+# or compare the vectorized auto_unwrap with the bmesh one, and check they produce the same UVs:
+# blender -b --factory-startup --python benchmark.py -- addon_parent_dir addon_package unwrap [subdivisions]
+# or check Carve and CSG agree on a map with a brush outside every room, which adds nothing to the map:
+# blender -b --factory-startup --python benchmark.py -- addon_parent_dir addon_package stray
+
+import bpy, bmesh, importlib, math, sys, time
+import numpy as np
+
+_room_size = 4.0
+_room_overlap = 0.1 # Carve needs rooms to intersect slightly
+_room_height = 3.0
+
+def clear_scene(scene):
+	for obj in list(scene.objects):
+		scene.objects.unlink(obj)
+		bpy.data.objects.remove(obj)
+
+def add_box(s_type, location, scale):
+	bpy.ops.scene.add_brush(s_type=s_type)
+	obj = bpy.context.active_object
+	obj.location = location
+	obj.scale = scale
+	return obj
+
+def generate_map(num_rooms):
+	columns = int(math.ceil(math.sqrt(num_rooms)))
+	spacing = _room_size - _room_overlap
+	for i in range(num_rooms):
+		(x, y) = ((i % columns) * spacing, (i // columns) * spacing)
+		add_box('3D_ROOM', (x, y, _room_height / 2), (_room_size / 2, _room_size / 2, _room_height / 2))
+		add_box('BRUSH', (x, y, _room_height / 2), (0.25, 0.25, _room_height / 2 + 0.5))
+
+def time_build(addon, scene, mode):
+	scene.bfg.build_mode = mode
+	addon.core.free_build_caches()
+	start = time.perf_counter()
+	addon.core.build_scene_maps(bpy.context)
+	elapsed = time.perf_counter() - start
+	mesh = bpy.data.objects["_worldspawn"].data
+	return (elapsed, len(mesh.polygons))
+
+# the operator based helpers the build pipeline used to have
+def ops_flip_object_normals(obj):
+	bpy.ops.object.select_all(action='DESELECT')
+	obj.select = True
+	bpy.context.scene.objects.active = obj
+	bpy.ops.object.editmode_toggle()
+	bpy.ops.mesh.select_all(action='SELECT')
+	bpy.ops.mesh.flip_normals()
+	bpy.ops.object.editmode_toggle()
+	
+def ops_link_object_to_group(obj, group):
+	bpy.context.scene.objects.active = obj
+	if not group in bpy.data.groups:
+		bpy.ops.group.create(name=group)
+	bpy.ops.object.group_link(group=group)
+	
+def ops_boolean_meshes(scene, mesh, other):
+	dest = bpy.data.objects.new("_bool_dest", mesh.copy())
+	scene.objects.link(dest)
+	ob_bool = bpy.data.objects.new("_bool", other)
+	bpy.ops.object.select_all(action='DESELECT')
+	dest.select = True
+	scene.objects.active = dest
+	mod = dest.modifiers.new(name="_bool", type='BOOLEAN')
+	mod.object = ob_bool
+	mod.operation = 'UNION'
+	mod.solver = 'CARVE'
+	bpy.ops.object.modifier_apply(apply_as='DATA', modifier=mod.name)
+	result = dest.data
+	scene.objects.unlink(dest)
+	bpy.data.objects.remove(dest)
+	bpy.data.objects.remove(ob_bool)
+	return result
+	
+def time_calls(f, items):
+	start = time.perf_counter()
+	for item in items:
+		f(item)
+	return time.perf_counter() - start
+	
+def benchmark_overhead(addon, scene, num_objects):
+	clear_scene(scene)
+	objects = [add_box('BRUSH', (i * 3.0, 0, 0), (1, 1, 1)) for i in range(num_objects)]
+	meshes = [obj.data for obj in objects]
+	core = addon.core
+	print("%24s %12s %12s" % ("", "ops (s)", "data (s)"))
+	print("%24s %12.3f %12.3f" % ("flip normals", time_calls(ops_flip_object_normals, objects), time_calls(core.flip_object_normals, objects)))
+	print("%24s %12.3f %12.3f" % ("link to group", time_calls(lambda obj: ops_link_object_to_group(obj, "ops"), objects), time_calls(lambda obj: core.link_object_to_group(obj, "data"), objects)))
+	pairs = list(zip(meshes[:-1], meshes[1:]))
+	print("%24s %12.3f %12.3f" % ("boolean union", time_calls(lambda p: ops_boolean_meshes(scene, p[0], p[1]), pairs), time_calls(lambda p: core.boolean_meshes(scene, p[0], p[1], 'UNION'), pairs)))
+	
+def get_uvs(mesh):
+	uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+	mesh.uv_layers.active.data.foreach_get("uv", uvs)
+	return uvs
+	
+def benchmark_unwrap(addon, scene, subdivisions):
+	clear_scene(scene)
+	bpy.ops.mesh.primitive_ico_sphere_add(subdivisions=subdivisions, size=5.0, location=(1.5, -2.0, 0.5))
+	obj = bpy.context.active_object
+	obj.scale = (1.0, 2.0, 0.5)
+	mesh = obj.data
+	other = mesh.copy()
+	core = addon.core
+	start = time.perf_counter()
+	bm = bmesh.new()
+	bm.from_mesh(other)
+	core.auto_unwrap_bmesh(bm, other, obj.location, obj.scale)
+	bm.to_mesh(other)
+	bm.free()
+	bmesh_time = time.perf_counter() - start
+	start = time.perf_counter()
+	core.auto_unwrap(mesh, obj.location, obj.scale)
+	numpy_time = time.perf_counter() - start
+	mismatches = np.count_nonzero(get_uvs(mesh) != get_uvs(other))
+	print("%10s %12s %12s %12s" % ("faces", "bmesh (s)", "numpy (s)", "mismatches"))
+	print("%10d %12.3f %12.3f %12d" % (len(mesh.polygons), bmesh_time, numpy_time, mismatches))
+	
+def get_mesh_bounds(mesh):
+	co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+	mesh.vertices.foreach_get("co", co)
+	co = co.reshape(-1, 3)
+	return (co.min(axis=0), co.max(axis=0)) if len(co) > 0 else (np.zeros(3), np.zeros(3))
+	
+def benchmark_stray_brush(addon, scene):
+	clear_scene(scene)
+	generate_map(4)
+	# the rooms start at x = -room size / 2
+	add_box('BRUSH', (-4.0 * _room_size, 0, _room_height / 2), (0.5, 0.5, 0.5))
+	print("%8s %12s %10s %12s" % ("mode", "time (s)", "faces", "stray faces"))
+	strays = []
+	for mode in ['CARVE', 'CSG']:
+		(elapsed, faces) = time_build(addon, scene, mode)
+		(mins, _) = get_mesh_bounds(bpy.data.objects["_worldspawn"].data)
+		strays.append(bool(mins[0] < -_room_size))
+		print("%8s %12.2f %10d %12s" % (mode, elapsed, faces, "yes" if strays[-1] else "no"))
+	print("carve and csg agree" if strays[0] == strays[1] else "carve and csg disagree")
+	
+def main():
+	args = sys.argv[sys.argv.index("--") + 1:]
+	(addon_parent_dir, package) = args[:2]
+	sys.path.insert(0, addon_parent_dir)
+	addon = importlib.import_module(package)
+	addon.register()
+	scene = bpy.context.scene
+	if len(args) > 2 and args[2] == "overhead":
+		benchmark_overhead(addon, scene, int(args[3]) if len(args) > 3 else 200)
+		return
+	if len(args) > 2 and args[2] == "unwrap":
+		benchmark_unwrap(addon, scene, int(args[3]) if len(args) > 3 else 7)
+		return
+	if len(args) > 2 and args[2] == "stray":
+		benchmark_stray_brush(addon, scene)
+		return
+	room_counts = [int(a) for a in args[2:]] or [100, 200, 400]
+	print("%8s %12s %10s %12s %10s" % ("rooms", "carve (s)", "faces", "csg (s)", "faces"))
+	for num_rooms in room_counts:
+		clear_scene(scene)
+		generate_map(num_rooms)
+		(carve_time, carve_faces) = time_build(addon, scene, 'CARVE')
+		(csg_time, csg_faces) = time_build(addon, scene, 'CSG')
+		print("%8d %12.2f %10d %12.2f %10d" % (num_rooms, carve_time, carve_faces, csg_time, csg_faces))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,84 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# parallel map builds: union trees are built by a pool of background blender processes running build_worker.py
+# source meshes and results are passed as .npz files of mesh arrays, see mesh_utils.get_mesh_arrays
+
+import bpy, json, os, shutil, subprocess, tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+def save_mesh_arrays(filename, arrays):
+	(positions, loop_vertices, loop_totals, material_indices, uvs, material_names) = arrays
+	data = {
+		"positions": np.asarray(positions, dtype=np.float32),
+		"loop_vertices": np.asarray(loop_vertices, dtype=np.int32),
+		"loop_totals": np.asarray(loop_totals, dtype=np.int32),
+		"material_indices": np.asarray(material_indices, dtype=np.int32),
+		"material_names": np.array([name or "" for name in material_names], dtype=np.str_)
+	}
+	if uvs is not None:
+		data["uvs"] = np.asarray(uvs, dtype=np.float32)
+	np.savez(filename, **data)
+
+def load_mesh_arrays(filename):
+	with np.load(filename) as data:
+		uvs = data["uvs"] if "uvs" in data.files else None
+		material_names = [str(name) or None for name in data["material_names"]]
+		return (data["positions"], data["loop_vertices"], data["loop_totals"], data["material_indices"], uvs, material_names)
+
+def run_worker(job_filename):
+	addon_dir = os.path.dirname(os.path.realpath(__file__))
+	args = [bpy.app.binary_path, "-b", "--factory-startup", "--python", os.path.join(addon_dir, "build_worker.py"), "--", os.path.dirname(addon_dir), __package__, job_filename]
+	subprocess.call(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def build_union_trees(trees, sources, num_workers):
+	"""Build union trees in background blender processes
+	trees: list of (list of leaf object keys, flip normals, cost)
+	sources: object key: mesh arrays of the source mesh, flipped if it should be, for every leaf
+	returns a list of mesh arrays, or None where a tree failed"""
+	temp_dir = tempfile.mkdtemp(prefix="bfg_forge_build_")
+	try:
+		source_filenames = {}
+		for i, (key, arrays) in enumerate(sources.items()):
+			source_filenames[key] = os.path.join(temp_dir, "source%d.npz" % i)
+			save_mesh_arrays(source_filenames[key], arrays)
+
+		# longest processing time first: give the next most expensive tree to the least loaded worker
+		num_workers = max(1, min(num_workers, len(trees)))
+		jobs = [[] for _ in range(num_workers)]
+		loads = [0] * num_workers
+		for i in sorted(range(len(trees)), key=lambda i: -trees[i][2]):
+			w = loads.index(min(loads))
+			(leaves, flip_normals, cost) = trees[i]
+			jobs[w].append({"leaves": leaves, "flip_normals": flip_normals, "sources": [source_filenames[k] for k in leaves], "output": os.path.join(temp_dir, "tree%d.npz" % i)})
+			loads[w] += cost
+		job_filenames = []
+		for w, job in enumerate(jobs):
+			job_filenames.append(os.path.join(temp_dir, "job%d.json" % w))
+			with open(job_filenames[-1], "w") as f:
+				json.dump(job, f)
+		with ThreadPoolExecutor(max_workers=num_workers) as executor:
+			list(executor.map(run_worker, job_filenames))
+
+		results = []
+		for i in range(len(trees)):
+			filename = os.path.join(temp_dir, "tree%d.npz" % i)
+			results.append(load_mesh_arrays(filename) if os.path.exists(filename) else None)
+		return results
+	finally:
+		shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,101 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# per-stage and per-object timing of Build Map
+# stages are e.g. to_mesh, auto_unwrap or boolean. a stage can be charged to one or more objects:
+# boolean time is shared between the objects of a union tree node in proportion to their triangle counts
+
+import json, time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class ObjectProfile:
+	def __init__(self, name, map_name):
+		self.name = name
+		self.map_name = map_name
+		self.triangles = 0
+		self.stages = OrderedDict() # stage name: seconds
+
+	def seconds(self):
+		return sum(self.stages.values())
+
+class BuildProfile:
+	def __init__(self):
+		self.start_time = time.time()
+		self.seconds = 0.0
+		self.stages = OrderedDict() # stage name: [seconds, calls]
+		self.objects = OrderedDict() # object name: ObjectProfile
+		self.maps = OrderedDict() # map name: triangles
+		self.faces = OrderedDict() # map name: (faces before, faces after) merging coplanar faces
+		self.leaks = {} # datablock collection: number leaked, see temp_data
+
+	def get_object(self, name, map_name=None):
+		profile = self.objects.get(name)
+		if not profile:
+			profile = self.objects[name] = ObjectProfile(name, map_name)
+		elif map_name:
+			profile.map_name = map_name
+		return profile
+
+	def add(self, stage, seconds, objects=[]):
+		"""Add time to a stage. objects is a list of (object name, weight)."""
+		totals = self.stages.setdefault(stage, [0.0, 0])
+		totals[0] += seconds
+		totals[1] += 1
+		total_weight = sum([w for (_, w) in objects])
+		for (name, weight) in objects:
+			share = seconds * (weight / total_weight if total_weight > 0 else 1.0 / len(objects))
+			obj = self.get_object(name)
+			obj.stages[stage] = obj.stages.get(stage, 0.0) + share
+
+	@contextmanager
+	def stage(self, stage, objects=[]):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add(stage, time.perf_counter() - start, objects)
+
+	def to_dict(self):
+		return OrderedDict([
+			("date", time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.start_time))),
+			("seconds", self.seconds),
+			("stages", [OrderedDict([("name", name), ("seconds", s), ("calls", calls)]) for (name, (s, calls)) in sorted(self.stages.items(), key=lambda i: -i[1][0])]),
+			("leaks", self.leaks),
+			("maps", [OrderedDict([("name", name), ("triangles", triangles), ("faces", self.faces.get(name))]) for (name, triangles) in self.maps.items()]),
+			("objects", [OrderedDict([("name", o.name), ("map", o.map_name), ("seconds", o.seconds()), ("triangles", o.triangles), ("stages", o.stages)]) for o in sorted(self.objects.values(), key=lambda o: -o.seconds())])
+		])
+
+	def save_json(self, filename):
+		with open(filename, "w") as f:
+			json.dump(self.to_dict(), f, indent="\t")
+
+class NullProfile:
+	# used when a build isn't being profiled
+	def __init__(self):
+		self.faces = {}
+		self.maps = {}
+		
+	@contextmanager
+	def stage(self, stage, objects=[]):
+		yield
+
+	def add(self, stage, seconds, objects=[]):
+		pass
+
+	def get_object(self, name, map_name=None):
+		return ObjectProfile(name, map_name)
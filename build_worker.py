@@ -0,0 +1,43 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# builds union trees in a background blender process, see build_pool.py
+# usage: blender -b --factory-startup --python build_worker.py -- addon_parent_dir addon_package job_file.json
+
+import bpy, importlib, json, sys
+
+def main():
+	args = sys.argv[sys.argv.index("--") + 1:]
+	(addon_parent_dir, package, job_filename) = args
+	sys.path.insert(0, addon_parent_dir)
+	addon = importlib.import_module(package)
+	with open(job_filename) as f:
+		jobs = json.load(f)
+	for job in jobs:
+		try:
+			# the sources go straight into the cache, so the tree never needs the objects they came from
+			cache = addon.core.BuildCache()
+			for (obj_key, filename) in zip(job["leaves"], job["sources"]):
+				mesh = addon.mesh_utils.create_mesh("_build_source", *addon.build_pool.load_mesh_arrays(filename))
+				cache.add_mesh(addon.core.get_source_key(obj_key, job["flip_normals"]), mesh)
+			(_, mesh) = addon.core.get_union_tree_mesh(bpy.context, cache, [(None, k) for k in job["leaves"]], job["flip_normals"])
+			addon.build_pool.save_mesh_arrays(job["output"], addon.mesh_utils.get_mesh_arrays(mesh))
+		except Exception as e:
+			print("Building union tree failed: %s" % e)
+
+if __name__ == "__main__":
+	main()
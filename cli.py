@@ -0,0 +1,110 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# build and export a map from the command line
+# usage: blender -b map.blend --python cli.py -- --output map.json [options]
+# see batch_build.py for building many maps at once
+
+import bpy, argparse, importlib, json, os, sys, time, traceback
+from collections import OrderedDict
+
+def parse_args():
+	parser = argparse.ArgumentParser(prog="blender -b map.blend --python cli.py --", description="Build and export a BFG Forge map")
+	parser.add_argument("--output", required=True, help="exported .json map filename")
+	parser.add_argument("--indent", action="store_true", help="indent the exported map")
+	parser.add_argument("--brushes", action="store_true", help="export the brushes of brush entities as planes when they're all convex")
+	parser.add_argument("--instancing", action="store_true", help="export mesh objects that share a mesh as func_static entities using one copy of the geometry")
+	parser.add_argument("--optimize-vertex-cache", action="store_true", help="reorder exported triangles and vertices for the GPU's vertex cache")
+	parser.add_argument("--export-workers", type=int, default=1, help="encode exported primitives in this many processes")
+	parser.add_argument("--no-export-cache", action="store_true", help="don't reuse the primitives of objects that haven't changed since the last export")
+	parser.add_argument("--decl-cache", help="load material and entity decls from this file. if it doesn't exist, decls are imported from the game path and saved to it.")
+	parser.add_argument("--game-path", help="override the RBDOOM-3-BFG path saved in the .blend")
+	parser.add_argument("--mod-dir", help="override the mod directory saved in the .blend")
+	parser.add_argument("--build-mode", choices=["CARVE", "CSG"], help="override the build mode saved in the .blend")
+	parser.add_argument("--workers", type=int, default=0, help="build with this many background Blender processes")
+	parser.add_argument("--report", help="save the build report to this .json file")
+	parser.add_argument("--result", help="save a summary of this run to this .json file, used by batch_build.py")
+	return parser.parse_args(sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else [])
+
+def import_addon():
+	addon_dir = os.path.dirname(os.path.realpath(__file__))
+	sys.path.insert(0, os.path.dirname(addon_dir))
+	addon = importlib.import_module(os.path.basename(addon_dir))
+	if not hasattr(bpy.types.Scene, "bfg"):
+		addon.register()
+	return addon
+
+def run(args, result):
+	addon = import_addon()
+	core = addon.core
+	context = bpy.context
+	scene = context.scene
+	if args.game_path:
+		scene.bfg.game_path = args.game_path
+	if args.mod_dir:
+		scene.bfg.mod_dir = args.mod_dir
+
+	# decls
+	start_time = time.perf_counter()
+	if args.decl_cache and os.path.exists(args.decl_cache):
+		core.load_decl_cache(scene, args.decl_cache)
+	elif args.decl_cache:
+		if scene.bfg.game_path == "":
+			raise Exception("Decl cache \"%s\" doesn't exist and there's no game path to import decls from" % args.decl_cache)
+		bpy.ops.scene.import_materials()
+		bpy.ops.scene.import_entities()
+		core.save_decl_cache(scene, args.decl_cache)
+	result["decl_seconds"] = time.perf_counter() - start_time
+
+	# build
+	if args.build_mode:
+		scene.bfg.build_mode = args.build_mode
+	if args.workers > 0:
+		scene.bfg.use_parallel_build = True
+		scene.bfg.build_workers = args.workers
+	start_time = time.perf_counter()
+	result["warnings"] = core.build_scene_maps(context)
+	result["build_seconds"] = time.perf_counter() - start_time
+	profile = core.get_last_build_profile()
+	result["triangles"] = sum(profile.maps.values())
+	if args.report:
+		profile.save_json(args.report)
+
+	# export
+	start_time = time.perf_counter()
+	stats = addon.export_map.export_map(context, args.output, args.indent, not args.no_export_cache, args.export_workers, args.brushes, args.optimize_vertex_cache, args.instancing)
+	if args.optimize_vertex_cache:
+		(result["acmr_before"], result["acmr_after"]) = stats.acmr()
+	result["export_seconds"] = time.perf_counter() - start_time
+
+def main():
+	args = parse_args()
+	result = OrderedDict([("blend", bpy.data.filepath), ("output", args.output)])
+	exit_code = 0
+	try:
+		run(args, result)
+	except Exception as e:
+		traceback.print_exc()
+		result["error"] = str(e)
+		exit_code = 1
+	if args.result:
+		with open(args.result, "w") as f:
+			json.dump(result, f, indent="\t")
+	sys.exit(exit_code)
+
+if __name__ == "__main__":
+	main()
@@ -15,8 +15,11 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
 	
-import bpy, bpy.utils.previews, bmesh, glob, math, os, time
-from . import import_md5mesh, lexer
+import bpy, bpy.utils.previews, bmesh, glob, hashlib, json, math, os, time
+import numpy as np
+from . import build_pool, build_profiler, csg, import_dae, import_lwo, import_md5anim, import_md5mesh, lexer, mesh_utils, temp_data, thumbnails
+from bpy_extras.io_utils import ExportHelper
+from collections import OrderedDict
 from mathutils import Vector
 
 # used when creating light and entities, and exporting
@@ -25,6 +28,8 @@ _scale_to_blender = 1.0 / _scale_to_game
 
 _editor_material_paths = ["textures/common", "textures/editor"]
 
+_model_extensions = [".dae", ".lwo", ".md5mesh"]
+
 preview_collections = {}
 				
 ################################################################################
@@ -91,6 +96,22 @@ class FileSystem:
 						touched_files.append(base)
 						found_files.append(f)
 		return found_files
+		
+	def find_files_recursive(self, directory, extensions):
+		"""Return (relative path, full path) for all files in directory and its subdirectories with one of the extensions"""
+		touched_files = []
+		found_files = []
+		for search_dir in self.search_dirs:
+			full_search_path = os.path.join(os.path.realpath(bpy.path.abspath(bpy.context.scene.bfg.game_path)), search_dir)
+			for root, dirs, files in os.walk(os.path.join(full_search_path, directory)):
+				for f in files:
+					if os.path.splitext(f)[1].lower() in extensions:
+						full_path = os.path.join(root, f)
+						relative_path = os.path.relpath(full_path, full_search_path).replace("\\", "/")
+						if not relative_path.lower() in touched_files:
+							touched_files.append(relative_path.lower())
+							found_files.append((relative_path, full_path))
+		return found_files
 						
 ################################################################################
 ## UTILITY FUNCTIONS
@@ -111,10 +132,15 @@ def set_object_mode_and_clear_selection():
 		bpy.ops.object.mode_set(mode='OBJECT')
 	bpy.ops.object.select_all(action='DESELECT')
 	
+def link_object_to_group(obj, group_name):
+	group = bpy.data.groups.get(group_name)
+	if not group:
+		group = bpy.data.groups.new(group_name)
+	if not obj.name in group.objects:
+		group.objects.link(obj)
+	
 def link_active_object_to_group(group):
-	if not group in bpy.data.groups:
-		bpy.ops.group.create(name=group)
-	bpy.ops.object.group_link(group=group)
+	link_object_to_group(bpy.context.active_object, group)
 						
 ################################################################################
 ## MATERIALS
@@ -161,6 +187,14 @@ def material_decl_preview_items(self, context):
 	pcoll.force_refresh = False
 	return pcoll.materials
 					
+def update_material_decl_paths(scene):
+	scene.bfg.material_decl_paths.clear()
+	for decl in scene.bfg.material_decls:
+		name = os.path.dirname(decl.name)
+		if name.startswith("textures") and not name in scene.bfg.material_decl_paths:
+			path = scene.bfg.material_decl_paths.add()
+			path.name = name
+			
 class ImportMaterials(bpy.types.Operator):
 	bl_idname = "scene.import_materials"
 	bl_label = "Import Materials"
@@ -270,14 +304,6 @@ class ImportMaterials(bpy.types.Operator):
 		print(" %d materials" % (num_materials_created + num_materials_updated))
 		return (num_materials_created, num_materials_updated)
 		
-	def update_material_decl_paths(self, scene):
-		scene.bfg.material_decl_paths.clear()
-		for decl in scene.bfg.material_decls:
-			name = os.path.dirname(decl.name)
-			if name.startswith("textures") and not name in scene.bfg.material_decl_paths:
-				path = scene.bfg.material_decl_paths.add()
-				path.name = name
-				
 	@classmethod
 	def poll(cls, context):
 		return context.scene.bfg.game_path != ""
@@ -295,7 +321,7 @@ class ImportMaterials(bpy.types.Operator):
 			wm.progress_update(i)
 			self.num_materials_created += result[0]
 			self.num_materials_updated += result[1]
-		self.update_material_decl_paths(context.scene)
+		update_material_decl_paths(context.scene)
 		preview_collections["light"].needs_refresh = True
 		wm.progress_end()
 		self.report({'INFO'}, "Imported %d materials, updated %d in %.2f seconds" % (self.num_materials_created, self.num_materials_updated, time.time() - start_time))
@@ -490,16 +516,25 @@ class RefreshMaterials(bpy.types.Operator):
 ## MODELS
 ################################################################################
 
+class ModelPathPropGroup(bpy.types.PropertyGroup):
+	pass # name property inherited
+	
+def import_model(filename):
+	"""Import a model file into the scene with the reader matching its extension"""
+	extension = os.path.splitext(filename)[1].lower()
+	if extension == ".dae":
+		import_dae.read_dae(filename)
+	elif extension == ".lwo":
+		import_lwo.read_lwo(filename)
+	elif extension == ".md5mesh":
+		import_md5mesh.read_md5mesh(filename)
+		
 # creates a new object with the specified model either loaded into a new mesh, or linked to an existing mesh
 # the object will be made active and selected
 # return (object, error_message)
 def create_model_object(context, filename, relative_path):
-	# check that the required import addon is enabled
 	extension = os.path.splitext(filename)[1]
-	if extension.lower() == ".lwo":
-		if not hasattr(bpy.types, "IMPORT_SCENE_OT_lwo"):
-			return (None, "LightWave Object (.lwo) import addon not enabled")
-	elif extension.lower() not in [".dae", ".md5mesh"]:
+	if extension.lower() not in _model_extensions:
 		return (None, "Model \"%s\" uses unsupported extension \"%s\"" % (filename, extension))
 	
 	set_object_mode_and_clear_selection()
@@ -508,7 +543,7 @@ def create_model_object(context, filename, relative_path):
 	mesh = None
 	for obj in context.scene.objects:
 		if obj.bfg.entity_model == relative_path:
-			mesh = obj.data
+			mesh = get_model_mesh(obj)
 			break
 	model_obj_name = os.path.splitext(os.path.basename(relative_path))[0]
 	if mesh:
@@ -522,12 +557,10 @@ def create_model_object(context, filename, relative_path):
 		for obj in context.scene.objects:
 			obj_names.append(obj.name)
 		# import
-		if extension.lower() == ".dae":
-			bpy.ops.wm.collada_import(filepath=filename)
-		elif extension.lower() == ".lwo":
-			bpy.ops.import_scene.lwo(filepath=filename, USE_EXISTING_MATERIALS=True)
-		elif extension.lower() == ".md5mesh":
-			import_md5mesh.read_md5mesh(filename)
+		try:
+			import_model(filename)
+		except Exception as e:
+			return (None, "Importing \"%s\" failed: %s" % (filename, e))
 		# diff scene objects
 		# 0: error, 1: fine, >1: join objects
 		imported_objects = []
@@ -554,19 +587,11 @@ def create_model_object(context, filename, relative_path):
 		obj = context.scene.objects.active
 		# fixup material names
 		for i, mat in enumerate(obj.data.materials):
+			# .dae and .lwo material names are already fixed up by the reader
 			(name, ext) = os.path.splitext(mat.name)
-			fix_material = False
-			if extension.lower() == ".dae":
-				# fix collada mangling
-				name = name.replace("_", "/")
-				if name.endswith("-material"):
-					name = name[:-len("-material")]
-				fix_material = True
 			if ext != "":
 				# remove filename extensions
 				# e.g. "models/items/rocket_ammo/rocket_large.tga" should be "models/items/rocket_ammo/rocket_large"
-				fix_material = True
-			if fix_material:
 				# if a material with the fixed name already exists, use it
 				# otherwise rename this one
 				new_mat = bpy.data.materials.get(name)
@@ -580,7 +605,121 @@ def create_model_object(context, filename, relative_path):
 	obj.lock_scale = [True, True, True]
 	refresh_selected_objects_materials(context)
 	bpy.ops.object.shade_smooth()
+	update_model_proxy(context, obj)
 	return (obj, None)
+	
+################################################################################
+## MODEL PROXIES
+################################################################################
+
+# heavy models are displayed with a decimated copy of their mesh
+# the original mesh is kept with a fake user and its name is stored in obj.bfg.model_mesh
+# proxies are cached per model path and triangle budget, export only cares about obj.bfg.entity_model
+# objects can override the scene's triangle budget
+
+_model_proxies = None # (model path, triangle budget): proxy mesh name, None until the proxy meshes are indexed
+
+def count_mesh_triangles(mesh):
+	loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+	mesh.polygons.foreach_get("loop_total", loop_totals)
+	return int((loop_totals - 2).sum())
+	
+def get_model_mesh(obj):
+	"""Return the original mesh of a model object, even if a proxy is being displayed"""
+	if obj.bfg.model_mesh != "":
+		mesh = bpy.data.meshes.get(obj.bfg.model_mesh)
+		if mesh:
+			return mesh
+	return obj.data
+	
+def index_model_proxies():
+	global _model_proxies
+	_model_proxies = {}
+	for mesh in bpy.data.meshes:
+		relative_path = mesh.get("bfg_proxy_model")
+		if relative_path != None:
+			_model_proxies[(relative_path, mesh.get("bfg_proxy_budget"))] = mesh.name
+	
+def find_model_proxy(relative_path, triangle_budget):
+	if _model_proxies == None:
+		index_model_proxies()
+	key = (relative_path, triangle_budget)
+	name = _model_proxies.get(key)
+	if not name:
+		return None
+	mesh = bpy.data.meshes.get(name)
+	if not mesh or mesh.get("bfg_proxy_model") != relative_path or mesh.get("bfg_proxy_budget") != triangle_budget:
+		# renamed, removed or a different .blend was loaded
+		index_model_proxies()
+		name = _model_proxies.get(key)
+		mesh = bpy.data.meshes.get(name) if name else None
+	return mesh
+	
+def get_proxy_triangle_budget(context, obj):
+	if obj.bfg.proxy_triangle_budget > 0:
+		return obj.bfg.proxy_triangle_budget
+	return context.scene.bfg.proxy_triangle_budget
+	
+def create_model_proxy(context, mesh, relative_path, triangle_budget):
+	"""Create a decimated copy of mesh. Returns None if the mesh already fits in the budget."""
+	num_triangles = count_mesh_triangles(mesh)
+	if num_triangles <= triangle_budget:
+		return None
+	temp_obj = bpy.data.objects.new("_proxy", mesh)
+	mod = temp_obj.modifiers.new(name="decimate", type='DECIMATE')
+	mod.ratio = triangle_budget / num_triangles
+	proxy = temp_obj.to_mesh(context.scene, True, 'PREVIEW')
+	bpy.data.objects.remove(temp_obj)
+	proxy.name = mesh.name + "_proxy"
+	proxy["bfg_proxy_model"] = relative_path
+	proxy["bfg_proxy_budget"] = triangle_budget
+	if _model_proxies != None:
+		_model_proxies[(relative_path, triangle_budget)] = proxy.name
+	return proxy
+	
+def restore_model_mesh(obj):
+	if obj.bfg.model_mesh == "":
+		return
+	mesh = bpy.data.meshes.get(obj.bfg.model_mesh)
+	obj.bfg.model_mesh = ""
+	if not mesh:
+		return
+	obj.data = mesh
+	# only keep the fake user if other objects are still displaying a proxy of this mesh
+	for other in bpy.data.objects:
+		if other.bfg.model_mesh == mesh.name:
+			return
+	mesh.use_fake_user = False
+	
+def update_model_proxy(context, obj):
+	"""Swap between the original and proxy mesh of a model object, depending on the scene settings"""
+	if obj.type != 'MESH' or obj.bfg.entity_model == "":
+		return
+	bfg = context.scene.bfg
+	if not bfg.use_model_proxies:
+		restore_model_mesh(obj)
+		return
+	mesh = get_model_mesh(obj)
+	triangle_budget = get_proxy_triangle_budget(context, obj)
+	proxy = find_model_proxy(obj.bfg.entity_model, triangle_budget)
+	if not proxy:
+		proxy = create_model_proxy(context, mesh, obj.bfg.entity_model, triangle_budget)
+	if not proxy:
+		restore_model_mesh(obj) # fits in the budget, no proxy required
+		return
+	if obj.data != proxy:
+		mesh.use_fake_user = True
+		obj.bfg.model_mesh = mesh.name
+		obj.data = proxy
+		
+def update_model_proxies(self, context):
+	index_model_proxies()
+	for obj in context.scene.objects:
+		update_model_proxy(context, obj)
+		
+def update_object_model_proxy(self, context):
+	# self is the object's BfgObjectPropertyGroup
+	update_model_proxy(context, self.id_data)
 		
 ################################################################################
 ## ENTITIES
@@ -742,10 +881,11 @@ def update_scene_entity_properties(context):
 	"""Add missing properties to existing entity objects"""
 	for obj in context.scene.objects:
 		if obj.bfg.type in ['BRUSH_ENTITY', 'ENTITY']:
-			context.scene.objects.active = obj
-			entity = context.scene.bfg.entities[obj.bfg.classname]
-			create_object_entity_properties(context, entity)
-			break
+			entity = context.scene.bfg.entities.get(obj.bfg.classname)
+			if entity: # imported maps can have entities without a def
+				context.scene.objects.active = obj
+				create_object_entity_properties(context, entity)
+				break
 
 class AddEntity(bpy.types.Operator):
 	"""Add a new entity to the scene of the selected type"""
@@ -850,6 +990,41 @@ class AddEntity(bpy.types.Operator):
 						assign_material(s, mat)
 		return {'FINISHED'}
 		
+class PreviewEntityAnimation(bpy.types.Operator):
+	"""Browse for an md5anim to preview on the selected md5mesh entity"""
+	bl_idname = "object.preview_entity_animation"
+	bl_label = "Preview Animation"
+	filepath = bpy.props.StringProperty(default="", options={'HIDDEN', 'SKIP_SAVE'})
+	filter_glob = bpy.props.StringProperty(default="*.md5anim", options={'HIDDEN'})
+	
+	@classmethod
+	def poll(cls, context):
+		obj = context.active_object
+		return obj and obj.bfg.type == 'ENTITY' and obj.bfg.entity_model.lower().endswith(".md5mesh")
+		
+	def execute(self, context):
+		obj = context.active_object
+		mesh_filename = FileSystem().find_file_path(obj.bfg.entity_model)
+		if not mesh_filename:
+			self.report({'ERROR'}, "Model %s not found" % obj.bfg.entity_model)
+			return {'CANCELLED'}
+		start_time = time.time()
+		try:
+			action = import_md5anim.apply_md5anim(context, obj, mesh_filename, self.properties.filepath)
+		except Exception as e:
+			self.report({'ERROR'}, "Importing \"%s\" failed: %s" % (self.properties.filepath, e))
+			return {'CANCELLED'}
+		self.report({'INFO'}, "Imported animation %s in %.2f seconds" % (action.name, time.time() - start_time))
+		return {'FINISHED'}
+		
+	def invoke(self, context, event):
+		# start browsing in the model directory, that's usually where the animations are
+		mesh_filename = FileSystem().find_file_path(context.active_object.bfg.entity_model)
+		if mesh_filename:
+			self.properties.filepath = os.path.dirname(mesh_filename) + os.sep
+		context.window_manager.fileselect_add(self)
+		return {'RUNNING_MODAL'}
+		
 class ShowEntityDescription(bpy.types.Operator):
 	"""Show entity description"""
 	bl_idname = "object.show_entity_description"
@@ -987,6 +1162,56 @@ class RemoveCustomEntityProperty(bpy.types.Operator):
 			context.scene.objects.active = old_active
 		return {'FINISHED'}
 		
+################################################################################
+## DECL CACHE
+################################################################################
+
+# imported material decls, entity defs and model defs can be saved to a JSON file
+# so batch builds don't have to parse the game's decl files for every map
+
+_decl_cache_version = 1
+
+def save_decl_cache(scene, filename):
+	bfg = scene.bfg
+	data = OrderedDict()
+	data["version"] = _decl_cache_version
+	data["materials"] = [OrderedDict([("name", d.name), ("diffuse_texture", d.diffuse_texture), ("editor_texture", d.editor_texture), ("heightmap_scale", d.heightmap_scale), ("normal_texture", d.normal_texture), ("specular_texture", d.specular_texture), ("texture", d.texture)]) for d in bfg.material_decls]
+	data["entities"] = [OrderedDict([("name", e.name), ("dict", OrderedDict([(kvp.name, kvp.value) for kvp in e.dict]))]) for e in bfg.entities]
+	data["model_defs"] = [OrderedDict([("name", m.name), ("inherit", m.inherit), ("mesh", m.mesh)]) for m in bfg.model_defs]
+	with open(filename, "w") as f:
+		json.dump(data, f)
+		
+def load_decl_cache(scene, filename):
+	"""Replace the scene's decls with the contents of a decl cache file"""
+	with open(filename, "r") as f:
+		data = json.load(f)
+	if data.get("version") != _decl_cache_version:
+		raise Exception("Decl cache \"%s\" has version %s, expected %d" % (filename, data.get("version"), _decl_cache_version))
+	bfg = scene.bfg
+	bfg.material_decls.clear()
+	for d in data["materials"]:
+		decl = bfg.material_decls.add()
+		for (key, value) in d.items():
+			setattr(decl, key, value)
+	update_material_decl_paths(scene)
+	bfg.entities.clear()
+	for e in data["entities"]:
+		entity = bfg.entities.add()
+		entity.name = e["name"]
+		for (key, value) in e["dict"].items():
+			kvp = entity.dict.add()
+			kvp.name = key
+			kvp.value = value
+	bfg.model_defs.clear()
+	for m in data["model_defs"]:
+		model_def = bfg.model_defs.add()
+		for (key, value) in m.items():
+			setattr(model_def, key, value)
+	if "material" in preview_collections: # not registered when running from the command line
+		preview_collections["material"].force_refresh = True
+		preview_collections["light"].needs_refresh = True
+	return (len(bfg.material_decls), len(bfg.entities))
+	
 ################################################################################
 ## LIGHTS
 ################################################################################
@@ -1049,6 +1274,16 @@ def light_material_preview_items(self, context):
 ## STATIC MODELS
 ################################################################################
 		
+def add_static_model(context, filename, relative_path):
+	"""Create a func_static from a model file. Returns an error message on failure."""
+	(obj, error_message) = create_model_object(context, filename, relative_path)
+	if error_message:
+		return error_message
+	obj.bfg.type = 'STATIC_MODEL'
+	obj.bfg.classname = "func_static"
+	link_active_object_to_group("static models")
+	return None
+		
 class AddStaticModel(bpy.types.Operator):
 	"""Browse for a static model to add"""
 	bl_idname = "scene.add_static_model"
@@ -1069,19 +1304,240 @@ class AddStaticModel(bpy.types.Operator):
 		if not relative_path:
 			self.report({'ERROR'}, "File \"%s\" not found. Path must descend from \"%s\"" % (self.properties.filepath, context.scene.bfg.game_path))
 			return {'CANCELLED'}
-		(obj, error_message) = create_model_object(context, self.properties.filepath, relative_path)
+		error_message = add_static_model(context, self.properties.filepath, relative_path)
 		if error_message:
 			self.report({'ERROR'}, error_message)
 			return {'CANCELLED'}
-		else:
-			obj.bfg.type = 'STATIC_MODEL'
-			obj.bfg.classname = "func_static"
-			link_active_object_to_group("static models")
 		return {'FINISHED'}
 
 	def invoke(self, context, event):
 		context.window_manager.fileselect_add(self)
 		return {'RUNNING_MODAL'}
+		
+class AddBrowserModel(bpy.types.Operator):
+	"""Add the model selected in the model browser as a static model"""
+	bl_idname = "scene.add_browser_model"
+	bl_label = "Add"
+	
+	@classmethod
+	def poll(cls, context):
+		return context.scene.bfg.active_model in context.scene.bfg.models
+	
+	def execute(self, context):
+		relative_path = context.scene.bfg.active_model
+		filename = FileSystem().find_file_path(relative_path)
+		if not filename:
+			self.report({'ERROR'}, "Model %s not found" % relative_path)
+			return {'CANCELLED'}
+		error_message = add_static_model(context, filename, relative_path)
+		if error_message:
+			self.report({'ERROR'}, error_message)
+			return {'CANCELLED'}
+		return {'FINISHED'}
+		
+class ScanModels(bpy.types.Operator):
+	"""Find all models and render thumbnails for any that aren't cached"""
+	bl_idname = "scene.scan_models"
+	bl_label = "Scan Models"
+	
+	@classmethod
+	def poll(cls, context):
+		return context.scene.bfg.game_path != ""
+		
+	def execute(self, context):
+		start_time = time.time()
+		bfg = context.scene.bfg
+		models = FileSystem().find_files_recursive("models", _model_extensions)
+		bfg.models.clear()
+		bfg.model_paths.clear()
+		for (relative_path, full_path) in models:
+			bfg.models.add().name = relative_path
+			path = os.path.dirname(relative_path)
+			if not path in bfg.model_paths:
+				bfg.model_paths.add().name = path
+		wm = context.window_manager
+		wm.progress_begin(0, 100)
+		num_rendered = thumbnails.render_thumbnails([m[1] for m in models], bfg.thumbnail_workers, lambda i, n: wm.progress_update(int(i * 100 / n)))
+		wm.progress_end()
+		preview_collections["model"].force_refresh = True
+		self.report({'INFO'}, "Found %d models, rendered %d thumbnails in %.2f seconds" % (len(models), num_rendered, time.time() - start_time))
+		return {'FINISHED'}
+		
+def model_preview_items(self, context):
+	models = []
+	pcoll = preview_collections["model"]
+	if pcoll.current_model_path == context.scene.bfg.active_model_path and not pcoll.force_refresh:
+		return pcoll.models
+	fs = FileSystem()
+	for model in context.scene.bfg.models:
+		if os.path.dirname(model.name) != context.scene.bfg.active_model_path:
+			continue
+		preview = None
+		if model.name in pcoll: # workaround blender bug, pcoll.load is supposed to return cached preview if name already exists
+			preview = pcoll[model.name]
+		else:
+			filename = fs.find_file_path(model.name)
+			if filename:
+				# only read the cache, thumbnails are rendered by ScanModels
+				thumbnail = thumbnails.get_thumbnail_path(filename)
+				if os.path.exists(thumbnail):
+					preview = pcoll.load(model.name, thumbnail, 'IMAGE')
+		models.append((model.name, os.path.basename(model.name), model.name, preview.icon_id if preview else 0, len(models)))
+	models.sort()
+	pcoll.models = models
+	pcoll.current_model_path = context.scene.bfg.active_model_path
+	pcoll.force_refresh = False
+	return pcoll.models
+	
+################################################################################
+## MAP BUILD CACHE
+################################################################################
+
+# build_map caches per map (worldspawn or brush entity):
+# -each room/brush's world space source mesh, keyed by a fingerprint of everything that affects it
+# -every node of the union trees (see MAP), keyed by the keys of its children
+# editing a room or brush only invalidates the nodes on its path to the root of its cluster's tree
+
+_build_caches = {}
+_last_build_profile = None
+
+class BuildCache:
+	def __init__(self):
+		self.meshes = {} # key: mesh name
+		self.touched = set() # keys used by the current build
+		self.profile = build_profiler.NullProfile()
+		
+	def get_mesh(self, key):
+		name = self.meshes.get(key)
+		mesh = bpy.data.meshes.get(name) if name else None
+		if mesh and mesh.get("bfg_build_key") == key:
+			self.touched.add(key)
+			return mesh
+		return None
+		
+	def add_mesh(self, key, mesh):
+		temp_data.keep(mesh)
+		mesh["bfg_build_key"] = key
+		self.meshes[key] = mesh.name
+		self.touched.add(key)
+		
+	def begin(self):
+		self.touched = set()
+		
+	def end(self):
+		# free anything the build didn't use
+		for key in list(self.meshes.keys()):
+			if not key in self.touched:
+				mesh = self.get_mesh(key)
+				if mesh and mesh.users == 0:
+					bpy.data.meshes.remove(mesh)
+				del self.meshes[key]
+				
+def get_build_cache(map_name):
+	cache = _build_caches.get(map_name)
+	if not cache:
+		cache = _build_caches[map_name] = BuildCache()
+	return cache
+	
+def free_build_caches(keep_map_names=[]):
+	for map_name in list(_build_caches.keys()):
+		if not map_name in keep_map_names:
+			cache = _build_caches.pop(map_name)
+			cache.begin()
+			cache.end()
+	
+def hash_collection(h, collection, attr, count, dtype):
+	values = np.empty(count, dtype=dtype)
+	if count > 0:
+		collection.foreach_get(attr, values)
+	h.update(values.tobytes())
+	return values
+	
+def hash_rna_properties(h, data):
+	# hash the simple properties of e.g. a modifier
+	for prop in data.bl_rna.properties:
+		if prop.identifier == "rna_type":
+			continue
+		value = getattr(data, prop.identifier, None)
+		if prop.type == 'POINTER':
+			value = value.name if value and hasattr(value, "name") else None
+		elif prop.type == 'COLLECTION':
+			continue
+		elif hasattr(value, "__len__") and not isinstance(value, str):
+			value = tuple(value)
+		h.update(repr((prop.identifier, value)).encode("utf-8"))
+		
+def get_material_texture_size(mat):
+	# used by auto_unwrap: the size of the first texture slot's image, or 128x128
+	if mat and len(mat.texture_slots) > 0 and mat.texture_slots[0]:
+		tex = bpy.data.textures.get(mat.texture_slots[0].name)
+		if tex and hasattr(tex, "image") and tex.image: # if the texture type isn't set to "Image or Movie", the image attribute won't exist
+			return tuple(tex.image.size)
+	return (128, 128)
+		
+def is_auto_unwrapped(obj):
+	return obj.bfg.type == '2D_ROOM' or (obj.bfg.type in ['3D_ROOM', 'BRUSH'] and obj.bfg.auto_unwrap)
+	
+def get_object_fingerprint(context, obj):
+	"""Hash everything that affects the build_map source mesh of a room or brush"""
+	h = hashlib.sha1()
+	bfg = obj.bfg
+	h.update(repr((obj.type, bfg.type, bfg.auto_unwrap, bfg.room_height, bfg.floor_material, bfg.wall_material, bfg.ceiling_material)).encode("utf-8"))
+	h.update(repr((tuple(obj.location), tuple(obj.scale), [tuple(row) for row in obj.matrix_world])).encode("utf-8"))
+	for mod in obj.modifiers:
+		hash_rna_properties(h, mod)
+	mesh = obj.data
+	for mat in mesh.materials:
+		h.update(repr((mat.name if mat else None, get_material_texture_size(mat))).encode("utf-8"))
+	h.update(repr(context.scene.bfg.global_uv_scale).encode("utf-8"))
+	hash_collection(h, mesh.vertices, "co", len(mesh.vertices) * 3, np.float32)
+	hash_collection(h, mesh.loops, "vertex_index", len(mesh.loops), np.int32)
+	hash_collection(h, mesh.polygons, "loop_total", len(mesh.polygons), np.int32)
+	hash_collection(h, mesh.polygons, "material_index", len(mesh.polygons), np.int32)
+	hash_collection(h, mesh.polygons, "use_smooth", len(mesh.polygons), np.bool_)
+	if len(mesh.uv_layers) > 0:
+		uv_data = mesh.uv_layers[0].data
+		if is_auto_unwrapped(obj):
+			# UVs are overwritten by auto_unwrap, except pinned ones
+			pins = hash_collection(h, uv_data, "pin_uv", len(uv_data), np.bool_)
+			uvs = np.empty(len(uv_data) * 2, dtype=np.float32)
+			if len(uvs) > 0:
+				uv_data.foreach_get("uv", uvs)
+			h.update(uvs.reshape(-1, 2)[pins].tobytes())
+		else:
+			hash_collection(h, uv_data, "uv", len(uv_data) * 2, np.float32)
+	return h.hexdigest()
+	
+def create_source_mesh(context, obj, flip_normals, profile=None):
+	"""Create the world space mesh of a room or brush that build_map combines"""
+	if profile is None:
+		profile = build_profiler.NullProfile()
+	profile_objects = [(obj.name, 1)]
+	
+	# auto unwrap this 3D room or brush if that's what the user wants
+	if obj.bfg.type in ['3D_ROOM', 'BRUSH'] and obj.bfg.auto_unwrap:
+		with profile.stage("auto_unwrap", profile_objects):
+			auto_unwrap(obj.data, obj.location, obj.scale)
+		
+	# generate mesh for the source object
+	# transform to worldspace
+	with profile.stage("to_mesh", profile_objects):
+		mesh = obj.to_mesh(context.scene, True, 'PREVIEW')
+		mesh.transform(obj.matrix_world)
+	
+	# 2D rooms are always unwrapped (the to_mesh result, not the object - it's just a plane)
+	if obj.bfg.type == '2D_ROOM':
+		with profile.stage("auto_unwrap", profile_objects):
+			auto_unwrap(mesh)
+		
+	if flip_normals:
+		with profile.stage("flip_normals", profile_objects):
+			flip_mesh_normals(mesh)
+	mesh.name = "_build_source"
+	return mesh
+	
+def combine_keys(op, keys):
+	return hashlib.sha1((op + "|" + "|".join(keys)).encode("utf-8")).hexdigest()
 	
 ################################################################################
 ## MAP
@@ -1117,47 +1573,71 @@ def flip_mesh_normals(mesh):
 	bm.to_mesh(mesh)
 	bm.free()
 	
-def apply_boolean(dest, src, bool_op, flip_normals=False):
-	# auto unwrap this 3D room or brush if that's what the user wants
-	if src.bfg.type in ['3D_ROOM', 'BRUSH'] and src.bfg.auto_unwrap:
-		auto_unwrap(src.data, src.location, src.scale)
+def boolean_meshes(scene, mesh, other, bool_op):
+	"""Return a new mesh: the result of a boolean operation on two meshes, which are left untouched"""
+	with temp_data.TempData("boolean", check_leaks=False) as temp:
+		# temp objects to hold the meshes, linked so the modifier can be evaluated
+		dest = temp.track(bpy.data.objects.new("_bool_dest", temp.track(mesh.copy())))
+		ob_bool = temp.track(bpy.data.objects.new("_bool", other))
+		scene.objects.link(dest)
+		scene.objects.link(ob_bool)
 		
-	# generate mesh for the source object
-	# transform to worldspace
-	bpy.ops.object.select_all(action='DESELECT')
-	dest.select = True
-	me = src.to_mesh(bpy.context.scene, True, 'PREVIEW')
-	me.transform(src.matrix_world)
-	
-	# 2D rooms are always unwrapped (the to_mesh result, not the object - it's just a plane)
-	if src.bfg.type == '2D_ROOM':
-		auto_unwrap(me)
+		# copy materials
+		for mat in other.materials:
+			if mat and not mat.name in dest.data.materials:
+				dest.data.materials.append(mat)
 		
-	if flip_normals:
-		flip_mesh_normals(me)
-		
-	# bool object - need a temp object to hold the result of to_mesh
-	ob_bool = bpy.data.objects.new("_bool", me)
-	
-	# copy materials
-	for mat in src.data.materials:
-		if not mat.name in dest.data.materials:
-			dest.data.materials.append(mat)	
-	
-	# apply the boolean modifier
-	mod = dest.modifiers.new(name=src.name, type='BOOLEAN')
-	mod.object = ob_bool
-	mod.operation = bool_op
-	mod.solver = 'CARVE'
-	bpy.ops.object.modifier_apply(apply_as='DATA', modifier=src.name)
+		# evaluate the boolean modifier
+		mod = dest.modifiers.new(name="_bool", type='BOOLEAN')
+		mod.object = ob_bool
+		mod.operation = bool_op
+		mod.solver = 'CARVE'
+		return dest.to_mesh(scene, True, 'PREVIEW')
 
 def flip_object_normals(obj):
-	bpy.ops.object.select_all(action='DESELECT')
-	obj.select = True
-	bpy.ops.object.editmode_toggle()
-	bpy.ops.mesh.select_all(action='SELECT')
-	bpy.ops.mesh.flip_normals()
-	bpy.ops.object.editmode_toggle()
+	flip_mesh_normals(obj.data)
+	
+_optimize_angle_limit = math.radians(0.01) # faces this close to coplanar are merged
+_optimize_distance = 1e-5 # edges shorter than this are degenerate
+_optimize_uv_distance = 1e-5
+	
+def is_uv_seam(edge, uv_layer):
+	# a manifold edge whose two faces don't share UVs at its vertices
+	if len(edge.link_loops) != 2:
+		return False
+	(l1, l2) = edge.link_loops
+	uv1 = (l1[uv_layer].uv, l1.link_loop_next[uv_layer].uv)
+	if l2.vert == l1.vert:
+		uv2 = (l2[uv_layer].uv, l2.link_loop_next[uv_layer].uv)
+	else:
+		uv2 = (l2.link_loop_next[uv_layer].uv, l2[uv_layer].uv)
+	return (uv1[0] - uv2[0]).length_squared > _optimize_uv_distance ** 2 or (uv1[1] - uv2[1]).length_squared > _optimize_uv_distance ** 2
+	
+def optimize_map_mesh(mesh):
+	"""Merge adjacent coplanar faces that share a material and have continuous UVs, and remove degenerate faces and collinear vertices.
+	Vertices joining more than two edges are left alone, so T-junctions aren't opened into cracks.
+	Returns the number of faces before and after."""
+	bm = bmesh.new()
+	bm.from_mesh(mesh)
+	num_faces = len(bm.faces)
+	bmesh.ops.dissolve_degenerate(bm, dist=_optimize_distance, edges=bm.edges[:])
+	
+	# dissolve_limit can't tell UV discontinuities apart, mark them as seams so they're delimited
+	seams = []
+	uv_layer = bm.loops.layers.uv.active
+	if uv_layer:
+		for e in bm.edges:
+			if not e.seam and is_uv_seam(e, uv_layer):
+				e.seam = True
+				seams.append(e)
+	bmesh.ops.dissolve_limit(bm, angle_limit=_optimize_angle_limit, use_dissolve_boundaries=False, verts=bm.verts[:], edges=bm.edges[:], delimit={'MATERIAL', 'SEAM'})
+	for e in seams:
+		if e.is_valid:
+			e.seam = False
+	result = (num_faces, len(bm.faces))
+	bm.to_mesh(mesh)
+	bm.free()
+	return result
 	
 def move_object_to_layer(obj, layer_number):
 	layers = 20 * [False]
@@ -1178,71 +1658,304 @@ def add_all_materials(obj):
 			obj.data.materials.append(m)
 		i += 1
 		
-def build_map(context, rooms, brushes, map_name):
+def get_mesh_bounds(mesh):
+	co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+	mesh.vertices.foreach_get("co", co)
+	co = co.reshape(-1, 3)
+	if len(co) == 0:
+		return (np.zeros(3), np.zeros(3))
+	return (co.min(axis=0), co.max(axis=0))
+	
+def cluster_bounds(mins, maxs):
+	"""Group overlapping or touching bounding boxes, sweep and prune along x. Returns lists of indices."""
+	epsilon = 1e-4
+	parents = list(range(len(mins)))
+	def find(i):
+		while parents[i] != i:
+			parents[i] = parents[parents[i]]
+			i = parents[i]
+		return i
+	order = np.argsort(mins[:, 0], kind='mergesort')
+	sorted_mins = mins[order]
+	sorted_maxs = maxs[order]
+	for i in range(len(order)):
+		# candidates start before this box ends on x
+		end = np.searchsorted(sorted_mins[:, 0], sorted_maxs[i, 0] + epsilon, side='right')
+		if end <= i + 1:
+			continue
+		overlap = ((sorted_mins[i + 1:end] <= sorted_maxs[i] + epsilon) & (sorted_maxs[i + 1:end] >= sorted_mins[i] - epsilon)).all(axis=1)
+		for j in np.nonzero(overlap)[0]:
+			(a, b) = (find(order[i]), find(order[i + 1 + j]))
+			if a != b:
+				parents[max(a, b)] = min(a, b)
+	clusters = {}
+	for i in range(len(mins)):
+		clusters.setdefault(find(i), []).append(i)
+	return [clusters[root] for root in sorted(clusters.keys())]
+	
+def spatial_order(centers, indices):
+	"""Sort indices so that neighbours in the list are neighbours in space: recursive median split on the longest axis"""
+	if len(indices) <= 2:
+		return list(indices)
+	points = centers[indices]
+	axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+	indices = [indices[i] for i in np.argsort(points[:, axis], kind='mergesort')]
+	half = len(indices) // 2
+	return spatial_order(centers, indices[:half]) + spatial_order(centers, indices[half:])
+	
+def get_source_key(obj_key, flip_normals):
+	return obj_key + ("_flipped" if flip_normals else "")
+	
+def get_source_mesh(context, cache, obj, obj_key, flip_normals):
+	key = get_source_key(obj_key, flip_normals)
+	mesh = cache.get_mesh(key)
+	if not mesh:
+		mesh = create_source_mesh(context, obj, flip_normals, cache.profile)
+		cache.add_mesh(key, mesh)
+	return mesh
+	
+def get_profile_objects(cache, leaves):
+	# boolean time is charged to the objects in proportion to their triangle counts
+	return [(obj.name, cache.profile.get_object(obj.name).triangles) for (obj, _) in leaves if obj]
+	
+def get_union_tree_key(leaves, flip_normals):
+	if len(leaves) == 1:
+		return get_source_key(leaves[0][1], flip_normals)
+	half = len(leaves) // 2
+	return combine_keys("UNION", [get_union_tree_key(leaves[:half], flip_normals), get_union_tree_key(leaves[half:], flip_normals)])
+	
+def touch_union_tree(cache, leaves, flip_normals):
+	# keep the nodes below a cached node alive, they're needed when one of the leaves changes
+	cache.get_mesh(get_union_tree_key(leaves, flip_normals))
+	if len(leaves) > 1:
+		half = len(leaves) // 2
+		touch_union_tree(cache, leaves[:half], flip_normals)
+		touch_union_tree(cache, leaves[half:], flip_normals)
+	
+def get_union_tree_mesh(context, cache, leaves, flip_normals):
+	"""Union the source meshes of leaves, a list of (obj, obj_key), in a balanced tree. Returns (key, mesh)."""
+	if len(leaves) == 1:
+		(obj, obj_key) = leaves[0]
+		return (get_source_key(obj_key, flip_normals), get_source_mesh(context, cache, obj, obj_key, flip_normals))
+	key = get_union_tree_key(leaves, flip_normals)
+	mesh = cache.get_mesh(key)
+	if mesh:
+		touch_union_tree(cache, leaves, flip_normals)
+	else:
+		half = len(leaves) // 2
+		(_, left) = get_union_tree_mesh(context, cache, leaves[:half], flip_normals)
+		(_, right) = get_union_tree_mesh(context, cache, leaves[half:], flip_normals)
+		with cache.profile.stage("boolean", get_profile_objects(cache, leaves)):
+			mesh = boolean_meshes(context.scene, left, right, 'UNION')
+		mesh.name = "_build_node"
+		cache.add_mesh(key, mesh)
+	return (key, mesh)
+	
+def get_cluster_mesh(context, cache, rooms, brushes):
+	"""Rooms are unioned with their normals flipped, then the result is flipped back and brushes are unioned. Returns (key, mesh)."""
+	if len(rooms) > 0:
+		(rooms_key, rooms_mesh) = get_union_tree_mesh(context, cache, rooms, True)
+		key = combine_keys("FLIP", [rooms_key])
+		mesh = cache.get_mesh(key)
+		if not mesh:
+			with cache.profile.stage("flip_normals", get_profile_objects(cache, rooms)):
+				mesh = rooms_mesh.copy()
+				mesh.name = "_build_node"
+				flip_mesh_normals(mesh)
+			cache.add_mesh(key, mesh)
+		if len(brushes) == 0:
+			return (key, mesh)
+	# brushes are unioned with each other first, union is associative
+	(brushes_key, brushes_mesh) = get_union_tree_mesh(context, cache, brushes, False)
+	if len(rooms) == 0:
+		return (brushes_key, brushes_mesh)
+	rooms_key = key
+	rooms_mesh = mesh
+	key = combine_keys("UNION", [rooms_key, brushes_key])
+	mesh = cache.get_mesh(key)
+	if not mesh:
+		with cache.profile.stage("boolean", get_profile_objects(cache, rooms + brushes)):
+			mesh = boolean_meshes(context.scene, rooms_mesh, brushes_mesh, 'UNION')
+		mesh.name = "_build_node"
+		cache.add_mesh(key, mesh)
+	return (key, mesh)
+	
+class MapBuild:
+	def __init__(self, map_name):
+		self.map_name = map_name
+		self.cache = get_build_cache(map_name)
+		self.clusters = [] # (rooms, brushes), lists of (obj, obj_key) in spatial order
+		self.mesh = None # set by the CSG build mode
+		self.warning = None
+		
+def prepare_map_build(context, rooms, brushes, map_name, profile=None):
+	"""The first half of build_map: everything but the booleans"""
+	if profile is None:
+		profile = build_profiler.NullProfile() # not shared, finish_map_build writes to it
+	build = MapBuild(map_name)
+	cache = build.cache
+	cache.begin()
+	cache.profile = profile
+	
+	# fingerprint the inputs, source meshes are cached by fingerprint
+	def fingerprint(obj):
+		with profile.stage("fingerprint", [(obj.name, 1)]):
+			return (obj, get_object_fingerprint(context, obj))
+	rooms = [fingerprint(obj) for obj in rooms]
+	brushes = [fingerprint(obj) for obj in brushes]
+	leaves = rooms + brushes
+	bounds = []
+	for i, (obj, obj_key) in enumerate(leaves):
+		mesh = get_source_mesh(context, cache, obj, obj_key, i < len(rooms))
+		profile.get_object(obj.name, map_name).triangles = count_mesh_triangles(mesh)
+		bounds.append(get_mesh_bounds(mesh))
+	
+	if context.scene.bfg.build_mode == 'CSG' and len(leaves) > 0:
+		# the CSG build mode does everything in one go. it can only handle convex rooms and brushes, otherwise fall back to Carve.
+		key = combine_keys("CSG", [get_source_key(k, True) for (_, k) in rooms] + [k for (_, k) in brushes])
+		with profile.stage("csg", get_profile_objects(cache, leaves)):
+			build.mesh = build_csg_mesh(context, cache, rooms, brushes, key)
+		if build.mesh:
+			return build
+		build.warning = "\"%s\" has non-convex rooms or brushes, built with Carve instead of CSG" % map_name
+	if len(leaves) > 0:
+		# group overlapping rooms and brushes. clusters don't affect each other, so they're built independently and concatenated.
+		# within a cluster, union in a balanced tree of spatial neighbours: each boolean works on meshes of similar size
+		mins = np.array([b[0] for b in bounds])
+		maxs = np.array([b[1] for b in bounds])
+		centers = (mins + maxs) * 0.5
+		for cluster in cluster_bounds(mins, maxs):
+			cluster = spatial_order(centers, cluster)
+			cluster_rooms = [leaves[i] for i in cluster if i < len(rooms)]
+			# the flipped rooms are solid outside the rooms: brushes that don't touch any room add nothing
+			# without rooms, e.g. brush entities, the brushes are the map
+			if len(cluster_rooms) == 0 and len(rooms) > 0:
+				continue
+			build.clusters.append((cluster_rooms, [leaves[i] for i in cluster if i >= len(rooms)]))
+	return build
+	
+def finish_map_build(context, build):
+	"""The second half of build_map: run the booleans that aren't cached and create the map object"""
 	scene = context.scene
-
-	# get all the temp bool objects from the last time this map was built
-	bool_objects = [obj for obj in bpy.data.objects if obj.name.startswith(map_name + "_bool")]
+	cache = build.cache
+	map_name = build.map_name
+	map_mesh = build.mesh
+	if not map_mesh and len(build.clusters) > 0:
+		cluster_keys = []
+		cluster_meshes = []
+		for (rooms, brushes) in build.clusters:
+			(key, mesh) = get_cluster_mesh(context, cache, rooms, brushes)
+			cluster_keys.append(key)
+			cluster_meshes.append(mesh)
+		if len(cluster_meshes) == 1:
+			map_mesh = cluster_meshes[0]
+		else:
+			key = combine_keys("JOIN", cluster_keys)
+			map_mesh = cache.get_mesh(key)
+			if not map_mesh:
+				with cache.profile.stage("join"):
+					map_mesh = mesh_utils.join_meshes("_build_node", cluster_meshes)
+				cache.add_mesh(key, map_mesh)
 				
 	# create map object
 	# if a map object already exists, its old mesh is removed
-	set_object_mode_and_clear_selection()
+	start_time = time.perf_counter()
 	old_map_mesh = None
 	map_mesh_name = map_name + "_mesh"
 	if map_mesh_name in bpy.data.meshes:
 		old_map_mesh = bpy.data.meshes[map_mesh_name]
 		old_map_mesh.name = "_worldspawn_old"
-	if len(rooms) > 0:
-		# first room: generate the mesh and transform to worldspace
-		if rooms[0].bfg.type == '3D_ROOM' and rooms[0].bfg.auto_unwrap:
-			auto_unwrap(rooms[0].data)
-		map_mesh = rooms[0].to_mesh(scene, True, 'PREVIEW')
-		map_mesh.name = map_mesh_name
-		map_mesh.transform(rooms[0].matrix_world)
-		
-		# 2D rooms are always unwrapped (the to_mesh result, not the object - it's just a plane)
-		if rooms[0].bfg.type == '2D_ROOM':
-			auto_unwrap(map_mesh)
-	else:
-		map_mesh = bpy.data.meshes.new(map_mesh_name)
+	map_mesh = temp_data.keep(map_mesh.copy() if map_mesh else bpy.data.meshes.new(map_mesh_name))
+	map_mesh.name = map_mesh_name
+	if "bfg_build_key" in map_mesh:
+		del map_mesh["bfg_build_key"]
+	if scene.bfg.optimize_map_mesh:
+		with cache.profile.stage("optimize"):
+			cache.profile.faces[map_name] = optimize_map_mesh(map_mesh)
 	if map_name in bpy.data.objects:
 		map = bpy.data.objects[map_name]
 		map.data = map_mesh
 	else:
-		map = bpy.data.objects.new(map_name, map_mesh)
+		map = temp_data.keep(bpy.data.objects.new(map_name, map_mesh))
 		scene.objects.link(map)
 	if old_map_mesh:
 		bpy.data.meshes.remove(old_map_mesh)
-	map.layers[scene.active_layer] = True
 	scene.objects.active = map
-	map.select = True
+	map.select = False
 	map.hide = False
-				
-	# combine rooms
-	if len(rooms) > 0:
-		flip_object_normals(map)
-	for i, room in enumerate(rooms):
-		if i > 0:
-			# not the first room: bool union with existing mesh
-			apply_boolean(map, room, 'UNION', flip_normals=True)
-	map.select = True
-	if len(rooms) > 0:
-		flip_object_normals(map)
-		
-	# combine brushes
-	for brush in brushes:
-		apply_boolean(map, brush, 'UNION')
-		
-	link_active_object_to_group("map")
+	link_object_to_group(map, "map")
 	move_object_to_layer(map, scene.bfg.map_layer)
 	map.hide_select = True
-	bpy.ops.object.select_all(action='DESELECT')
+	cache.profile.add("map_object", time.perf_counter() - start_time)
+	cache.profile.maps[map_name] = count_mesh_triangles(map_mesh)
+	with cache.profile.stage("cleanup"):
+		cache.end()
+	return build.warning
+	
+def build_map(context, rooms, brushes, map_name):
+	return finish_map_build(context, prepare_map_build(context, rooms, brushes, map_name))
 	
-	# cleanup temp bool objects
-	for obj in bool_objects:
-		mesh = obj.data
-		bpy.data.objects.remove(obj)
-		bpy.data.meshes.remove(mesh)
+def find_parallel_union_trees(cache, leaves, flip_normals, max_leaves, trees):
+	# split a union tree into subtrees of at most max_leaves leaves, skipping the ones that are cached
+	if len(leaves) < 2 or cache.get_mesh(get_union_tree_key(leaves, flip_normals)):
+		return
+	if len(leaves) <= max_leaves:
+		trees.append((leaves, flip_normals))
+		return
+	half = len(leaves) // 2
+	find_parallel_union_trees(cache, leaves[:half], flip_normals, max_leaves, trees)
+	find_parallel_union_trees(cache, leaves[half:], flip_normals, max_leaves, trees)
+	
+def build_union_trees_parallel(context, builds, num_workers):
+	"""Build the lower levels of the union trees of prepared map builds in background blender processes
+	finish_map_build picks the results up from the cache and does the rest"""
+	roots = []
+	for build in builds:
+		for (rooms, brushes) in build.clusters:
+			roots.append((build.cache, rooms, True))
+			roots.append((build.cache, brushes, False))
+	max_leaves = max(2, int(math.ceil(sum([len(leaves) for (_, leaves, _) in roots]) / max(1, num_workers))))
+	trees = []
+	for (cache, leaves, flip_normals) in roots:
+		subtrees = []
+		find_parallel_union_trees(cache, leaves, flip_normals, max_leaves, subtrees)
+		trees += [(cache, t[0], t[1]) for t in subtrees]
+	if len(trees) == 0:
+		return
+	profile = builds[0].cache.profile
+	start_time = time.perf_counter()
+	sources = {}
+	costs = []
+	for (cache, leaves, flip_normals) in trees:
+		cost = 0
+		for (obj, obj_key) in leaves:
+			arrays = mesh_utils.get_mesh_arrays(get_source_mesh(context, cache, obj, obj_key, flip_normals))
+			sources[obj_key] = arrays
+			cost += len(arrays[2])
+		costs.append(cost)
+	results = build_pool.build_union_trees([([k for (_, k) in leaves], flip_normals, cost) for ((_, leaves, flip_normals), cost) in zip(trees, costs)], sources, num_workers)
+	for ((cache, leaves, flip_normals), arrays) in zip(trees, results):
+		# failed trees are built locally by finish_map_build
+		if arrays:
+			cache.add_mesh(get_union_tree_key(leaves, flip_normals), mesh_utils.create_mesh("_build_node", *arrays))
+	profile.add("parallel", time.perf_counter() - start_time, [o for (cache, leaves, _) in trees for o in get_profile_objects(cache, leaves)])
+	
+def build_csg_mesh(context, cache, rooms, brushes, key):
+	"""Combine rooms and brushes, lists of (obj, obj_key), with the csg module. Returns None if any of them isn't convex."""
+	mesh = cache.get_mesh(key)
+	if mesh:
+		return mesh
+	solids = []
+	for i, (obj, obj_key) in enumerate(rooms + brushes):
+		# rooms are flipped: csg wants solids with outward facing normals
+		solid = csg.solid_from_arrays(*mesh_utils.get_mesh_arrays(get_source_mesh(context, cache, obj, obj_key, i < len(rooms))))
+		if not solid:
+			return None
+		solids.append(solid)
+	(positions, loop_vertices, loop_totals, material_indices, uvs, material_names) = csg.polygons_to_arrays(csg.build(solids[:len(rooms)], solids[len(rooms):]))
+	mesh = mesh_utils.create_mesh("_build_node", positions, loop_vertices, loop_totals, material_indices, uvs, material_names)
+	cache.add_mesh(key, mesh)
+	return mesh
 		
 class AddRoom(bpy.types.Operator):
 	bl_idname = "scene.add_room"
@@ -1390,6 +2103,21 @@ class BuildMap(bpy.types.Operator):
 	bool_op = bpy.props.StringProperty(name="bool_op", default='INTERSECT')
 
 	def execute(self, context):
+		# rooms being edited need to be written back to their meshes
+		set_object_mode_and_clear_selection()
+		for warning in build_scene_maps(context):
+			self.report({'WARNING'}, warning)
+		return {'FINISHED'}
+		
+def build_scene_maps(context):
+	"""Build the worldspawn and brush entity maps of context.scene. Returns a list of warnings.
+	Doesn't use operators, so it works in scripts and background processes.
+	The build is profiled, see get_last_build_profile."""
+	global _last_build_profile
+	profile = build_profiler.BuildProfile()
+	start_time = time.perf_counter()
+	# anything created while building that isn't kept by the build cache or the map object is reported as a leak
+	with temp_data.TempData("Build Map") as temp:
 		# worldspawn
 		rooms = []
 		brushes = []
@@ -1400,9 +2128,9 @@ class BuildMap(bpy.types.Operator):
 				rooms.append(obj)
 			elif obj.bfg.type == 'BRUSH':
 				brushes.append(obj)
-					
-		build_map(context, rooms, brushes, "_worldspawn")
-		
+				
+		builds = [prepare_map_build(context, rooms, brushes, "_worldspawn", profile)]
+	
 		# brush entities
 		for obj in context.scene.objects:
 			if obj.bfg.type == 'BRUSH_ENTITY':
@@ -1411,7 +2139,39 @@ class BuildMap(bpy.types.Operator):
 					if child.bfg.type == 'BRUSH':
 						brushes.append(child)
 				if len(brushes) > 0:
-					build_map(context, [], brushes, "_" + obj.name)
+					builds.append(prepare_map_build(context, [], brushes, "_" + obj.name, profile))
+				
+		# brush entities and clusters are independent, build as much as possible in parallel
+		if context.scene.bfg.use_parallel_build:
+			build_union_trees_parallel(context, builds, context.scene.bfg.build_workers)
+		warnings = []
+		for build in builds:
+			warning = finish_map_build(context, build)
+			if warning:
+				warnings.append(warning)
+			
+		# brush entities that have been removed don't need their cache anymore
+		free_build_caches([build.map_name for build in builds])
+	profile.leaks = temp.leaks
+	profile.seconds = time.perf_counter() - start_time
+	_last_build_profile = profile
+	return warnings
+	
+def get_last_build_profile():
+	return _last_build_profile
+	
+class SaveBuildReport(bpy.types.Operator, ExportHelper):
+	"""Save the profile of the last Build Map to a JSON file"""
+	bl_idname = "scene.save_build_report"
+	bl_label = "Save Build Report"
+	filename_ext = ".json"
+	
+	@classmethod
+	def poll(cls, context):
+		return _last_build_profile != None
+		
+	def execute(self, context):
+		_last_build_profile.save_json(self.filepath)
 		return {'FINISHED'}
 		
 ################################################################################
@@ -1419,22 +2179,76 @@ class BuildMap(bpy.types.Operator):
 ################################################################################
 
 def auto_unwrap(mesh, obj_location=Vector(), obj_scale=Vector((1, 1, 1))):
-	if bpy.context.mode == 'EDIT_MESH':
+	"""Planar projection of each face along its dominant axis, scaled by its material's texture size. Pinned UVs are left alone.
+	In edit mode, only the selected faces are unwrapped."""
+	if mesh.is_editmode:
 		bm = bmesh.from_edit_mesh(mesh)
-	else:
-		bm = bmesh.new()
-		bm.from_mesh(mesh)
+		auto_unwrap_bmesh(bm, mesh, obj_location, obj_scale, True)
+		bmesh.update_edit_mesh(mesh)
+		return
+	if len(mesh.uv_textures) == 0:
+		mesh.uv_textures.new()
+	num_polygons = len(mesh.polygons)
+	num_loops = len(mesh.loops)
+	if num_loops == 0:
+		return
+	normals = np.empty(num_polygons * 3, dtype=np.float32)
+	mesh.polygons.foreach_get("normal", normals)
+	normals = normals.reshape(-1, 3)
+	loop_starts = np.empty(num_polygons, dtype=np.int32)
+	mesh.polygons.foreach_get("loop_start", loop_starts)
+	loop_totals = np.empty(num_polygons, dtype=np.int32)
+	mesh.polygons.foreach_get("loop_total", loop_totals)
+	material_indices = np.empty(num_polygons, dtype=np.int32)
+	mesh.polygons.foreach_get("material_index", material_indices)
+	loop_vertices = np.empty(num_loops, dtype=np.int32)
+	mesh.loops.foreach_get("vertex_index", loop_vertices)
+	co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+	mesh.vertices.foreach_get("co", co)
+	uv_data = mesh.uv_layers.active.data
+	uvs = np.empty(num_loops * 2, dtype=np.float32)
+	uv_data.foreach_get("uv", uvs)
+	uvs = uvs.reshape(-1, 2)
+	pins = np.empty(num_loops, dtype=np.bool_)
+	uv_data.foreach_get("pin_uv", pins)
+	
+	# per material: game units per texel, in double precision like the scalar version
+	sizes = np.array([get_material_texture_size(mat) for mat in mesh.materials] or [(128, 128)], dtype=np.float64)
+	scales = _scale_to_game / sizes * (1.0 / bpy.context.scene.bfg.global_uv_scale)
+	
+	# dominant axis: the first of the largest absolute normal components, x before y before z
+	axes = np.argmax(np.abs(normals), axis=1)
+	negative = normals[np.arange(num_polygons), axes] < 0
+	# x: (y, z), -x: (-y, z), y: (-x, z), -y: (x, z), z: (x, y), -z: (x, -y)
+	u_component = np.array([1, 0, 0])[axes]
+	v_component = np.array([2, 2, 1])[axes]
+	u_sign = np.where(axes == 0, np.where(negative, -1.0, 1.0), np.where(axes == 1, np.where(negative, 1.0, -1.0), 1.0))
+	v_sign = np.where((axes == 2) & negative, -1.0, 1.0)
+	
+	# polygon data per loop. loops are found through loop_start, they don't have to be in polygon order.
+	polygon_indices = np.repeat(np.arange(num_polygons), loop_totals)
+	offsets = np.cumsum(loop_totals) - loop_totals
+	loop_indices = np.arange(len(polygon_indices)) - np.repeat(offsets, loop_totals) + np.repeat(loop_starts, loop_totals)
+	positions = co.reshape(-1, 3)[loop_vertices[loop_indices]].astype(np.float64) * np.array(obj_scale, dtype=np.float64) + np.array(obj_location, dtype=np.float64)
+	rows = np.arange(len(loop_indices))
+	poly_scales = scales[np.clip(material_indices, 0, len(scales) - 1)][polygon_indices]
+	u = positions[rows, u_component[polygon_indices]] * poly_scales[:, 0] * u_sign[polygon_indices]
+	v = positions[rows, v_component[polygon_indices]] * poly_scales[:, 1] * v_sign[polygon_indices]
+	
+	unpinned = ~pins[loop_indices]
+	uvs[loop_indices[unpinned], 0] = u[unpinned]
+	uvs[loop_indices[unpinned], 1] = v[unpinned]
+	uv_data.foreach_set("uv", uvs.ravel())
+	mesh.update()
+	
+def auto_unwrap_bmesh(bm, mesh, obj_location=Vector(), obj_scale=Vector((1, 1, 1)), selected_only=False):
+	# the scalar version of auto_unwrap, used in edit mode
 	uv_layer = bm.loops.layers.uv.verify()
 	bm.faces.layers.tex.verify()  # currently blender needs both layers.
 	for f in bm.faces:
-		if bpy.context.mode == 'EDIT_MESH' and not f.select:
+		if selected_only and not f.select:
 			continue # ignore faces that aren't selected in edit mode
-		texture_size = (128, 128)
-		mat = mesh.materials[f.material_index]
-		if len(mat.texture_slots) > 0:
-			tex = bpy.data.textures[mat.texture_slots[0].name]
-			if hasattr(tex, "image") and tex.image: # if the texture type isn't set to "Image or Movie", the image attribute won't exist
-				texture_size = tex.image.size
+		texture_size = get_material_texture_size(mesh.materials[f.material_index] if f.material_index < len(mesh.materials) else None)
 		nX = f.normal.x
 		nY = f.normal.y
 		nZ = f.normal.z
@@ -1484,12 +2298,6 @@ def auto_unwrap(mesh, obj_location=Vector(), obj_scale=Vector((1, 1, 1))):
 				if face_direction == '-z':
 					luv.uv.x = (((l.vert.co.x * obj_scale[0]) + obj_location[0]) * scale_x) * 1
 					luv.uv.y = (((l.vert.co.y * obj_scale[1]) + obj_location[1]) * scale_y) * -1
-	if bpy.context.mode == 'EDIT_MESH':
-		bmesh.update_edit_mesh(mesh)
-	else:
-		bm.to_mesh(mesh)
-		bm.free()
-		mesh.update()
 
 class AutoUnwrap(bpy.types.Operator):
 	bl_idname = "object.auto_uv_unwrap"
@@ -1662,7 +2470,11 @@ class SettingsPanel(bpy.types.Panel):
 		flow.prop(scene.bfg, "show_entity_names")
 		flow.prop(scene.bfg, "hide_bad_materials")
 		flow.prop(scene.bfg, "shadeless_materials")
+		flow.prop(scene.bfg, "use_model_proxies")
 		col.prop(context.scene.bfg, "global_uv_scale")
+		sub = col.row(align=True)
+		sub.enabled = scene.bfg.use_model_proxies
+		sub.prop(scene.bfg, "proxy_triangle_budget")
 		
 class CreatePanel(bpy.types.Panel):
 	bl_label = "Create"
@@ -1676,6 +2488,12 @@ class CreatePanel(bpy.types.Panel):
 		row = col.row(align=True)
 		row.operator(BuildMap.bl_idname, "Build Map", icon='MOD_BUILD').bool_op = 'UNION'
 		row.prop(context.scene.bfg, "map_layer")
+		row = col.row(align=True)
+		row.prop(context.scene.bfg, "build_mode", "")
+		row.prop(context.scene.bfg, "optimize_map_mesh", "", icon='MOD_DECIM')
+		row.prop(context.scene.bfg, "use_parallel_build", "", icon='SETTINGS')
+		if context.scene.bfg.use_parallel_build:
+			col.prop(context.scene.bfg, "build_workers")
 		col.operator(AddRoom.bl_idname, "Add 2D Room", icon='SURFACE_NCURVE')
 		col.operator(AddBrush.bl_idname, "Add 3D Room", icon='SNAP_FACE').s_type = '3D_ROOM'
 		col.operator(AddBrush.bl_idname, "Add Brush", icon='SNAP_VOLUME').s_type = 'BRUSH'
@@ -1688,6 +2506,33 @@ class CreatePanel(bpy.types.Panel):
 		col.operator(AddLight.bl_idname, AddLight.bl_label, icon='LAMP_POINT')
 		col.operator(AddStaticModel.bl_idname, AddStaticModel.bl_label, icon='MESH_MONKEY')
 		
+class BuildReportPanel(bpy.types.Panel):
+	bl_label = "Build Report"
+	bl_space_type = 'VIEW_3D'
+	bl_region_type = 'TOOLS'
+	bl_category = "BFGForge"
+	bl_options = {'DEFAULT_CLOSED'}
+	
+	def draw(self, context):
+		profile = get_last_build_profile()
+		col = self.layout.column()
+		if not profile:
+			col.label("Build the map to see a report")
+			return
+		col.label("Total: %.2fs, %d triangles" % (profile.seconds, sum(profile.maps.values())))
+		if len(profile.faces) > 0:
+			col.label("Merged faces: %d to %d" % (sum([f[0] for f in profile.faces.values()]), sum([f[1] for f in profile.faces.values()])))
+		if sum(profile.leaks.values()) > 0:
+			col.label("Leaked %s" % ", ".join(["%d %s" % (n, c) for (c, n) in profile.leaks.items() if n > 0]), icon='ERROR')
+		box = col.box()
+		for (name, (seconds, calls)) in sorted(profile.stages.items(), key=lambda i: -i[1][0])[:8]:
+			box.label("%s: %.2fs (%d)" % (name, seconds, calls))
+		col.label("Slowest objects:")
+		box = col.box()
+		for obj in sorted(profile.objects.values(), key=lambda o: -o.seconds())[:10]:
+			box.label("%s: %.2fs, %d tris" % (obj.name, obj.seconds(), obj.triangles), icon='MESH_CUBE')
+		col.operator(SaveBuildReport.bl_idname, SaveBuildReport.bl_label, icon='FILE_TEXT')
+		
 class MaterialPanel(bpy.types.Panel):
 	bl_label = "Material"
 	bl_space_type = 'VIEW_3D'
@@ -1713,6 +2558,25 @@ class MaterialPanel(bpy.types.Panel):
 				elif hasattr(obj.data, "materials") or len(context.selected_objects) > 1: # don't hide if multiple selections
 					col.operator(AssignMaterial.bl_idname, AssignMaterial.bl_label, icon='MATERIAL')
 
+class ModelPanel(bpy.types.Panel):
+	bl_label = "Models"
+	bl_space_type = 'VIEW_3D'
+	bl_region_type = 'TOOLS'
+	bl_category = "BFGForge"
+	
+	def draw(self, context):
+		scene = context.scene
+		col = self.layout.column()
+		row = col.row(align=True)
+		row.operator(ScanModels.bl_idname, ScanModels.bl_label, icon='FILE_REFRESH')
+		row.prop(scene.bfg, "thumbnail_workers")
+		if len(scene.bfg.models) > 0:
+			col.prop_search(scene.bfg, "active_model_path", scene.bfg, "model_paths", "", icon='MESH_MONKEY')
+			col.template_icon_view(scene.bfg, "active_model")
+			row = col.row(align=True)
+			row.prop(scene.bfg, "active_model", "")
+			row.operator(AddBrowserModel.bl_idname, "", icon='ZOOMIN')
+
 class ObjectPanel(bpy.types.Panel):
 	bl_label = "Object"
 	bl_space_type = 'VIEW_3D'
@@ -1778,6 +2642,8 @@ class ObjectPanel(bpy.types.Panel):
 			elif obj.bfg.type in ['3D_ROOM', 'BRUSH']:
 				col.prop(obj.bfg, "auto_unwrap")
 			elif obj.bfg.type in ['BRUSH_ENTITY','ENTITY']:
+				if obj.bfg.entity_model.lower().endswith(".md5mesh"):
+					col.operator(PreviewEntityAnimation.bl_idname, PreviewEntityAnimation.bl_label, icon='POSE_DATA')
 				self.draw_entity_properties(context, col, obj)
 			elif obj.type == 'LAMP':
 				row = col.row()
@@ -1787,6 +2653,8 @@ class ObjectPanel(bpy.types.Panel):
 				col.prop(obj.data, "use_diffuse")
 				col.template_icon_view(obj.bfg, "light_material")
 				col.prop(obj.bfg, "light_material", "")
+			if obj.bfg.entity_model != "" and context.scene.bfg.use_model_proxies:
+				col.prop(obj.bfg, "proxy_triangle_budget")
 			if hasattr(obj.data, "materials") or len(context.selected_objects) > 1: # don't hide if multiple selections
 				col.operator(RefreshMaterials.bl_idname, RefreshMaterials.bl_label, icon='MATERIAL')
 			# if this object is part of a brush entity (i.e. a child of one), show the brush entity properties
@@ -1876,6 +2744,13 @@ class BfgScenePropertyGroup(bpy.types.PropertyGroup):
 	shadeless_materials = bpy.props.BoolProperty(name="Fullbright materials", description="Disable lighting on materials", default=True, update=update_shadeless_materials)
 	show_inherited_entity_props = bpy.props.BoolProperty(name="Show inherited properties", description="Show inherited entity properties", default=False)
 	map_layer = bpy.props.IntProperty(name="Layer", default=0, min=0, max=19)
+	build_mode = bpy.props.EnumProperty(items=[
+		('CARVE', "Carve", "Boolean modifiers, rooms and brushes can be any shape"),
+		('CSG', "CSG", "Exact plane clipping, much faster. Only works with convex rooms and brushes, otherwise Carve is used.")
+	], name="Build Mode", default='CARVE')
+	optimize_map_mesh = bpy.props.BoolProperty(name="Merge coplanar faces", description="Merge adjacent coplanar faces with the same material and continuous UVs, and remove collinear vertices, after building the map", default=True)
+	use_parallel_build = bpy.props.BoolProperty(name="Parallel build", description="Run Carve booleans in background Blender processes", default=False)
+	build_workers = bpy.props.IntProperty(name="Workers", description="Number of background Blender processes used by parallel builds", default=os.cpu_count() or 1, min=1, max=256)
 	material_decl_paths = bpy.props.CollectionProperty(type=MaterialDeclPathPropGroup)
 	active_material_decl_path = bpy.props.StringProperty(name="", default="")
 	material_decls = bpy.props.CollectionProperty(type=MaterialDeclPropGroup)
@@ -1883,15 +2758,24 @@ class BfgScenePropertyGroup(bpy.types.PropertyGroup):
 	entities = bpy.props.CollectionProperty(type=EntityPropGroup)
 	active_entity = bpy.props.StringProperty(name="Active Entity", default="")
 	model_defs = bpy.props.CollectionProperty(type=ModelDefPropGroup)
+	models = bpy.props.CollectionProperty(type=ModelPathPropGroup) # relative paths, e.g. models/mapobjects/arcade_machine/arcade_machine.lwo
+	model_paths = bpy.props.CollectionProperty(type=ModelPathPropGroup)
+	active_model_path = bpy.props.StringProperty(name="", default="")
+	active_model = bpy.props.EnumProperty(name="", items=model_preview_items)
+	thumbnail_workers = bpy.props.IntProperty(name="Workers", description="Number of background Blender processes used to render model thumbnails", default=os.cpu_count() or 1, min=1, max=64)
 	global_uv_scale = bpy.props.FloatProperty(name="Global UV Scale", description="Scale Automatically unwrapped UVs by this amount", default=0.5, step=0.1, min=0.1, max=10)
 	uv_fit_repeat = bpy.props.FloatProperty(name="UV Fit Repeat", default=1.0, step=0.1, min=0.1, max=10)
 	uv_nudge_increment = bpy.props.FloatProperty(name="Nudge Increment", default=_scale_to_blender)
 	uv_rotate_degrees = bpy.props.FloatProperty(name="UV Rotate Degrees", default=90.0, step=10.0, min=1.0, max=90.0)
+	use_model_proxies = bpy.props.BoolProperty(name="Model proxies", description="Display heavy static models and monsters with a decimated mesh", default=False, update=update_model_proxies)
+	proxy_triangle_budget = bpy.props.IntProperty(name="Proxy Triangles", description="Maximum number of triangles per model when displaying proxies", default=1000, min=12, update=update_model_proxies)
 	
 class BfgObjectPropertyGroup(bpy.types.PropertyGroup):
 	auto_unwrap = bpy.props.BoolProperty(name="Auto unwrap on Build Map", description="Auto Unwrap this object when the map is built", default=True)
 	classname = bpy.props.StringProperty(name="Classname", default="")
 	entity_model = bpy.props.StringProperty(name="Entity model", default="")
+	model_mesh = bpy.props.StringProperty(name="Model mesh", default="") # original mesh name when a proxy is displayed
+	proxy_triangle_budget = bpy.props.IntProperty(name="Proxy Triangles", description="Maximum number of triangles of this model's proxy, 0 uses the scene's", default=0, min=0, update=update_object_model_proxy)
 	room_height = bpy.props.FloatProperty(name="Room Height", default=4, step=20, precision=1, update=update_room)
 	floor_material = bpy.props.StringProperty(name="Floor Material", update=update_room)
 	wall_material = bpy.props.StringProperty(name="Wall Material", update=update_room)
@@ -1925,6 +2809,11 @@ def register():
 	pcoll.lights = ()
 	pcoll.needs_refresh = True
 	preview_collections["light"] = pcoll
+	pcoll = bpy.utils.previews.new()
+	pcoll.models = ()
+	pcoll.current_model_path = ""
+	pcoll.force_refresh = False
+	preview_collections["model"] = pcoll
 
 def unregister():
 	del bpy.types.Scene.bfg
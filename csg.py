@@ -0,0 +1,243 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# plane based CSG for convex rooms and brushes, an alternative to Carve
+# rooms and brushes are convex solids with outward facing planes
+# the result is the surface of the space inside the rooms and outside the brushes, facing into that space:
+# -room faces are kept where they're outside all other rooms and brushes, then flipped
+# -brush faces are kept where they're inside a room and outside all other brushes
+# polygons are clipped exactly against the planes of the solids they overlap. they're classified against all planes
+# of the overlapping solids at once, only solids and planes that actually cut a polygon are clipped against one by one
+# doesn't use bpy so it can run anywhere
+
+import numpy as np
+
+_epsilon = 1e-4 # blender units, 1/640 of a game unit
+
+# what to do with the part of a polygon that lies on a face of the solid being clipped against
+_COPLANAR_KEEP = 0 # treat as outside the solid
+_COPLANAR_DISCARD = 1 # treat as inside the solid
+
+class Polygon:
+	def __init__(self, verts, material, uv_matrix, normal):
+		self.verts = verts # (n, 3)
+		self.material = material # material name
+		self.uv_matrix = uv_matrix # (2, 4), uv = uv_matrix * (x y z 1)
+		self.normal = normal
+
+class Solid:
+	def __init__(self, polygons, planes):
+		self.polygons = polygons
+		self.planes = planes # (n, 4) outward normal and distance, n.p - d = 0
+		all_verts = np.concatenate([p.verts for p in polygons])
+		self.mins = all_verts.min(axis=0)
+		self.maxs = all_verts.max(axis=0)
+
+def polygon_normal(verts):
+	# newell's method
+	n = np.cross(verts, np.roll(verts, -1, axis=0)).sum(axis=0)
+	length = np.linalg.norm(n)
+	return n / length if length > 1e-12 else None
+
+def fit_uv_matrix(verts, uvs):
+	"""Least squares fit of the affine map from positions to uvs, exact for planar projections"""
+	a = np.hstack([verts, np.ones((len(verts), 1))])
+	return np.linalg.lstsq(a, uvs, rcond=None)[0].T
+
+def solid_from_arrays(positions, loop_vertices, loop_totals, material_indices, loop_uvs, material_names):
+	"""Create a solid from mesh arrays with outward facing polygons. Returns None if it isn't convex."""
+	positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+	loop_vertices = np.asarray(loop_vertices)
+	loop_uvs = np.asarray(loop_uvs, dtype=np.float64).reshape(-1, 2) if loop_uvs is not None else np.zeros((len(loop_vertices), 2))
+	polygons = []
+	planes = []
+	start = 0
+	for i, total in enumerate(loop_totals):
+		loops = np.arange(start, start + total)
+		start += total
+		verts = positions[loop_vertices[loops]]
+		normal = polygon_normal(verts)
+		if normal is None:
+			continue # degenerate
+		material = material_names[material_indices[i]] if material_indices[i] < len(material_names) else None
+		polygons.append(Polygon(verts, material, fit_uv_matrix(verts, loop_uvs[loops]), normal))
+		planes.append(np.append(normal, normal.dot(verts.mean(axis=0))))
+	if len(polygons) < 4:
+		return None
+	planes = np.array(planes)
+	# convex if every vertex is on or behind every plane
+	if (positions[np.unique(loop_vertices)].dot(planes[:, :3].T) - planes[:, 3] > _epsilon).any():
+		return None
+	# remove duplicate planes, e.g. from triangulated quads
+	(_, unique) = np.unique(np.round(planes / _epsilon).astype(np.int64), axis=0, return_index=True)
+	return Solid(polygons, planes[np.sort(unique)])
+
+def split_polygon(verts, dists):
+	"""Split a convex polygon by a plane. Returns the (front, back) parts, either may be None."""
+	# each vertex is followed by the point where its edge crosses the plane, if it does
+	next_dists = np.roll(dists, -1)
+	crossing = ((dists > _epsilon) & (next_dists < -_epsilon)) | ((dists < -_epsilon) & (next_dists > _epsilon))
+	t = np.where(crossing, dists / np.where(crossing, dists - next_dists, 1.0), 0.0)
+	points = np.stack((verts, verts + (np.roll(verts, -1, axis=0) - verts) * t[:, np.newaxis]), axis=1).reshape(-1, 3)
+	front = points[np.stack((dists >= -_epsilon, crossing), axis=1).ravel()]
+	back = points[np.stack((dists <= _epsilon, crossing), axis=1).ravel()]
+	return (front if len(front) >= 3 else None, back if len(back) >= 3 else None)
+
+def clip_polygon(verts, normal, solid, coplanar_same, coplanar_opposite):
+	"""Split verts into the parts outside and inside a convex solid
+	coplanar_same/coplanar_opposite decide what happens to parts lying on a face of the solid
+	with the same or opposite orientation
+	returns (list of outside parts, inside part or None)"""
+	planes = solid.planes
+	# classify against every plane at once: a polygon in front of any plane is outside,
+	# only the planes it straddles split it
+	dists = verts.dot(planes[:, :3].T) - planes[:, 3]
+	front = (dists >= -_epsilon).all(axis=0)
+	behind = (dists <= _epsilon).all(axis=0)
+	on = front & behind
+	if (front & ~on).any():
+		return ([verts], None)
+	coplanar = None
+	on = np.flatnonzero(on)
+	if len(on) > 0:
+		coplanar = coplanar_same if normal.dot(planes[on[-1], :3]) > 0 else coplanar_opposite
+	outside = []
+	for i in np.flatnonzero(~front & ~behind):
+		# the part left behind the previous planes may not reach this one
+		d = verts.dot(planes[i, :3]) - planes[i, 3]
+		if (d >= -_epsilon).all():
+			if (d <= _epsilon).all():
+				coplanar = coplanar_same if normal.dot(planes[i, :3]) > 0 else coplanar_opposite
+				continue
+			outside.append(verts)
+			return (outside, None)
+		if (d <= _epsilon).all():
+			continue
+		(front_part, back_part) = split_polygon(verts, d)
+		if front_part is not None:
+			outside.append(front_part)
+		if back_part is None:
+			return (outside, None)
+		verts = back_part
+	if coplanar == _COPLANAR_KEEP:
+		outside.append(verts)
+		return (outside, None)
+	return (outside, verts)
+
+def stack_planes(solids):
+	"""The planes of all solids in one array, with the first row and number of rows of each solid, see touching"""
+	counts = np.array([len(s.planes) for s in solids], dtype=np.int64)
+	planes = np.concatenate([s.planes for s in solids]) if len(solids) > 0 else np.zeros((0, 4))
+	return (planes, np.cumsum(counts) - counts, counts)
+
+def touching(verts, stacked, indices):
+	"""The solids of indices, in order, that verts isn't entirely in front of a plane of. The others can't clip it, or any part of it."""
+	indices = np.asarray(indices, dtype=np.int64)
+	if len(indices) == 0:
+		return indices
+	(planes, starts, counts) = stacked
+	counts = counts[indices]
+	offsets = np.cumsum(counts) - counts
+	rows = np.arange(counts.sum()) - np.repeat(offsets - starts[indices], counts)
+	dists = verts.dot(planes[rows, :3].T) - planes[rows, 3]
+	front = (dists >= -_epsilon).all(axis=0) & ~(dists <= _epsilon).all(axis=0)
+	return indices[~np.logical_or.reduceat(front, offsets)]
+
+def overlapping(mins, maxs, solid_mins, solid_maxs):
+	"""Indices of the solids whose bounds overlap mins/maxs"""
+	return np.nonzero(((solid_mins <= maxs + _epsilon) & (solid_maxs >= mins - _epsilon)).all(axis=1))[0]
+
+def clip_outside(parts, normal, solids, indices, rule):
+	# rule(solid index) returns (coplanar_same, coplanar_opposite)
+	for s in indices:
+		(same, opposite) = rule(s)
+		clipped = []
+		for verts in parts:
+			clipped += clip_polygon(verts, normal, solids[s], same, opposite)[0]
+		parts = clipped
+		if len(parts) == 0:
+			break
+	return parts
+
+def build(rooms, brushes):
+	"""Combine lists of convex solids, see the top of this file
+	return a list of (verts, material name, uv matrix) polygons facing into the space"""
+	result = []
+	room_mins = np.array([r.mins for r in rooms]).reshape(-1, 3)
+	room_maxs = np.array([r.maxs for r in rooms]).reshape(-1, 3)
+	brush_mins = np.array([b.mins for b in brushes]).reshape(-1, 3)
+	brush_maxs = np.array([b.maxs for b in brushes]).reshape(-1, 3)
+	(room_planes, brush_planes) = (stack_planes(rooms), stack_planes(brushes))
+
+	# room faces: outside all other rooms and brushes
+	for r, room in enumerate(rooms):
+		for poly in room.polygons:
+			(mins, maxs) = (poly.verts.min(axis=0), poly.verts.max(axis=0))
+			parts = [poly.verts]
+			# coplanar with another room: touching rooms (opposite) are joined, flush walls (same) are kept once
+			others = touching(poly.verts, room_planes, [i for i in overlapping(mins, maxs, room_mins, room_maxs) if i != r])
+			parts = clip_outside(parts, poly.normal, rooms, others, lambda i: (_COPLANAR_KEEP if r < i else _COPLANAR_DISCARD, _COPLANAR_DISCARD))
+			# coplanar with a brush: brush outside the room (opposite) keeps the wall, brush inside (same) covers it
+			parts = clip_outside(parts, poly.normal, brushes, touching(poly.verts, brush_planes, overlapping(mins, maxs, brush_mins, brush_maxs)), lambda i: (_COPLANAR_DISCARD, _COPLANAR_KEEP))
+			for verts in parts:
+				result.append((verts[::-1], poly.material, poly.uv_matrix))
+
+	# brush faces: inside any room, outside all other brushes
+	# without rooms, e.g. brush entities, it's the union of the brushes
+	for b, brush in enumerate(brushes):
+		for poly in brush.polygons:
+			(mins, maxs) = (poly.verts.min(axis=0), poly.verts.max(axis=0))
+			outside = [poly.verts]
+			inside = [] if len(rooms) > 0 else [poly.verts]
+			# brush faces on a room face are never visible, treat them as outside the room
+			for i in touching(poly.verts, room_planes, overlapping(mins, maxs, room_mins, room_maxs)):
+				remaining = []
+				for verts in outside:
+					(o, inner) = clip_polygon(verts, poly.normal, rooms[i], _COPLANAR_KEEP, _COPLANAR_KEEP)
+					remaining += o
+					if inner is not None:
+						inside.append(inner)
+				outside = remaining
+				if len(outside) == 0:
+					break
+			if len(inside) == 0:
+				continue
+			others = touching(poly.verts, brush_planes, [i for i in overlapping(mins, maxs, brush_mins, brush_maxs) if i != b])
+			inside = clip_outside(inside, poly.normal, brushes, others, lambda i: (_COPLANAR_KEEP if b < i else _COPLANAR_DISCARD, _COPLANAR_DISCARD))
+			for verts in inside:
+				result.append((verts, poly.material, poly.uv_matrix))
+	return result
+
+def polygons_to_arrays(polygons):
+	"""Weld polygon vertices and flatten to (x y z, loop vertex indices, loop totals, material indices, loop uvs, material names)"""
+	if len(polygons) == 0:
+		return (np.zeros(0), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0), [])
+	loop_positions = np.concatenate([p[0] for p in polygons])
+	loop_totals = np.array([len(p[0]) for p in polygons], dtype=np.int32)
+	material_names = []
+	material_indices = np.empty(len(polygons), dtype=np.int32)
+	uvs = []
+	for i, (verts, material, uv_matrix) in enumerate(polygons):
+		if not material in material_names:
+			material_names.append(material)
+		material_indices[i] = material_names.index(material)
+		uvs.append(verts.dot(uv_matrix[:, :3].T) + uv_matrix[:, 3])
+	# weld vertices within epsilon
+	keys = np.round(loop_positions / _epsilon).astype(np.int64)
+	(_, first, loop_vertices) = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+	positions = loop_positions[first]
+	return (positions, loop_vertices.astype(np.int32).ravel(), loop_totals, material_indices, np.concatenate(uvs), material_names)
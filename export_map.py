@@ -15,10 +15,11 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
 
-import bpy, bmesh, json, math
-from . import core
+import bpy, bmesh, hashlib, math, os
+import numpy as np
+from . import core, export_pool, map_writer, temp_data
 from bpy_extras.io_utils import ExportHelper
-from collections import OrderedDict
+from collections import deque, OrderedDict
 from mathutils import Euler, Matrix
 
 def ftos(a):
@@ -27,120 +28,272 @@ def ftos(a):
 def tuple_to_float_string(t):
 	return "%s %s %s" % (ftos(t[0]), ftos(t[1]), ftos(t[2]))
 	
+def angles_to_rotation_string(angles):
+	rot = Euler((-angles[0], -angles[1], -angles[2]), 'XYZ').to_matrix()
+	return "%s %s %s" % (tuple_to_float_string(rot[0]), tuple_to_float_string(rot[1]), tuple_to_float_string(rot[2]))
+	
+def extract_primitive(context, obj, obj_transform):
+	"""Triangulate an object's mesh and return it as arrays, see get_primitive_arrays"""
+	# the temp mesh that stores the result of to_mesh is freed when the scope ends
+	# no operators, so the scene isn't touched and this works in background mode
+	with temp_data.TempData("Export primitive", check_leaks=False) as temp:
+		temp_mesh = temp.track(obj.to_mesh(context.scene, True, 'PREVIEW'))
+		temp_mesh.name = "_export_mesh"
+		if obj_transform:
+			temp_mesh.transform(obj_transform)
+		bm = bmesh.new()
+		bm.from_mesh(temp_mesh)
+		
+		# duplicate verts/0 length edges mess up dmap portal creation
+		bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=core._scale_to_blender*0.99) # epsilon < 1 game unit
+		
+		# triangulate, beauty quad and ngon methods like mesh.quads_convert_to_tris
+		bmesh.ops.triangulate(bm, faces=bm.faces[:])
+		bm.to_mesh(temp_mesh)
+		bm.free()
+		return get_primitive_arrays(temp_mesh)
+		
 def create_primitive(context, obj, obj_transform, index):
-	# need a temp mesh to store the result of to_mesh and a temp object for mesh operator
-	temp_mesh = obj.to_mesh(context.scene, True, 'PREVIEW')
-	temp_mesh.name = "_export_mesh"
-	if obj_transform:
-		temp_mesh.transform(obj_transform)
-	temp_obj = bpy.data.objects.new("_export_obj", temp_mesh)
-	context.scene.objects.link(temp_obj)
-	temp_obj.select = True
-	context.scene.objects.active = temp_obj
-	bpy.ops.object.editmode_toggle()
-	
-	# duplicate verts/0 length edges mess up dmap portal creation
-	bm = bmesh.from_edit_mesh(temp_obj.data)
-	bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=core._scale_to_blender*0.99) # epsilon < 1 game unit
-	bmesh.update_edit_mesh(temp_obj.data)
-	bm.free()
-	
-	bpy.ops.mesh.select_all(action='SELECT')
-	#bpy.ops.mesh.vert_connect_concave() # make faces convex
-	bpy.ops.mesh.quads_convert_to_tris() # triangulate
-	bpy.ops.object.editmode_toggle()
-	obj = temp_obj
-	mesh = temp_mesh
+	return map_writer.primitive_from_arrays(index, extract_primitive(context, obj, obj_transform))
+	
+def get_primitive_arrays(mesh):
+	"""The data map_writer.primitive_from_arrays needs, pulled out of a triangulated mesh"""
 	mesh.calc_normals_split() # create face normals
+	num_loops = len(mesh.loops)
+	num_polygons = len(mesh.polygons)
+	arrays = {}
+	co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+	mesh.vertices.foreach_get("co", co)
+	arrays["positions"] = co.reshape(-1, 3).astype(np.float64) * core._scale_to_game
+	arrays["loop_vertices"] = np.empty(num_loops, dtype=np.int32)
+	mesh.loops.foreach_get("vertex_index", arrays["loop_vertices"])
+	arrays["normals"] = np.empty(num_loops * 3, dtype=np.float32)
+	mesh.loops.foreach_get("normal", arrays["normals"])
+	arrays["uvs"] = np.zeros(num_loops * 2, dtype=np.float32)
+	if len(mesh.uv_layers) > 0:
+		mesh.uv_layers[0].data.foreach_get("uv", arrays["uvs"])
+	arrays["loop_starts"] = np.empty(num_polygons, dtype=np.int32)
+	mesh.polygons.foreach_get("loop_start", arrays["loop_starts"])
+	arrays["loop_totals"] = np.empty(num_polygons, dtype=np.int32)
+	mesh.polygons.foreach_get("loop_total", arrays["loop_totals"])
+	arrays["material_indices"] = np.empty(num_polygons, dtype=np.int32)
+	mesh.polygons.foreach_get("material_index", arrays["material_indices"])
+	arrays["material_names"] = [mat.name if mat else "" for mat in mesh.materials]
+	return arrays
+	
+# primitives are serialized at this nesting level: map > entities > entity > primitives > primitive
+_primitive_level = 4
 
-	# vertex position and normal are decoupled from uvs
-	# need to:
-	# -create new vertices for each vertex/uv combination
-	# -map the old vertex indices to the new ones
-	vert_map = list(range(len(mesh.vertices)))
-	for i in range(0, len(vert_map)):
-		vert_map[i] = list()
-	for p in mesh.polygons:
-		for i in p.loop_indices:
-			loop = mesh.loops[i]
-			vert_map[loop.vertex_index].append([0, loop.index])
-	num_vertices = 0
-	for i, v in enumerate(mesh.vertices):
-		for vm in vert_map[i]:
-			vm[0] = num_vertices
-			num_vertices += 1
-			
-	prim = OrderedDict()
-	prim["primitive"] = index
-	
-	# vertices	
-	verts = prim["verts"] = []		
-	for i, v in enumerate(mesh.vertices):
-		for vm in vert_map[i]:
-			uv = mesh.uv_layers[0].data[vm[1]].uv
-			loop = mesh.loops[vm[1]]
-			vert = OrderedDict()
-			vert["xyz"] = (v.co.x * core._scale_to_game, v.co.y * core._scale_to_game, v.co.z * core._scale_to_game)
-			vert["st"] = (uv.x, 1.0 - uv.y)
-			vert["normal"] = (loop.normal.x, loop.normal.y, loop.normal.z)
-			verts.append(vert)
-	
-	# polygons
-	polygons = prim["polygons"] = []
-	for p in mesh.polygons:
-		poly = OrderedDict()
-		poly["material"] = obj.material_slots[p.material_index].name
-		indices = poly["indices"] = []
-		for i in p.loop_indices:
-			loop = mesh.loops[i]
-			v = mesh.vertices[loop.vertex_index]
-			uv = mesh.uv_layers[0].data[loop.index].uv
-			# find the vert_map nested list element with the matching loop.index
-			vm = next(x for x in vert_map[loop.vertex_index] if x[1] == loop.index)
-			indices.append(vm[0])
-		polygons.append(poly)
-
-	# finished, delete the temp object and mesh
-	bpy.ops.object.delete()
-	bpy.data.meshes.remove(mesh)
-	return prim
-	
-def export_map(context, filepath, indent):
-	# set object mode and clear selection
-	if context.active_object:
-		bpy.ops.object.mode_set(mode='OBJECT')
-	bpy.ops.object.select_all(action='DESELECT')
-	
-	data = OrderedDict()
-	data["version"] = 3
-	entities = data["entities"] = []
-	entity_index = 0
+# bump when the primitive format or how it's generated changes, so old cached fragments aren't used
+_export_cache_version = 1
+
+_look_ahead_jobs = 4 # pool jobs per worker kept in flight while exporting
+
+def get_export_cache_dir(filepath):
+	# one directory per exported map, so fragments it doesn't use anymore can be removed
+	key = os.path.normcase(os.path.realpath(filepath))
+	return bpy.utils.user_resource('CONFIG', os.path.join("bfg_forge_export_cache", hashlib.sha1(key.encode("utf-8")).hexdigest()), create=True)
 	
-	# write worldspawn
-	worldspawn = OrderedDict()
-	worldspawn["entity"] = entity_index
-	worldspawn["classname"] = "worldspawn"
-	primitives = worldspawn["primitives"] = []
+def hash_object_deformation(h, obj):
+	# what moves an object's geometry besides its own mesh: its transform, shape keys and pose
+	h.update(repr((obj.name, obj.type, [tuple(row) for row in obj.matrix_world])).encode("utf-8"))
+	if obj.type == 'MESH':
+		mesh = obj.data
+		if mesh.shape_keys:
+			h.update(repr((obj.active_shape_key_index, obj.show_only_shape_key, mesh.shape_keys.use_relative, [(kb.name, kb.value, kb.mute, kb.relative_key.name) for kb in mesh.shape_keys.key_blocks])).encode("utf-8"))
+	if obj.pose:
+		h.update(repr([(bone.name, [tuple(row) for row in bone.matrix]) for bone in obj.pose.bones]).encode("utf-8"))
+	
+def hash_modifier_targets(h, obj, visited):
+	# modifiers can depend on other objects, e.g. armatures, booleans and curves
+	# core.hash_rna_properties only hashes their names
+	for mod in obj.modifiers:
+		for prop in mod.bl_rna.properties:
+			if prop.type != 'POINTER' or prop.fixed_type.identifier != "Object":
+				continue
+			target = getattr(mod, prop.identifier, None)
+			if target and not target.name in visited:
+				visited.add(target.name)
+				hash_object_deformation(h, target)
+				if target.type == 'MESH':
+					core.hash_collection(h, target.data.vertices, "co", len(target.data.vertices) * 3, np.float32)
+				for target_mod in target.modifiers:
+					core.hash_rna_properties(h, target_mod)
+				hash_modifier_targets(h, target, visited)
+	
+def get_primitive_fingerprint(context, obj, obj_transform, index, options):
+	"""Hash everything that affects the serialized primitive of an object"""
+	h = hashlib.sha1()
+	h.update(core.get_object_fingerprint(context, obj).encode("utf-8"))
+	h.update(repr((_export_cache_version, index, options, [tuple(row) for row in obj_transform] if obj_transform is not None else None)).encode("utf-8"))
+	h.update(repr([slot.name for slot in obj.material_slots]).encode("utf-8"))
+	# get_object_fingerprint doesn't cover shape keys or other objects the modifiers use
+	hash_object_deformation(h, obj)
+	hash_modifier_targets(h, obj, set([obj.name]))
+	# split normals
+	mesh = obj.data
+	h.update(repr((mesh.use_auto_smooth, mesh.auto_smooth_angle)).encode("utf-8"))
+	if mesh.use_auto_smooth:
+		core.hash_collection(h, mesh.edges, "vertices", len(mesh.edges) * 2, np.int32)
+		core.hash_collection(h, mesh.edges, "use_edge_sharp", len(mesh.edges), np.bool_)
+	return h.hexdigest()
+	
+class CacheFragment(map_writer.Fragment):
+	# saved to the export cache when it's written, so the cache doesn't hold on to every fragment until the export is done
+	def __init__(self, fragment, path):
+		self.fragment = fragment
+		self.path = path
+		self.loops = getattr(fragment, "loops", 0)
+		self._text = None
+
+	@property
+	def text(self):
+		if self._text is None:
+			self._text = self.fragment.text
+			self.fragment = None
+			with open(self.path + ".tmp", 'w') as f:
+				f.write(self._text)
+			os.replace(self.path + ".tmp", self.path)
+		return self._text
+
+class ExportCache:
+	"""Serialized primitives of the objects of an exported map, stored on disk and keyed by a fingerprint of the object
+	Exporting again only regenerates the primitives of objects that have changed."""
+	def __init__(self, filepath, encoder):
+		self.dir = get_export_cache_dir(filepath)
+		self.encoder = encoder
+		self.used = set()
+		self.hits = 0
+		self.misses = 0
+		
+	def get_primitive(self, context, obj, obj_transform, index):
+		filename = get_primitive_fingerprint(context, obj, obj_transform, index, (self.encoder.indent, self.encoder.optimize_vertex_cache)) + ".json"
+		self.used.add(filename)
+		path = os.path.join(self.dir, filename)
+		if os.path.exists(path):
+			with open(path) as f:
+				self.hits += 1
+				return map_writer.Fragment(f.read())
+		self.misses += 1
+		return CacheFragment(self.encoder.encode(index, extract_primitive(context, obj, obj_transform)), path)
+		
+	def finish(self):
+		# remove fragments of objects that have changed or have been removed since the last export
+		for filename in os.listdir(self.dir):
+			if not filename in self.used:
+				os.remove(os.path.join(self.dir, filename))
+				
+class NullExportCache:
+	# used when exporting without a cache
+	def __init__(self, encoder):
+		self.encoder = encoder
+		
+	def get_primitive(self, context, obj, obj_transform, index):
+		return self.encoder.encode(index, extract_primitive(context, obj, obj_transform))
+		
+	def finish(self):
+		pass
+	
+def is_worldspawn_mesh(obj):
+	# plain mesh objects are written to worldspawn
+	# except for children of brush entities and objects in the "map" group, those are handled elsewhere
+	if obj.parent and obj.parent.bfg.type == 'BRUSH_ENTITY':
+		return False
+	map_group = bpy.data.groups.get("map")
+	if map_group and obj.name in map_group.objects:
+		return False
+	return obj.bfg.type == 'NONE' and obj.type == 'MESH'
+	
+def find_instances(context):
+	"""Group the worldspawn mesh objects that can share their geometry: the same mesh, materials and scale, and no modifiers
+	Returns a list of object lists, each with at least two objects."""
+	groups = OrderedDict()
+	for obj in context.scene.objects:
+		if is_worldspawn_mesh(obj) and len(obj.modifiers) == 0:
+			scale = tuple([round(c, 5) for c in obj.matrix_world.to_scale()])
+			# material slots can be linked to the object instead of the mesh
+			materials = tuple([slot.material.name if slot.material else "" for slot in obj.material_slots])
+			groups.setdefault((obj.data.name, materials, scale), []).append(obj)
+	return [objects for objects in groups.values() if len(objects) > 1]
+	
+def generate_worldspawn_primitives(context, cache, instanced):
 	primitive_index = 0
 	# write the "build map" output
 	built_obj = context.scene.objects.get("_worldspawn")
 	if built_obj:
-		primitives.append(create_primitive(context, built_obj, built_obj.matrix_world, primitive_index))
+		yield cache.get_primitive(context, built_obj, built_obj.matrix_world, primitive_index)
 		primitive_index += 1
-	# write plain mesh objects
-	# except for children of brush entities and objects in the "map" group, those are handled elsewhere
+	# write plain mesh objects, instanced ones are entities
 	for obj in context.scene.objects:
-		if obj.parent and obj.parent.bfg.type == 'BRUSH_ENTITY':
-			continue
-		map_group = bpy.data.groups.get("map")
-		if map_group and obj.name in map_group.objects:
-			continue
-		if obj.bfg.type == 'NONE' and obj.type == 'MESH':
-			primitives.append(create_primitive(context, obj, obj.matrix_world, primitive_index))
+		if is_worldspawn_mesh(obj) and not obj.name in instanced:
+			yield cache.get_primitive(context, obj, obj.matrix_world, primitive_index)
+			primitive_index += 1
+			
+def get_brush_primitives(context, obj):
+	"""The brush primitives of a brush entity's brushes, in object space. None if any of them can't be described by planes."""
+	primitives = []
+	for child in obj.children:
+		if child.bfg.type == 'BRUSH':
+			prim = map_writer.brush_from_arrays(len(primitives), extract_primitive(context, child, Matrix.Translation(-obj.location) * child.matrix_world))
+			if not prim:
+				return None
+			primitives.append(prim)
+	return primitives
+	
+def generate_brush_entity_primitives(context, cache, obj, use_brushes):
+	primitive_index = 0
+	# convex brushes are written as planes, otherwise use the "build map" output
+	brush_primitives = get_brush_primitives(context, obj) if use_brushes else None
+	if brush_primitives:
+		for prim in brush_primitives:
+			yield prim
+			primitive_index += 1
+	else:
+		# find the corresponding "build map" output for this brush entity
+		built_obj = context.scene.objects.get("_" + obj.name)
+		if built_obj:
+			# geometry must be exported in object space
+			yield cache.get_primitive(context, built_obj, Matrix.Translation(-obj.location) * built_obj.matrix_world, primitive_index)
+			primitive_index += 1
+	# handle plain mesh object children
+	for child in obj.children:
+		if child.bfg.type == 'NONE' and obj.type == 'MESH':
+			# geometry must be exported in object space
+			yield cache.get_primitive(context, child, Matrix.Translation(-obj.location) * child.matrix_world, primitive_index)
 			primitive_index += 1
-	entities.append(worldspawn)
-	entity_index += 1
 	
+def generate_instance_entities(context, cache, instances, entity_index):
+	# the first object of each group has the geometry, in object space without rotation. the others use its model.
+	for objects in instances:
+		model = objects[0].name
+		for obj in objects:
+			(location, rotation, scale) = obj.matrix_world.decompose()
+			ent = OrderedDict()
+			ent["entity"] = entity_index
+			ent["classname"] = "func_static"
+			ent["name"] = obj.name
+			ent["origin"] = tuple_to_float_string(location * core._scale_to_game)
+			ent["rotation"] = angles_to_rotation_string(rotation.to_euler('XYZ'))
+			ent["model"] = model
+			if obj == objects[0]:
+				ent["primitives"] = [cache.get_primitive(context, obj, Matrix.Scale(scale[0], 4, (1, 0, 0)) * Matrix.Scale(scale[1], 4, (0, 1, 0)) * Matrix.Scale(scale[2], 4, (0, 0, 1)), 0)]
+			yield ent
+			entity_index += 1
+	
+def generate_entities(context, cache, use_brushes, use_instancing):
+	# entities are produced one at a time while the map is being written
+	entity_index = 0
+	instances = find_instances(context) if use_instancing else []
+	instanced = set([obj.name for objects in instances for obj in objects])
+
+	# write worldspawn
+	worldspawn = OrderedDict()
+	worldspawn["entity"] = entity_index
+	worldspawn["classname"] = "worldspawn"
+	worldspawn["primitives"] = generate_worldspawn_primitives(context, cache, instanced)
+	yield worldspawn
+	entity_index += 1
+
 	# write the rest of the entities
 	for obj in context.scene.objects:
 		if obj.bfg.type in ['BRUSH_ENTITY', 'ENTITY', 'STATIC_MODEL'] or obj.type == 'LAMP':
@@ -163,25 +316,10 @@ def export_map(context, filepath, indent):
 				# brush entity primitives
 				if obj.bfg.type == 'BRUSH_ENTITY' and len(obj.children) > 0: # warn if brush entity has no children?
 					ent["model"] = obj.name
-					primitives = ent["primitives"] = []
-					primitive_index = 0
-					# find the corresponding "build map" output for this brush entity
-					built_obj = context.scene.objects.get("_" + obj.name)
-					if built_obj:
-						# geometry must be exported in object space
-						primitives.append(create_primitive(context, built_obj, Matrix.Translation(-obj.location) * built_obj.matrix_world, primitive_index))
-						primitive_index += 1
-					# handle plain mesh object children
-					for child in obj.children:
-						if child.bfg.type == 'NONE' and obj.type == 'MESH':
-							# geometry must be exported in object space
-							primitives.append(create_primitive(context, child, Matrix.Translation(-obj.location) * child.matrix_world, primitive_index))
-							primitive_index += 1
+					ent["primitives"] = generate_brush_entity_primitives(context, cache, obj, use_brushes)
 			elif obj.bfg.type == 'STATIC_MODEL':
 				ent["model"] = obj.bfg.entity_model.replace("\\", "/")
-				angles = obj.rotation_euler
-				rot = Euler((-angles[0], -angles[1], -angles[2]), 'XYZ').to_matrix()
-				ent["rotation"] = "%s %s %s" % (tuple_to_float_string(rot[0]), tuple_to_float_string(rot[1]), tuple_to_float_string(rot[2]))
+				ent["rotation"] = angles_to_rotation_string(obj.rotation_euler)
 			elif obj.type == 'LAMP':
 				ent["light_center"] = "0 0 0"
 				radius = ftos(obj.data.distance * core._scale_to_game)
@@ -191,10 +329,105 @@ def export_map(context, filepath, indent):
 				ent["nodiffuse"] = "%d" % 0 if obj.data.use_diffuse else 1
 				if obj.bfg.light_material != "default":
 					ent["texture"] = obj.bfg.light_material
-			entities.append(ent)
+			if obj.bfg.type == 'STATIC_MODEL' or obj.type == 'LAMP':
+				# keys the map importer couldn't map to object settings, e.g. light_target or skin
+				for prop in obj.game.properties:
+					if prop.name.startswith("custom_") and prop.value != "":
+						ent[prop.name[len("custom_"):]] = prop.value
+			yield ent
 			entity_index += 1
-	with open(filepath, 'w') as f:
-		json.dump(data, f, indent="\t" if indent else None)
+			
+	# mesh objects that share their geometry
+	for ent in generate_instance_entities(context, cache, instances, entity_index):
+		yield ent
+	
+class LookAhead:
+	"""Extract and submit primitives ahead of the writer, across entities, while fewer than max_loops are in flight
+	Keeps the pool's workers busy while the writer waits for fragments in order, without holding the whole map in memory."""
+	def __init__(self, entities, max_loops):
+		self.items = self.flatten(entities)
+		self.window = deque() # (entity, has primitives) and (None, fragment)
+		self.loops = 0
+		self.max_loops = max_loops
+		self.done = False
+
+	def flatten(self, entities):
+		for ent in entities:
+			primitives = ent.get("primitives")
+			yield (ent, primitives is not None)
+			if primitives is not None:
+				for fragment in primitives:
+					yield (None, fragment)
+
+	def weight(self, item):
+		return max(1, getattr(item[1], "loops", 0))
+
+	def peek(self):
+		while not self.done and (len(self.window) == 0 or self.loops < self.max_loops):
+			item = next(self.items, None)
+			if item is None:
+				self.done = True
+			else:
+				self.window.append(item)
+				self.loops += self.weight(item)
+		return self.window[0] if self.window else None
+
+	def pop(self):
+		item = self.window.popleft()
+		self.loops -= self.weight(item)
+		return item
+
+	def entities(self):
+		while self.peek():
+			(ent, has_primitives) = self.pop()
+			if has_primitives:
+				ent["primitives"] = self.primitives()
+			yield ent
+
+	def primitives(self):
+		# the fragments up to the next entity
+		while True:
+			item = self.peek()
+			if not item or item[0] is not None:
+				return
+			yield self.pop()[1]
+
+def export_map(context, filepath, indent, use_cache=True, num_workers=1, use_brushes=False, optimize_vertex_cache=False, use_instancing=False):
+	"""Export the scene to a JSON map. With more than one worker, primitives are encoded in worker processes while the next ones are extracted.
+	Returns the vertex_cache.Stats of the primitives that were encoded, cached ones aren't included."""
+	# anything created while exporting that isn't freed is reported as a leak
+	with temp_data.TempData("Export Map"):
+		# objects being edited need to be written back to their meshes
+		if context.active_object and context.active_object.mode != 'OBJECT':
+			bpy.ops.object.mode_set(mode='OBJECT')
+	
+		data = OrderedDict()
+		data["version"] = 3
+		indent = "\t" if indent else None
+		if num_workers > 1:
+			encoder = export_pool.ExportPool(indent, _primitive_level, optimize_vertex_cache, num_workers, bpy.app.binary_path_python)
+		else:
+			encoder = export_pool.SerialEncoder(indent, _primitive_level, optimize_vertex_cache)
+		cache = ExportCache(filepath, encoder) if use_cache else NullExportCache(encoder)
+		temp_filepath = filepath + ".tmp"
+		try:
+			entities = generate_entities(context, cache, use_brushes, use_instancing)
+			if num_workers > 1:
+				# extract ahead so the workers are kept busy, encoded primitives are waited for in order while writing
+				entities = LookAhead(entities, num_workers * _look_ahead_jobs * export_pool._job_loops).entities()
+			data["entities"] = entities
+			# entities are written as they're generated, write to a temp file so a failed export doesn't leave a partial map behind
+			with open(temp_filepath, 'w') as f:
+				map_writer.dump(data, f, indent=indent)
+			os.replace(temp_filepath, filepath)
+		finally:
+			encoder.close()
+			if os.path.exists(temp_filepath):
+				os.remove(temp_filepath)
+		cache.finish()
+		if optimize_vertex_cache and encoder.stats.triangles > 0:
+			print("Vertex cache ACMR: %.3f before, %.3f after, %d triangles" % (encoder.stats.acmr() + (encoder.stats.triangles,)))
+		return encoder.stats
 
 class ExportMap(bpy.types.Operator, ExportHelper):
 	bl_idname = "export_scene.rbdoom_map_json"
@@ -202,9 +435,16 @@ class ExportMap(bpy.types.Operator, ExportHelper):
 	bl_options = {'PRESET'}
 	filename_ext = ".json"
 	indent = bpy.props.BoolProperty(name="Indent", default=False)
+	use_cache = bpy.props.BoolProperty(name="Cache", description="Reuse the primitives of objects that haven't changed since the last export", default=True)
+	use_brushes = bpy.props.BoolProperty(name="Brushes", description="Export the brushes of brush entities as planes when they're all convex, instead of the triangles of the built mesh", default=False)
+	use_instancing = bpy.props.BoolProperty(name="Instancing", description="Export mesh objects that share a mesh as func_static entities using one copy of the geometry", default=False)
+	optimize_vertex_cache = bpy.props.BoolProperty(name="Optimize vertex cache", description="Reorder triangles and vertices for the GPU's vertex cache", default=False)
+	num_workers = bpy.props.IntProperty(name="Workers", description="Number of processes encoding primitives. 1 encodes them while exporting.", default=1, min=1, max=256)
 		
 	def execute(self, context):
-		export_map(context, self.filepath, self.indent)
+		stats = export_map(context, self.filepath, self.indent, self.use_cache, self.num_workers, self.use_brushes, self.optimize_vertex_cache, self.use_instancing)
+		if self.optimize_vertex_cache and stats.triangles > 0:
+			self.report({'INFO'}, "Vertex cache ACMR: %.3f before, %.3f after" % stats.acmr())
 		return {'FINISHED'}
 	
 def menu_func_export(self, context):
@@ -0,0 +1,136 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# encode exported primitives - weld vertices and serialize them - in a pool of worker processes
+# the main thread extracts mesh arrays with bpy and submits them, the workers encode them while the next ones are extracted
+# the workers run blender's python without bpy, so this module and the ones it imports must not use bpy
+
+import multiprocessing, sys, types
+from . import map_writer, vertex_cache
+
+# small primitives are batched, each job sent to a worker encodes about this many loops
+_job_loops = 20000
+# maps with fewer loops than this are encoded in the main thread, starting the pool costs more than encoding them
+_min_pool_loops = 20000
+
+def encode_primitive(index, arrays, indent, level, optimize_vertex_cache):
+	"""Return the serialized primitive of a triangulated mesh's arrays, and its vertex_cache.Stats"""
+	stats = vertex_cache.Stats()
+	prim = map_writer.primitive_from_arrays(index, arrays, optimize_vertex_cache, stats)
+	return (map_writer.to_string(prim, indent, level), stats)
+
+def _encode_jobs(jobs):
+	return [encode_primitive(*job) for job in jobs]
+
+class _Batch:
+	# primitives encoded by one pool job
+	def __init__(self):
+		self.jobs = [] # encode_primitive arguments, until the batch is submitted
+		self.loops = 0
+		self.result = None # AsyncResult once submitted
+		self.results = None # [(text, stats)] once encoded
+
+class PendingFragment(map_writer.Fragment):
+	# a fragment that's still being encoded, waited for when it's written
+	def __init__(self, encoder, batch, position, loops):
+		self.encoder = encoder
+		self.batch = batch
+		self.position = position
+		self.loops = loops
+		self._text = None
+
+	@property
+	def text(self):
+		if self._text is None:
+			if self.batch.results is None:
+				if self.batch.result is None:
+					# the writer caught up with a batch that isn't full yet
+					self.encoder.submit(self.batch)
+				if self.batch.results is None:
+					self.batch.results = self.batch.result.get()
+			(self._text, stats) = self.batch.results[self.position]
+			self.batch.results[self.position] = None
+			self.encoder.stats.add(stats)
+			self.batch = None
+		return self._text
+
+class SerialEncoder:
+	def __init__(self, indent, level, optimize_vertex_cache=False):
+		self.indent = indent
+		self.level = level
+		self.optimize_vertex_cache = optimize_vertex_cache
+		self.stats = vertex_cache.Stats() # of the primitives that have been encoded
+
+	def encode(self, index, arrays):
+		(text, stats) = encode_primitive(index, arrays, self.indent, self.level, self.optimize_vertex_cache)
+		self.stats.add(stats)
+		return map_writer.Fragment(text)
+
+	def close(self):
+		pass
+
+class ExportPool(SerialEncoder):
+	def __init__(self, indent, level, optimize_vertex_cache, num_workers, executable):
+		"""executable is the python the workers run, e.g. bpy.app.binary_path_python. The pool is started when it's first needed."""
+		SerialEncoder.__init__(self, indent, level, optimize_vertex_cache)
+		self.num_workers = num_workers
+		self.executable = executable
+		self.pool = None
+		self.batch = _Batch()
+		self.total_loops = 0
+
+	def start(self):
+		context = multiprocessing.get_context("spawn")
+		context.set_executable(self.executable)
+		# spawned processes run the parent's main script first, which could be e.g. cli.py and need bpy. hide it while they're started.
+		main_module = sys.modules["__main__"]
+		sys.modules["__main__"] = types.ModuleType("__main__")
+		try:
+			self.pool = context.Pool(self.num_workers)
+		finally:
+			sys.modules["__main__"] = main_module
+
+	def encode(self, index, arrays):
+		loops = len(arrays["loop_vertices"])
+		if self.batch.jobs and self.batch.loops + loops > _job_loops:
+			self.submit(self.batch)
+		batch = self.batch
+		batch.jobs.append((index, arrays, self.indent, self.level, self.optimize_vertex_cache))
+		batch.loops += loops
+		self.total_loops += loops
+		fragment = PendingFragment(self, batch, len(batch.jobs) - 1, loops)
+		if batch.loops >= _job_loops:
+			self.submit(batch)
+		return fragment
+
+	def submit(self, batch):
+		"""Send a batch to a worker, or encode it here while the map is too small for the pool to be worth starting"""
+		if batch is self.batch:
+			self.batch = _Batch()
+		if not self.pool and self.total_loops < _min_pool_loops:
+			batch.results = _encode_jobs(batch.jobs)
+		else:
+			if not self.pool:
+				self.start()
+			batch.result = self.pool.apply_async(_encode_jobs, [batch.jobs])
+		batch.jobs = None
+
+	def close(self):
+		if self.pool:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
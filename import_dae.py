@@ -0,0 +1,272 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# COLLADA geometry reader
+# streams the document with iterparse and only keeps what's needed to build a single mesh:
+# geometry sources, primitives, material symbols and node transforms
+
+import bpy, math, os
+import numpy as np
+import xml.etree.ElementTree as ET
+from . import mesh_utils
+
+class DaePrimitive:
+	def __init__(self, tag, material):
+		self.tag = tag # triangles, polylist or polygons
+		self.material = material # material symbol
+		self.inputs = [] # (semantic, source id, offset, set)
+		self.vcount = None
+		self.p = []
+
+class DaeGeometry:
+	def __init__(self):
+		self.positions = np.zeros((0, 3))
+		self.loop_positions = np.zeros(0, dtype=np.int32)
+		self.loop_uvs = None
+		self.loop_totals = np.zeros(0, dtype=np.int32)
+		self.polygon_symbols = [] # (material symbol, number of polygons)
+
+def strip_namespace(tag):
+	return tag.rsplit("}", 1)[-1]
+
+def strip_url(url):
+	return url[1:] if url.startswith("#") else url
+
+def fix_material_name(name):
+	# fix collada mangling
+	name = name.replace("_", "/")
+	if name.endswith("-material"):
+		name = name[:-len("-material")]
+	# remove filename extensions
+	# e.g. "models/items/rocket_ammo/rocket_large.tga" should be "models/items/rocket_ammo/rocket_large"
+	return os.path.splitext(name)[0]
+
+def parse_transform(tag, values):
+	if tag == "matrix":
+		return values.reshape(4, 4)
+	m = np.identity(4)
+	if tag == "translate":
+		m[:3, 3] = values[:3]
+	elif tag == "scale":
+		m[0, 0], m[1, 1], m[2, 2] = values[:3]
+	elif tag == "rotate":
+		axis = values[:3] / max(np.linalg.norm(values[:3]), 1e-12)
+		angle = math.radians(values[3])
+		c, s = math.cos(angle), math.sin(angle)
+		x, y, z = axis
+		m[:3, :3] = [
+			[c + x * x * (1 - c), x * y * (1 - c) - z * s, x * z * (1 - c) + y * s],
+			[y * x * (1 - c) + z * s, c + y * y * (1 - c), y * z * (1 - c) - x * s],
+			[z * x * (1 - c) - y * s, z * y * (1 - c) + x * s, c + z * z * (1 - c)]]
+	return m
+
+def build_geometry(prims, sources, vertices):
+	"""Flatten a geometry's primitives into loop arrays"""
+	geom = DaeGeometry()
+	position_source = None
+	loop_positions = []
+	loop_uvs = []
+	loop_totals = []
+	uv_source = None
+	for prim in prims:
+		stride = max([i[2] for i in prim.inputs]) + 1 if prim.inputs else 1
+		vertex_offset = None
+		uv_offset = None
+		for (semantic, source, offset, set) in prim.inputs:
+			if semantic == "VERTEX":
+				vertex_offset = offset
+				position_source = vertices.get(source, source)
+			elif semantic == "TEXCOORD" and (uv_offset == None or set == 0):
+				uv_offset = offset
+				uv_source = source
+		if vertex_offset == None:
+			continue
+		if prim.tag == "polygons":
+			# one <p> per polygon
+			totals = np.array([len(p) // stride for p in prim.p], dtype=np.int32)
+			p = np.concatenate(prim.p) if prim.p else np.zeros(0, dtype=np.int32)
+		else:
+			p = np.concatenate(prim.p) if prim.p else np.zeros(0, dtype=np.int32)
+			if prim.tag == "triangles":
+				totals = np.full(len(p) // (stride * 3), 3, dtype=np.int32)
+			else:
+				totals = prim.vcount if prim.vcount is not None else np.zeros(0, dtype=np.int32)
+		p = p[:int(totals.sum()) * stride].reshape(-1, stride)
+		# drop points and lines
+		keep = totals >= 3
+		if not keep.all():
+			loop_keep = np.repeat(keep, totals)
+			p = p[loop_keep]
+			totals = totals[keep]
+		loop_positions.append(p[:, vertex_offset])
+		loop_uvs.append(p[:, uv_offset] if uv_offset != None else None)
+		loop_totals.append(totals)
+		geom.polygon_symbols.append((prim.material, len(totals)))
+	if position_source == None or not position_source in sources or not loop_totals:
+		return None
+	(values, source_stride) = sources[position_source]
+	geom.positions = values[:len(values) // source_stride * source_stride].reshape(-1, source_stride)[:, :3]
+	geom.loop_positions = np.concatenate(loop_positions)
+	geom.loop_totals = np.concatenate(loop_totals)
+	if uv_source in sources and all([uvs is not None for uvs in loop_uvs]):
+		(values, source_stride) = sources[uv_source]
+		uvs = values[:len(values) // source_stride * source_stride].reshape(-1, source_stride)[:, :2]
+		geom.loop_uvs = uvs[np.concatenate(loop_uvs)]
+	return geom
+
+def load_dae(filename):
+	"""Read all the instanced geometry of a COLLADA file, joined into one mesh
+	return a tuple of (x y z, loop vertex indices, loop totals, material indices, loop uvs, material names)"""
+	up_axis = "Z_UP"
+	materials = {} # material id: name
+	geometries = {} # geometry id: DaeGeometry
+	instances = [] # (geometry id, world matrix, {symbol: material id})
+	# per-geometry parse state
+	sources = {} # source id: (values, stride)
+	vertices = {} # vertices id: position source id
+	prims = []
+	source_id = None
+	vertices_id = None
+	prim = None
+	# visual scene parse state
+	node_matrices = []
+	bind = None
+	for event, elem in ET.iterparse(filename, events=("start", "end")):
+		tag = strip_namespace(elem.tag)
+		if event == "start":
+			if tag == "source":
+				source_id = elem.get("id")
+			elif tag == "vertices":
+				vertices_id = elem.get("id")
+			elif tag in ["triangles", "polylist", "polygons"]:
+				prim = DaePrimitive(tag, elem.get("material", ""))
+			elif tag == "node":
+				node_matrices.append(node_matrices[-1].copy() if node_matrices else np.identity(4))
+			elif tag == "instance_geometry":
+				bind = {}
+			continue
+		# end events
+		if tag == "up_axis":
+			up_axis = (elem.text or "Z_UP").strip()
+		elif tag == "float_array":
+			if source_id:
+				sources[source_id] = (np.array((elem.text or "").split(), dtype=np.float64), 1)
+			elem.clear()
+		elif tag == "accessor":
+			if source_id in sources:
+				sources[source_id] = (sources[source_id][0], int(elem.get("stride", "1")))
+		elif tag == "source":
+			source_id = None
+		elif tag == "input":
+			semantic = elem.get("semantic")
+			source = strip_url(elem.get("source", ""))
+			if prim:
+				prim.inputs.append((semantic, source, int(elem.get("offset", "0")), int(elem.get("set", "0"))))
+			elif vertices_id and semantic == "POSITION":
+				vertices[vertices_id] = source
+		elif tag == "vertices":
+			vertices_id = None
+		elif tag == "vcount":
+			if prim:
+				prim.vcount = np.array((elem.text or "").split(), dtype=np.int32)
+			elem.clear()
+		elif tag == "p":
+			if prim:
+				prim.p.append(np.array((elem.text or "").split(), dtype=np.int32))
+			elem.clear()
+		elif tag in ["triangles", "polylist", "polygons"]:
+			prims.append(prim)
+			prim = None
+		elif tag == "geometry":
+			geom = build_geometry(prims, sources, vertices)
+			if geom:
+				geometries[elem.get("id")] = geom
+			sources = {}
+			vertices = {}
+			prims = []
+			elem.clear()
+		elif tag == "material":
+			materials[elem.get("id")] = elem.get("name") or elem.get("id")
+			elem.clear()
+		elif tag in ["matrix", "translate", "rotate", "scale"]:
+			if node_matrices:
+				values = np.array((elem.text or "").split(), dtype=np.float64)
+				node_matrices[-1] = node_matrices[-1].dot(parse_transform(tag, values))
+		elif tag == "instance_material":
+			if bind != None:
+				bind[elem.get("symbol")] = strip_url(elem.get("target", ""))
+		elif tag == "instance_geometry":
+			instances.append((strip_url(elem.get("url", "")), node_matrices[-1] if node_matrices else np.identity(4), bind))
+			bind = None
+		elif tag == "node":
+			node_matrices.pop()
+		elif tag in ["library_geometries", "library_visual_scenes"]:
+			elem.clear()
+
+	# no visual scene: use all the geometry as is
+	if not instances:
+		instances = [(geom_id, np.identity(4), {}) for geom_id in geometries]
+
+	# convert to z up
+	if up_axis == "Y_UP":
+		up_matrix = np.array([[1, 0, 0, 0], [0, 0, -1, 0], [0, 1, 0, 0], [0, 0, 0, 1]], dtype=np.float64)
+	elif up_axis == "X_UP":
+		up_matrix = np.array([[0, -1, 0, 0], [0, 0, -1, 0], [1, 0, 0, 0], [0, 0, 0, 1]], dtype=np.float64)
+	else:
+		up_matrix = np.identity(4)
+
+	# join the instances
+	positions = []
+	loop_vertices = []
+	loop_totals = []
+	material_indices = []
+	uvs = []
+	material_names = []
+	has_uvs = all([geometries[i[0]].loop_uvs is not None for i in instances if i[0] in geometries])
+	num_vertices = 0
+	for (geom_id, matrix, bind) in instances:
+		geom = geometries.get(geom_id)
+		if not geom:
+			continue
+		m = up_matrix.dot(matrix)
+		positions.append(geom.positions.dot(m[:3, :3].T) + m[:3, 3])
+		loop_vertices.append(geom.loop_positions + num_vertices)
+		num_vertices += len(geom.positions)
+		loop_totals.append(geom.loop_totals)
+		if has_uvs:
+			uvs.append(geom.loop_uvs)
+		for (symbol, count) in geom.polygon_symbols:
+			material_id = bind.get(symbol, symbol)
+			name = fix_material_name(materials.get(material_id, material_id))
+			if not name in material_names:
+				material_names.append(name)
+			material_indices.append(np.full(count, material_names.index(name), dtype=np.int32))
+	if not loop_totals:
+		return None
+	return (np.concatenate(positions), np.concatenate(loop_vertices), np.concatenate(loop_totals), np.concatenate(material_indices), np.concatenate(uvs) if has_uvs else None, material_names)
+
+def read_dae(filename):
+	"""Create an object from a COLLADA file and link it to the scene"""
+	result = load_dae(filename)
+	if not result:
+		return None
+	(positions, loop_vertices, loop_totals, material_indices, uvs, material_names) = result
+	name = os.path.splitext(os.path.basename(filename))[0]
+	mesh = mesh_utils.create_mesh(name, positions, loop_vertices, loop_totals, material_indices, uvs, material_names)
+	obj = bpy.data.objects.new(name, mesh)
+	bpy.context.scene.objects.link(obj)
+	return obj
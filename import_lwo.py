@@ -0,0 +1,235 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# LightWave LWO2 reader
+# only the chunks Doom 3 cares about are read: TAGS, LAYR, PNTS, VMAP/VMAD (TXUV), POLS (FACE/PTCH) and PTAG (SURF)
+
+import bpy, os, struct
+from . import mesh_utils
+
+class LwoLayer:
+	def __init__(self):
+		self.points = () # x y z, lightwave coordinates
+		self.polygons = [] # list of point index tuples
+		self.surfaces = {} # polygon index: tag index
+		self.uvs = {} # TXUV vmap name: {point index: (u, v)}
+		self.uvs_discontinuous = {} # TXUV vmad name: {(point index, polygon index): (u, v)}
+		self.polygon_offset = 0 # index of the first polygon of the last POLS chunk, None if it wasn't read
+
+class LwoFile:
+	def __init__(self):
+		self.tags = []
+		self.layers = []
+
+def read_vx(data, pos):
+	# variable length index: 2 bytes, or 4 bytes if the first byte is 0xFF
+	if data[pos] == 0xFF:
+		return (struct.unpack_from(">I", data, pos)[0] & 0x00FFFFFF, pos + 4)
+	return (struct.unpack_from(">H", data, pos)[0], pos + 2)
+
+def read_string(data, pos):
+	# null terminated, padded to an even length
+	end = pos
+	while data[end] != 0:
+		end += 1
+	s = bytes(data[pos:end]).decode("latin-1")
+	end += 1
+	if (end - pos) % 2 != 0:
+		end += 1
+	return (s, end)
+
+def is_short_vx_records(data, start, end, record_size):
+	# true if every record in [start, end) starts with a 2 byte VX, so the whole chunk can be unpacked in one go
+	if (end - start) % record_size != 0:
+		return False
+	return not b"\xff" in bytes(data[start:end:record_size])
+
+def read_tags(data, start, end):
+	tags = []
+	pos = start
+	while pos < end:
+		(tag, pos) = read_string(data, pos)
+		tags.append(tag)
+	return tags
+
+def read_pnts(data, start, end):
+	return struct.unpack_from(">%df" % ((end - start) // 4), data, start)
+
+def read_pols(data, start, end, polygons):
+	pos = start
+	while pos < end:
+		count = struct.unpack_from(">H", data, pos)[0] & 0x03FF # top 6 bits are flags
+		pos += 2
+		if not b"\xff" in bytes(data[pos:pos + count * 2:2]):
+			polygons.append(struct.unpack_from(">%dH" % count, data, pos))
+			pos += count * 2
+		else:
+			indices = []
+			for _ in range(count):
+				(index, pos) = read_vx(data, pos)
+				indices.append(index)
+			polygons.append(tuple(indices))
+
+def read_ptag(data, start, end, surfaces, polygon_offset):
+	# polygon indices are relative to the POLS chunk before this one
+	if is_short_vx_records(data, start, end, 4):
+		values = struct.unpack_from(">%dH" % ((end - start) // 2), data, start)
+		surfaces.update(zip([polygon_offset + v for v in values[0::2]], values[1::2]))
+	else:
+		pos = start
+		while pos < end:
+			(polygon, pos) = read_vx(data, pos)
+			surfaces[polygon_offset + polygon] = struct.unpack_from(">H", data, pos)[0]
+			pos += 2
+
+def read_vmap(data, start, end, dimension):
+	# returns {point index: values}
+	record_size = 2 + dimension * 4
+	if is_short_vx_records(data, start, end, record_size):
+		n = (end - start) // record_size
+		values = struct.unpack_from(">" + ("H" + "f" * dimension) * n, data, start)
+		stride = dimension + 1
+		return dict(zip(values[0::stride], zip(*[values[i::stride] for i in range(1, stride)])))
+	result = {}
+	pos = start
+	while pos < end:
+		(point, pos) = read_vx(data, pos)
+		result[point] = struct.unpack_from(">%df" % dimension, data, pos)
+		pos += dimension * 4
+	return result
+
+def read_vmad(data, start, end, dimension, polygon_offset, result):
+	# adds {(point index, polygon index): values} to result
+	# polygon indices are relative to the POLS chunk before this one
+	pos = start
+	while pos < end:
+		if data[pos] != 0xFF and data[pos + 2] != 0xFF:
+			(point, polygon) = struct.unpack_from(">HH", data, pos)
+			pos += 4
+		else:
+			(point, pos) = read_vx(data, pos)
+			(polygon, pos) = read_vx(data, pos)
+		result[(point, polygon_offset + polygon)] = struct.unpack_from(">%df" % dimension, data, pos)
+		pos += dimension * 4
+
+def read_lwo_file(filename):
+	with open(filename, "rb") as f:
+		data = memoryview(f.read())
+	if len(data) < 12 or bytes(data[0:4]) != b"FORM":
+		raise Exception("\"%s\" is not an IFF file" % filename)
+	form_type = bytes(data[8:12])
+	if form_type != b"LWO2":
+		raise Exception("\"%s\" unsupported LightWave format \"%s\"" % (filename, form_type.decode("latin-1")))
+	form_end = min(len(data), 8 + struct.unpack_from(">I", data, 4)[0])
+	lwo = LwoFile()
+	layer = None
+	pos = 12
+	while pos + 8 <= form_end:
+		chunk_id = bytes(data[pos:pos + 4])
+		chunk_size = struct.unpack_from(">I", data, pos + 4)[0]
+		start = pos + 8
+		end = min(start + chunk_size, form_end)
+		pos = end + (chunk_size & 1) # chunks are padded to an even length
+		if chunk_id == b"TAGS":
+			lwo.tags = read_tags(data, start, end)
+		elif chunk_id == b"LAYR":
+			layer = LwoLayer()
+			lwo.layers.append(layer)
+		elif chunk_id in [b"PNTS", b"POLS", b"PTAG", b"VMAP", b"VMAD"]:
+			if not layer: # LAYR is required, but be lenient
+				layer = LwoLayer()
+				lwo.layers.append(layer)
+			if chunk_id == b"PNTS":
+				layer.points = read_pnts(data, start, end)
+			elif chunk_id == b"POLS":
+				pols_type = bytes(data[start:start + 4])
+				if pols_type in [b"FACE", b"PTCH"]:
+					layer.polygon_offset = len(layer.polygons)
+					read_pols(data, start + 4, end, layer.polygons)
+				else:
+					layer.polygon_offset = None # e.g. bones, the PTAG and VMAD chunks after this aren't about our polygons
+			elif chunk_id == b"PTAG":
+				if bytes(data[start:start + 4]) == b"SURF" and layer.polygon_offset != None:
+					read_ptag(data, start + 4, end, layer.surfaces, layer.polygon_offset)
+			else:
+				vmap_type = bytes(data[start:start + 4])
+				dimension = struct.unpack_from(">H", data, start + 4)[0]
+				(name, vmap_start) = read_string(data, start + 6)
+				if vmap_type == b"TXUV" and dimension == 2:
+					if chunk_id == b"VMAP":
+						layer.uvs[name] = read_vmap(data, vmap_start, end, dimension)
+					elif layer.polygon_offset != None:
+						# a vmad can be split over the POLS chunks of a layer
+						read_vmad(data, vmap_start, end, dimension, layer.polygon_offset, layer.uvs_discontinuous.setdefault(name, {}))
+	return lwo
+
+def load_lwo(filename):
+	"""Flatten all the layers of a LWO2 file into one mesh with one material per surface
+	return a tuple of (x y z, loop vertex indices, loop totals, material indices, loop uvs, material names)"""
+	lwo = read_lwo_file(filename)
+	positions = []
+	loop_vertices = []
+	loop_totals = []
+	material_indices = []
+	uvs = []
+	material_names = []
+	tag_materials = {} # tag index: material index
+	for layer in lwo.layers:
+		vertex_offset = len(positions) // 3
+		# swap y and z: lightwave is y up
+		points = layer.points
+		swapped = [0.0] * len(points)
+		swapped[0::3] = points[0::3]
+		swapped[1::3] = points[2::3]
+		swapped[2::3] = points[1::3]
+		positions.extend(swapped)
+		# use the first TXUV map, doom 3 does the same
+		# per-polygon VMAD values override the per-point VMAP ones
+		vmap_name = next(iter(layer.uvs), None)
+		vmap = layer.uvs.get(vmap_name, {})
+		vmad = layer.uvs_discontinuous.get(vmap_name)
+		if vmad == None and layer.uvs_discontinuous:
+			vmad = next(iter(layer.uvs_discontinuous.values()))
+		for polygon_index, polygon in enumerate(layer.polygons):
+			if len(polygon) < 3:
+				continue # ignore points and lines
+			tag = layer.surfaces.get(polygon_index, 0)
+			material_index = tag_materials.get(tag)
+			if material_index == None:
+				material_index = tag_materials[tag] = len(material_names)
+				name = lwo.tags[tag] if tag < len(lwo.tags) else "_default"
+				# remove filename extensions
+				# e.g. "models/items/rocket_ammo/rocket_large.tga" should be "models/items/rocket_ammo/rocket_large"
+				material_names.append(os.path.splitext(name)[0])
+			material_indices.append(material_index)
+			loop_totals.append(len(polygon))
+			for point in polygon:
+				loop_vertices.append(vertex_offset + point)
+				uv = vmad.get((point, polygon_index)) if vmad else None
+				if not uv:
+					uv = vmap.get(point, (0.0, 0.0))
+				uvs.extend(uv)
+	return (positions, loop_vertices, loop_totals, material_indices, uvs, material_names)
+
+def read_lwo(filename):
+	"""Create an object from a LWO2 file and link it to the scene"""
+	(positions, loop_vertices, loop_totals, material_indices, uvs, material_names) = load_lwo(filename)
+	name = os.path.splitext(os.path.basename(filename))[0]
+	mesh = mesh_utils.create_mesh(name, positions, loop_vertices, loop_totals, material_indices, uvs, material_names)
+	obj = bpy.data.objects.new(name, mesh)
+	bpy.context.scene.objects.link(obj)
+	return obj
@@ -0,0 +1,517 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# RBDOOM-3-BFG JSON map reader, the inverse of export_map, and Doom 3 .map reader
+# the JSON entity list is streamed: each entity is decoded and added to the scene before the next one is read
+# .map files are tokenized with lexer.Lexer into entities with the same layout as JSON ones
+# primitive meshes are created in bulk from their verts and polygons arrays, see mesh_utils.create_mesh
+# brushes and patches are turned into polygons by map_geometry
+
+import bpy, gc, itertools, json, math, os, re, time
+import numpy as np
+from . import core, lexer, map_geometry, mesh_utils
+from bpy_extras.io_utils import ImportHelper
+from collections import OrderedDict
+from mathutils import Euler, Matrix, Vector
+
+_read_size = 1 << 24 # characters read at a time, grows whenever an entity doesn't fit in what's been read
+_entities_start = re.compile(r'"entities"\s*:\s*\[')
+_version = re.compile(r'"version"\s*:\s*(\d+)')
+_entity_separator = re.compile(r'[\s,]*')
+
+# keys that are written from object settings instead of game properties, see export_map.generate_entities
+_object_keys = ["entity", "classname", "name", "origin", "angle", "rotation", "primitives"]
+_light_keys = ["entity", "classname", "name", "origin", "light_radius", "_color", "nospecular", "nodiffuse", "texture"]
+_static_model_keys = _object_keys + ["model"]
+
+class JsonMapReader:
+	"""Decode the entities of a JSON map one at a time, without reading the whole file first"""
+	def __init__(self, f):
+		self.f = f
+		self.buffer = ""
+		self.pos = 0
+		self.eof = False
+		self.read_size = _read_size
+		self.decoder = json.JSONDecoder()
+		self.version = None
+
+	def read_more(self):
+		"""Append the next chunk of the file to the unread part of the buffer. Returns False at the end of the file."""
+		data = self.f.read(self.read_size)
+		if not data:
+			self.eof = True
+			return False
+		self.buffer = self.buffer[self.pos:] + data
+		self.pos = 0
+		return True
+
+	def read_header(self):
+		# everything up to the start of the entity list, i.e. the version
+		while True:
+			match = _entities_start.search(self.buffer)
+			if match:
+				break
+			if not self.read_more():
+				raise Exception("Not a JSON map, no entity list found")
+		version = _version.search(self.buffer, 0, match.start())
+		if version:
+			self.version = int(version.group(1))
+		self.pos = match.end()
+
+	def decode(self):
+		# entities are trees of small dicts and lists without cycles, don't let the garbage collector walk them over and over while they're built
+		gc_enabled = gc.isenabled()
+		gc.disable()
+		try:
+			return self.decoder.raw_decode(self.buffer, self.pos)
+		finally:
+			if gc_enabled:
+				gc.enable()
+
+	def entities(self):
+		self.read_header()
+		while True:
+			self.pos = _entity_separator.match(self.buffer, self.pos).end()
+			if self.pos == len(self.buffer):
+				if not self.read_more():
+					raise Exception("Unexpected end of map file")
+				continue
+			if self.buffer[self.pos] == "]":
+				return
+			try:
+				(ent, self.pos) = self.decode()
+			except ValueError:
+				# the entity is incomplete, or malformed if there's nothing left to read
+				# read in bigger and bigger chunks so a huge worldspawn isn't decoded over and over
+				if not self.read_more():
+					raise
+				self.read_size *= 4
+				continue
+			yield ent
+
+def read_entities(filename):
+	"""Yield the entities of a JSON map as dictionaries"""
+	with open(filename, "r") as f:
+		reader = JsonMapReader(f)
+		for ent in reader.entities():
+			if reader.version != None and reader.version != 3:
+				raise Exception("\"%s\" has unsupported map version %d" % (filename, reader.version))
+			yield ent
+
+def parse_floats(lex, count):
+	return [float(lex.parse_token()) for _ in range(count)]
+
+def parse_brush_def3(lex):
+	# brushDef3 { ( a b c d ) ( ( a b c ) ( d e f ) ) "material" contents flags value ... }
+	sides = []
+	lex.expect_token("{")
+	while True:
+		token = lex.parse_token()
+		if token == "}":
+			break
+		if token != "(":
+			raise Exception("expected token \"(\", got \"%s\" on line %d" % (token, lex.line))
+		side = OrderedDict()
+		side["plane"] = parse_floats(lex, 4)
+		lex.expect_token(")")
+		lex.expect_token("(")
+		lex.expect_token("(")
+		s = parse_floats(lex, 3)
+		lex.expect_token(")")
+		lex.expect_token("(")
+		t = parse_floats(lex, 3)
+		lex.expect_token(")")
+		lex.expect_token(")")
+		side["material"] = lex.parse_token()
+		side["textureMatrix"] = [s, t]
+		parse_floats(lex, 3)
+		sides.append(side)
+	return sides
+
+def parse_patch_def(lex, explicit_subdivisions):
+	# patchDef2 { "material" ( width height 0 0 0 ) ( ( ( x y z s t ) ... ) ... ) }
+	# patchDef3 has ( width height horizontal_subdivisions vertical_subdivisions 0 0 0 )
+	patch = OrderedDict()
+	lex.expect_token("{")
+	patch["material"] = lex.parse_token()
+	lex.expect_token("(")
+	info = parse_floats(lex, 7 if explicit_subdivisions else 5)
+	lex.expect_token(")")
+	(width, height) = (int(info[0]), int(info[1]))
+	patch["subdivisions"] = [int(info[2]), int(info[3])] if explicit_subdivisions else None
+	control = []
+	lex.expect_token("(")
+	for i in range(width):
+		lex.expect_token("(")
+		row = []
+		for j in range(height):
+			lex.expect_token("(")
+			row.append(parse_floats(lex, 5))
+			lex.expect_token(")")
+		lex.expect_token(")")
+		control.append(row)
+	lex.expect_token(")")
+	lex.expect_token("}")
+	patch["control"] = control
+	return patch
+
+def parse_primitive(lex):
+	# after the opening brace of a primitive
+	prim = OrderedDict()
+	token = lex.parse_token()
+	if token == "brushDef3":
+		prim["brush"] = parse_brush_def3(lex)
+	elif token in ["patchDef2", "patchDef3"]:
+		prim["patch"] = parse_patch_def(lex, token == "patchDef3")
+	else:
+		# e.g. old brushDef
+		prim["unsupported"] = token
+		lex.skip_bracket_delimiter_section("{", "}")
+	lex.expect_token("}")
+	return prim
+
+def read_doom3_map(filename):
+	"""Yield the entities of a Doom 3 .map file, with the same layout as read_entities
+	Primitives are {"brush": sides}, like JSON brush primitives, or {"patch": {"material", "subdivisions", "control"}}."""
+	lex = lexer.Lexer(filename)
+	token = lex.parse_token()
+	if token == "Version":
+		lex.parse_token()
+		token = lex.parse_token()
+	while token != None:
+		if token != "{":
+			raise Exception("expected token \"{\", got \"%s\" on line %d" % (token, lex.line))
+		ent = OrderedDict()
+		primitives = []
+		while True:
+			token = lex.parse_token()
+			if token == "}":
+				break
+			elif token == "{":
+				primitives.append(parse_primitive(lex))
+			elif token == None:
+				raise Exception("\"%s\" ends in the middle of an entity" % filename)
+			else:
+				ent[token] = lex.parse_token()
+		if primitives:
+			ent["primitives"] = primitives
+		yield ent
+		token = lex.parse_token()
+
+def get_primitive_arrays(prim):
+	"""Mesh arrays of a primitive's verts and polygons, in game units
+	Returns (x y z, loop vertex indices, loop totals, material indices, loop uvs, material names), see mesh_utils.create_mesh"""
+	verts = prim["verts"]
+	polygons = prim["polygons"]
+	xyz = np.array([v["xyz"] for v in verts], dtype=np.float64).reshape(-1, 3)
+	st = np.array([v["st"] for v in verts], dtype=np.float64).reshape(-1, 2)
+	# verts are split by uv and normal, join the ones at the same position so the mesh is connected
+	(positions, vertex_remap) = np.unique(xyz, axis=0, return_inverse=True)
+	loop_indices = np.fromiter(itertools.chain.from_iterable([p["indices"] for p in polygons]), dtype=np.int64)
+	loop_totals = np.array([len(p["indices"]) for p in polygons], dtype=np.int32)
+	material_names = []
+	material_lookup = {}
+	material_indices = np.empty(len(polygons), dtype=np.int32)
+	for (i, p) in enumerate(polygons):
+		index = material_lookup.get(p["material"])
+		if index == None:
+			index = material_lookup[p["material"]] = len(material_names)
+			material_names.append(p["material"])
+		material_indices[i] = index
+	uvs = st[loop_indices]
+	uvs[:, 1] = 1.0 - uvs[:, 1]
+	return (positions, vertex_remap.ravel()[loop_indices], loop_totals, material_indices, uvs, material_names)
+
+def string_to_vector(s, default=(0.0, 0.0, 0.0)):
+	try:
+		return Vector([float(c) for c in s.split()])
+	except (AttributeError, ValueError):
+		return Vector(default)
+
+def rotation_string_to_angles(s):
+	"""The inverse of export_map.angles_to_rotation_string"""
+	values = [float(c) for c in s.split()]
+	rot = Matrix((values[0:3], values[3:6], values[6:9])).to_euler('XYZ')
+	return Euler((-rot[0], -rot[1], -rot[2]), 'XYZ')
+
+class MapImporter:
+	def __init__(self, context, world_space_textures=False):
+		"""world_space_textures: brush texture matrices include the entity origin, as in Doom 3 .map files. export_map doesn't include it."""
+		self.context = context
+		self.world_space_textures = world_space_textures
+		self.materials = set() # names of materials that have been looked up
+		self.instance_meshes = {} # model name: mesh, of func_statics that are instanced by others
+		self.num_entities = 0
+		self.num_primitives = 0
+		self.num_skipped_primitives = 0 # brushes that don't enclose anything and unsupported primitives
+		self.missing_models = set()
+		self.num_dropped_keys = 0 # of worldspawn and instanced func_statics, they can't store them
+
+	def link_object(self, obj):
+		self.context.scene.objects.link(obj)
+		return obj
+
+	def create_materials(self, material_names):
+		# create materials from their decls the first time they're used, like the material panel does
+		decls = self.context.scene.bfg.material_decls
+		for name in material_names:
+			if not name in self.materials:
+				self.materials.add(name)
+				decl = decls.get(name)
+				if decl:
+					core.create_material(decl)
+
+	def create_mesh(self, name, arrays):
+		if not arrays:
+			self.num_skipped_primitives += 1
+			return None
+		(positions, loop_vertices, loop_totals, material_indices, uvs, material_names) = arrays
+		self.create_materials(material_names)
+		self.num_primitives += 1
+		return mesh_utils.create_mesh(name, positions * core._scale_to_blender, loop_vertices, loop_totals, material_indices, uvs, material_names)
+
+	def create_primitive_mesh(self, name, prim):
+		# a mesh or patch primitive
+		if "verts" in prim:
+			return self.create_mesh(name, get_primitive_arrays(prim))
+		if "patch" in prim:
+			patch = prim["patch"]
+			return self.create_mesh(name, map_geometry.patch_to_arrays(patch["control"], patch["material"], patch["subdivisions"]))
+		self.num_skipped_primitives += 1
+		return None
+
+	def create_brush_objects(self, ent):
+		# all the brushes of an entity are converted at once
+		brushes = [[map_geometry.Side(side["plane"], side["material"], side["textureMatrix"]) for side in prim["brush"]] for prim in ent.get("primitives", []) if "brush" in prim]
+		origin = string_to_vector(ent.get("origin")) if self.world_space_textures else (0.0, 0.0, 0.0)
+		objects = []
+		for arrays in map_geometry.brushes_to_arrays(brushes, origin):
+			mesh = self.create_mesh("brush", arrays)
+			if not mesh:
+				continue
+			# the same as AddBrush, but keep the map's texturing
+			obj = self.link_object(bpy.data.objects.new("brush", mesh))
+			if self.context.scene.bfg.wireframe_rooms:
+				obj.draw_type = 'WIRE'
+			obj.bfg.type = 'BRUSH'
+			obj.bfg.auto_unwrap = False
+			obj.game.physics_type = 'NO_COLLISION'
+			obj.hide_render = True
+			core.link_object_to_group(obj, "brushes")
+			objects.append(obj)
+		return objects
+
+	def create_primitive_objects(self, name, ent):
+		"""Objects for an entity's primitives: brushes are BRUSH objects, the rest are plain meshes"""
+		objects = self.create_brush_objects(ent)
+		for prim in ent.get("primitives", []):
+			if not "brush" in prim:
+				mesh = self.create_primitive_mesh(name, prim)
+				if mesh:
+					objects.append(self.link_object(bpy.data.objects.new(name, mesh)))
+		return objects
+
+	def set_game_properties(self, obj, ent, skip_keys):
+		# properties of the entity def first, then the rest as custom properties
+		self.context.scene.objects.active = obj
+		entity = self.context.scene.bfg.entities.get(obj.bfg.classname)
+		if entity:
+			core.create_object_entity_properties(self.context, entity)
+		for key in sorted(ent.keys()):
+			if key in skip_keys:
+				continue
+			prop = obj.game.properties.get("inherited_" + key) or obj.game.properties.get(key)
+			if not prop:
+				bpy.ops.object.game_property_new(type='STRING', name="custom_" + key)
+				prop = obj.game.properties["custom_" + key]
+			prop.value = str(ent[key])
+
+	def create_entity_box(self, name, entity):
+		# the same as AddEntity: a box the size of the entity bounds, drawn in the entity color
+		mins = string_to_vector(entity.get_dict_value("editor_mins", "")) * core._scale_to_blender
+		maxs = string_to_vector(entity.get_dict_value("editor_maxs", "")) * core._scale_to_blender
+		corners = [(maxs[0] if i & 1 else mins[0], maxs[1] if i & 2 else mins[1], maxs[2] if i & 4 else mins[2]) for i in range(8)]
+		faces = [0, 2, 3, 1, 4, 5, 7, 6, 0, 1, 5, 4, 2, 6, 7, 3, 0, 4, 6, 2, 1, 3, 7, 5]
+		core.create_object_color_material()
+		mesh = mesh_utils.create_mesh(entity.name, corners, faces, [4] * 6, materials=["_object_color"])
+		obj = bpy.data.objects.new(name, mesh)
+		entity_color = entity.get_dict_value("editor_color", "0 0 1") # default to blue
+		obj.color = [float(i) for i in entity_color.split()] + [float(0.5)] # "r g b"
+		obj.hide_render = True
+		obj.show_wire = True
+		obj.show_transparent = True
+		return self.link_object(obj)
+
+	def create_entity_object(self, name, classname):
+		entity = self.context.scene.bfg.entities.get(classname)
+		obj = None
+		if entity:
+			model = entity.get_dict_value("model")
+			if model:
+				mesh_path = core.find_model_def_mesh(model)
+				filename = core.FileSystem().find_file_path(mesh_path) if mesh_path else None
+				if filename:
+					(obj, _) = core.create_model_object(self.context, filename, mesh_path)
+				else:
+					# a model def without a mesh has no path, report the def
+					self.missing_models.add(mesh_path if mesh_path else model)
+			if not obj and entity.get_dict_value("editor_mins") and entity.get_dict_value("editor_maxs"):
+				obj = self.create_entity_box(name, entity)
+		if not obj:
+			# unknown entity, or no model or bounds
+			obj = self.link_object(bpy.data.objects.new(name, None))
+			obj.empty_draw_type = 'ARROWS'
+		obj.lock_rotation = [True, True, False]
+		obj.lock_scale = [True, True, True]
+		obj.show_axis = True # x will be forward
+		obj.show_name = self.context.scene.bfg.show_entity_names
+		obj.bfg.type = 'ENTITY'
+		return obj
+
+	def create_brush_entity_object(self, name, ent):
+		obj = self.link_object(bpy.data.objects.new(name, None))
+		obj.empty_draw_type = 'SPHERE'
+		obj.empty_draw_size = 0.5
+		obj.hide_render = True
+		obj.lock_rotation = [True, True, True]
+		obj.lock_scale = [True, True, True]
+		obj.bfg.type = 'BRUSH_ENTITY'
+		# primitives are in object space
+		for child in self.create_primitive_objects(name + "_mesh", ent):
+			child.parent = obj
+			core.link_object_to_group(child, "entities")
+		return obj
+
+	def create_static_model_object(self, name, model):
+		filename = core.FileSystem().find_file_path(model)
+		obj = None
+		if filename:
+			(obj, _) = core.create_model_object(self.context, filename, model)
+		if not obj:
+			# keep the entity so it's exported again
+			self.missing_models.add(model)
+			obj = self.link_object(bpy.data.objects.new(name, None))
+			obj.empty_draw_type = 'CUBE'
+			obj.bfg.entity_model = model
+		obj.bfg.type = 'STATIC_MODEL'
+		obj.bfg.classname = "func_static"
+		core.link_object_to_group(obj, "static models")
+		return obj
+
+	def create_light_object(self, name, ent):
+		lamp = bpy.data.lamps.new(name=name, type='POINT')
+		obj = self.link_object(bpy.data.objects.new(name=name, object_data=lamp))
+		lamp.distance = string_to_vector(ent.get("light_radius"), (300.0, 300.0, 300.0))[0] * core._scale_to_blender
+		lamp.energy = lamp.distance
+		lamp.use_sphere = True
+		lamp.color = string_to_vector(ent.get("_color"), (1.0, 1.0, 1.0))
+		lamp.use_specular = str(ent.get("nospecular", 0)) == "0"
+		lamp.use_diffuse = str(ent.get("nodiffuse", 0)) == "0"
+		if "texture" in ent:
+			try:
+				obj.bfg.light_material = ent["texture"]
+			except TypeError:
+				pass # not a light material that's been loaded
+		core.link_object_to_group(obj, "lights")
+		return obj
+
+	def import_entity(self, ent):
+		classname = ent.get("classname", "")
+		name = ent.get("name", classname)
+		model = ent.get("model")
+		primitives = ent.get("primitives", [])
+		if classname == "worldspawn":
+			self.create_primitive_objects("worldspawn", ent)
+			self.num_dropped_keys += len([key for key in ent.keys() if not key in _object_keys])
+			return
+		if classname == "light":
+			obj = self.create_light_object(name, ent)
+		elif "rotation" in ent and model and (model in self.instance_meshes or (model == name and len(primitives) == 1 and "verts" in primitives[0])):
+			# func_statics that share their geometry, see export_map.generate_instance_entities
+			mesh = self.instance_meshes.get(model)
+			if not mesh:
+				mesh = self.instance_meshes[model] = self.create_primitive_mesh(name, primitives[0])
+			obj = self.link_object(bpy.data.objects.new(name, mesh))
+			self.num_dropped_keys += len([key for key in ent.keys() if not key in _static_model_keys])
+		elif primitives:
+			obj = self.create_brush_entity_object(name, ent)
+		elif "rotation" in ent and model:
+			obj = self.create_static_model_object(name, model)
+		else:
+			obj = self.create_entity_object(name, classname)
+		obj.name = name
+		obj.location = string_to_vector(ent.get("origin")) * core._scale_to_blender
+		if "rotation" in ent:
+			obj.rotation_euler = rotation_string_to_angles(ent["rotation"])
+		if obj.bfg.type in ['BRUSH_ENTITY', 'ENTITY']:
+			obj.bfg.classname = classname
+			if "angle" in ent:
+				obj.rotation_euler.z = math.radians(float(ent["angle"]))
+			core.link_object_to_group(obj, "entities")
+			self.set_game_properties(obj, ent, _object_keys + (["model"] if obj.bfg.type == 'BRUSH_ENTITY' else []))
+		elif obj.type == 'LAMP':
+			# e.g. light_center, light_target and noshadows, export_map writes custom properties of lights and static models
+			self.set_game_properties(obj, ent, _light_keys)
+		elif obj.bfg.type == 'STATIC_MODEL':
+			self.set_game_properties(obj, ent, _static_model_keys)
+		self.num_entities += 1
+
+def import_map(context, filename):
+	"""Add the entities of a JSON or Doom 3 .map file to the scene. Returns the MapImporter, for its counts."""
+	core.set_object_mode_and_clear_selection()
+	is_doom3_map = os.path.splitext(filename)[1].lower() == ".map"
+	importer = MapImporter(context, world_space_textures=is_doom3_map)
+	for ent in (read_doom3_map(filename) if is_doom3_map else read_entities(filename)):
+		importer.import_entity(ent)
+	for model in sorted(importer.missing_models):
+		print("Model %s not found" % model)
+	if importer.num_skipped_primitives > 0:
+		print("Skipped %d primitives" % importer.num_skipped_primitives)
+	if importer.num_dropped_keys > 0:
+		print("Dropped %d keys of worldspawn and instanced func_statics" % importer.num_dropped_keys)
+	return importer
+
+class ImportMap(bpy.types.Operator, ImportHelper):
+	bl_idname = "import_scene.rbdoom_map_json"
+	bl_label = "Import RBDOOM-3-BFG map"
+	bl_options = {'UNDO'}
+	filename_ext = ".json"
+	filter_glob = bpy.props.StringProperty(default="*.json;*.map", options={'HIDDEN'})
+
+	def execute(self, context):
+		start_time = time.time()
+		try:
+			importer = import_map(context, self.filepath)
+		except Exception as e:
+			self.report({'ERROR'}, str(e))
+			return {'CANCELLED'}
+		self.report({'INFO'}, "Imported %d entities, %d primitives in %.2f seconds" % (importer.num_entities, importer.num_primitives, time.time() - start_time))
+		if importer.num_dropped_keys > 0:
+			self.report({'WARNING'}, "Dropped %d keys of worldspawn and instanced func_statics" % importer.num_dropped_keys)
+		return {'FINISHED'}
+
+def menu_func_import(self, context):
+	self.layout.operator(ImportMap.bl_idname, "RBDOOM-3-BFG map (.json, .map)")
+
+def register():
+	bpy.types.INFO_MT_file_import.append(menu_func_import)
+
+def unregister():
+	bpy.types.INFO_MT_file_import.remove(menu_func_import)
+
+if __name__ == "__main__":
+	register()
@@ -0,0 +1,215 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# md5anim importer
+# all frames are reconstructed at once: the animated components of every frame are scattered over the baseframe
+# with one fancy index, then the hierarchy is resolved one depth level at a time for all frames and joints on that level
+
+import bpy, os, re
+import numpy as np
+from mathutils import Vector
+from . import import_md5mesh
+
+_hierarchy_re = re.compile(r"\"([^\"]*)\"\s+(-?\d+)\s+(\d+)\s+(\d+)")
+_comment_re = re.compile(r"//[^\n]*")
+_frame_re = re.compile(r"frame\s+\d+\s*\{|\}")
+
+class Md5Anim:
+	def __init__(self):
+		self.frame_rate = 24
+		self.names = []
+		self.parents = None # (joints)
+		self.positions = None # (frames, joints, 3) model space
+		self.orientations = None # (frames, joints, 4) w x y z, model space
+
+def find_section(text, name, start=0):
+	# return the contents of "name { ... }" and the position after the closing brace
+	match = re.compile(name + r"\s*\{").search(text, start)
+	if not match:
+		raise Exception("md5anim section \"%s\" not found" % name)
+	end = text.index("}", match.end())
+	return (text[match.end():end], end + 1)
+
+def header_value(text, name):
+	match = re.search(name + r"\s+(\S+)", text)
+	if not match:
+		raise Exception("md5anim header \"%s\" not found" % name)
+	return match.group(1)
+
+def quat_w(xyz):
+	# the w component is stored implicitly, see import_md5mesh.restore_quat
+	t = 1.0 - np.sum(xyz * xyz, axis=-1)
+	return np.where(t < 0.0, 0.0, -np.sqrt(np.maximum(t, 0.0)))
+
+def quat_mul(a, b):
+	aw, ax, ay, az = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+	bw, bx, by, bz = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+	return np.stack([
+		aw * bw - ax * bx - ay * by - az * bz,
+		aw * bx + ax * bw + ay * bz - az * by,
+		aw * by - ax * bz + ay * bw + az * bx,
+		aw * bz + ax * by - ay * bx + az * bw], axis=-1)
+
+def quat_conjugate(q):
+	return q * np.array([1.0, -1.0, -1.0, -1.0])
+
+def quat_rotate(q, v):
+	# v' = v + 2w(u x v) + 2u x (u x v)
+	u = q[..., 1:]
+	t = 2.0 * np.cross(u, v)
+	return v + q[..., :1] * t + np.cross(u, t)
+
+def read_md5anim(path):
+	with open(path, "r") as f:
+		text = _comment_re.sub("", f.read())
+	anim = Md5Anim()
+	num_frames = int(header_value(text, "numFrames"))
+	num_joints = int(header_value(text, "numJoints"))
+	num_components = int(header_value(text, "numAnimatedComponents"))
+	anim.frame_rate = int(header_value(text, "frameRate"))
+
+	# hierarchy: name parent flags start_index
+	(hierarchy, pos) = find_section(text, "hierarchy")
+	joints = _hierarchy_re.findall(hierarchy)
+	if len(joints) != num_joints:
+		raise Exception("md5anim hierarchy has %d joints, expected %d" % (len(joints), num_joints))
+	anim.names = [j[0] for j in joints]
+	anim.parents = np.array([int(j[1]) for j in joints], dtype=np.int32)
+	flags = np.array([int(j[2]) for j in joints], dtype=np.int32)
+	start_index = np.array([int(j[3]) for j in joints], dtype=np.int32)
+
+	# baseframe: ( tx ty tz ) ( qx qy qz ) per joint
+	(baseframe, pos) = find_section(text, "baseframe", pos)
+	base = np.array(baseframe.replace("(", " ").replace(")", " ").split(), dtype=np.float64).reshape(num_joints, 6)
+
+	# frames: parse all of them in one go
+	frames = np.array(_frame_re.sub(" ", text[pos:]).split(), dtype=np.float64)
+	if len(frames) != num_frames * num_components:
+		raise Exception("md5anim has %d animated components, expected %d" % (len(frames), num_frames * num_components))
+	frames = frames.reshape(num_frames, num_components)
+
+	# scatter the animated components over the baseframe
+	# component k of joint j is animated if bit k of flags is set
+	# its index in the frame is start_index plus the number of lower bits set
+	components = np.repeat(base[np.newaxis], num_frames, axis=0)
+	bits = (flags[:, np.newaxis] >> np.arange(6)) & 1
+	offsets = np.cumsum(bits, axis=1) - bits
+	(joint_indices, component_indices) = np.nonzero(bits)
+	frame_indices = start_index[joint_indices] + offsets[joint_indices, component_indices]
+	components[:, joint_indices, component_indices] = frames[:, frame_indices]
+
+	# joint local transforms
+	positions = components[..., :3]
+	xyz = components[..., 3:]
+	orientations = np.concatenate([quat_w(xyz)[..., np.newaxis], xyz], axis=-1)
+
+	# resolve the hierarchy, one depth level at a time. parents always come before children.
+	depth = np.zeros(num_joints, dtype=np.int32)
+	for j, parent in enumerate(anim.parents):
+		if parent >= 0:
+			depth[j] = depth[parent] + 1
+	for level in range(1, depth.max() + 1 if num_joints > 0 else 1):
+		js = np.nonzero(depth == level)[0]
+		ps = anim.parents[js]
+		positions[:, js] = positions[:, ps] + quat_rotate(orientations[:, ps], positions[:, js])
+		orientations[:, js] = quat_mul(orientations[:, ps], orientations[:, js])
+	orientations /= np.linalg.norm(orientations, axis=-1)[..., np.newaxis]
+	anim.positions = positions
+	anim.orientations = orientations
+	return anim
+
+def create_armature(context, obj, md5mesh_path):
+	"""Create an armature from the md5mesh bind pose, deforming obj"""
+	(ms, z_offset) = import_md5mesh.read_md5mesh_joints(md5mesh_path)
+	arm_data = bpy.data.armatures.new(obj.name + "_skeleton")
+	arm = bpy.data.objects.new(obj.name + "_skeleton", arm_data)
+	context.scene.objects.link(arm)
+	# not parented to obj: obj's armature modifier depends on the armature, that would be a dependency cycle
+	arm.matrix_world = obj.matrix_world.copy()
+	arm.show_x_ray = True
+	context.scene.objects.active = arm
+	bpy.ops.object.mode_set(mode='EDIT')
+	for (name, mtx) in ms:
+		bone = arm_data.edit_bones.new(name)
+		rot = mtx.to_3x3()
+		bone.head = mtx.to_translation() + Vector((0.0, 0.0, z_offset))
+		bone.tail = bone.head + rot * Vector((0.0, 4.0, 0.0))
+		bone.align_roll(rot * Vector((0.0, 0.0, 1.0)))
+	bpy.ops.object.mode_set(mode='OBJECT')
+	# the mesh may be linked from another object: vertex groups live on the object
+	if len(obj.vertex_groups) == 0:
+		for (name, _) in ms:
+			obj.vertex_groups.new(name)
+	mod = obj.modifiers.new(name="md5anim", type='ARMATURE')
+	mod.object = arm
+	mod.use_vertex_groups = True
+	context.scene.objects.active = obj
+	return (arm, z_offset)
+
+def find_armature(obj):
+	mod = obj.modifiers.get("md5anim")
+	if mod and mod.type == 'ARMATURE' and mod.object:
+		return mod.object
+	return None
+
+def add_fcurve(action, data_path, index, group, frames, values):
+	fc = action.fcurves.new(data_path, index, group)
+	fc.keyframe_points.add(len(frames))
+	co = np.empty(len(frames) * 2, dtype=np.float32)
+	co[0::2] = frames
+	co[1::2] = values
+	fc.keyframe_points.foreach_set("co", co)
+	fc.keyframe_points.foreach_set("interpolation", np.ones(len(frames), dtype=np.int32)) # LINEAR
+	fc.update()
+
+def apply_md5anim(context, obj, md5mesh_path, md5anim_path):
+	"""Preview an md5anim on obj, a model object created from md5mesh_path"""
+	anim = read_md5anim(md5anim_path)
+	arm = find_armature(obj)
+	if arm:
+		z_offset = import_md5mesh.read_md5mesh_joints(md5mesh_path)[1]
+		# obj may have moved since the armature was created
+		arm.matrix_world = obj.matrix_world.copy()
+	else:
+		(arm, z_offset) = create_armature(context, obj, md5mesh_path)
+	anim.positions[..., 2] += z_offset
+
+	# bones are unparented, so the pose basis is the rest matrix inverse times the animated matrix
+	bones = [arm.data.bones.get(name) for name in anim.names]
+	rest_t = np.array([b.head_local if b else (0, 0, 0) for b in bones], dtype=np.float64)
+	rest_q = np.array([b.matrix_local.to_quaternion() if b else (1, 0, 0, 0) for b in bones], dtype=np.float64)
+	inv_rest_q = quat_conjugate(rest_q)
+	locations = quat_rotate(inv_rest_q, anim.positions - rest_t)
+	rotations = quat_mul(inv_rest_q, anim.orientations)
+
+	name = os.path.splitext(os.path.basename(md5anim_path))[0]
+	action = bpy.data.actions.new(name)
+	frames = np.arange(len(anim.positions), dtype=np.float32)
+	for j, bone_name in enumerate(anim.names):
+		if not bones[j]:
+			continue # joint not in the md5mesh
+		for i in range(3):
+			add_fcurve(action, "pose.bones[\"%s\"].location" % bone_name, i, bone_name, frames, locations[:, j, i])
+		for i in range(4):
+			add_fcurve(action, "pose.bones[\"%s\"].rotation_quaternion" % bone_name, i, bone_name, frames, rotations[:, j, i])
+	if not arm.animation_data:
+		arm.animation_data_create()
+	arm.animation_data.action = action
+	context.scene.render.fps = anim.frame_rate
+	context.scene.frame_start = 0
+	context.scene.frame_end = max(len(frames) - 1, 0)
+	return action
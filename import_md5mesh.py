@@ -35,6 +35,9 @@ def read_md5mesh(path):
 		bm.to_mesh(mesh)
 		bm.free()
 		mesh_o = bpy.data.objects.new(mesh.name, mesh)
+		# deform layer indices are joint indices
+		for j_name, _ in ms:
+			mesh_o.vertex_groups.new(j_name)
 		bpy.context.scene.objects.link(mesh_o)
 		bpy.context.scene.objects.active = mesh_o
 		bpy.ops.object.mode_set(mode='EDIT')
@@ -45,6 +48,16 @@ def read_md5mesh(path):
 		mesh_o.material_slots[-1].material = mat
 		bpy.ops.object.mode_set()
 
+def read_md5mesh_joints(path):
+	w = "\s+(.+?)"
+	a = "(.+?)"
+	j_re  = re.compile("\s*\""+a+"\""+w+"\s+\("+w*3+"\s+\)\s+\("+w*3+"\s+\).*")
+	e_re  = re.compile("\s*}.*")
+	fh = open(path, "r")
+	md5mesh = fh.readlines()
+	fh.close()
+	return do_joints(md5mesh, j_re, e_re)
+
 def do_mesh(md5mesh, s_re, v_re, t_re, w_re, e_re, n_re, ms, z_offset):
 	bm = bmesh.new()
 	mat_name = gather(s_re, n_re, md5mesh)[0][0]
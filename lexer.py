@@ -15,15 +15,29 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
 
+import re
+
+# whitespace - any control character or space - and comments. an unterminated block comment runs to the end of the file.
+_whitespace = r"(?:[\x00-\x20]+|//[^\n]*|/(?=\*)(?:.*?\*/|.*\Z))*"
+# after any whitespace: a quoted token, or a run of valid token characters - "/" only if it doesn't start a comment
+# the optional quotes catch unterminated quoted tokens and quotes in the middle of tokens
+_next_token = re.compile(_whitespace + r"(?:\"([^\"]*)(\")?|((?:[a-zA-Z0-9_\\\-.&:]|/(?![/*]))+)(\")?)?", re.DOTALL)
+_skip_whitespace = re.compile(_whitespace, re.DOTALL)
+
 class Lexer:
 	valid_token_chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_/\\-.&:"
 	valid_single_tokens = "{}[]()+-*/%!=<>,"
 
 	def __init__(self, filename):
-		self.line, self.pos = 1, 0
+		self.pos = 0
 		with open(filename) as file:
 			self.data = file.read()
 			
+	@property
+	def line(self):
+		# only needed for error messages, so it's counted when it's asked for
+		return self.data.count("\n", 0, self.pos) + 1
+			
 	def eof(self):
 		return self.pos >= len(self.data)
 		
@@ -33,37 +47,24 @@ class Lexer:
 			raise Exception("expected token \"%s\", got \"%s\" on line %d" % (token, t, self.line))
 		
 	def parse_token(self):
-		self.skip_whitespace()
-		if self.eof():
+		match = _next_token.match(self.data, self.pos)
+		self.pos = match.end()
+		(quoted, closing_quote, token, quote) = match.groups()
+		if token != None:
+			if quote:
+				raise Exception("quote in middle of token")
+			return token
+		if quoted != None:
+			if not closing_quote:
+				raise Exception("eof in quoted token")
+			return quoted
+		if self.pos >= len(self.data):
 			return None
-		start = self.pos
-		while True:
-			if self.eof():
-				break
-			c = self.data[self.pos]
-			nc = self.data[self.pos + 1] if self.pos + 1 < len(self.data) else None
-			if c == "\"":
-				if not start == self.pos:
-					raise Exception("quote in middle of token")
-				self.pos += 1
-				while True:
-					if self.eof():
-						raise Exception("eof in quoted token")
-					c = self.data[self.pos]
-					self.pos += 1
-					if c == "\"":
-						return self.data[start + 1:self.pos - 1]
-			elif (c == "/" and nc == "/") or (c == "/" and nc == "*"):
-				break
-			elif not c in self.valid_token_chars:
-				if c in self.valid_single_tokens:
-					if self.pos == start:
-						# single character token
-						self.pos += 1
-				break
+		if self.data[self.pos] in self.valid_single_tokens:
+			# single character token
 			self.pos += 1
-		end = self.pos
-		return self.data[start:end]
+			return self.data[self.pos - 1]
+		return ""
 		
 	def skip_bracket_delimiter_section(self, opening, closing, already_open = False):
 		if not already_open:
@@ -81,33 +82,7 @@ class Lexer:
 					break
 		
 	def skip_whitespace(self):
-		while True:
-			if self.eof():
-				break
-			c = self.data[self.pos]
-			nc = self.data[self.pos + 1] if self.pos + 1 < len(self.data) else None
-			if c == "\n":
-				self.line += 1
-				self.pos += 1
-			elif ord(c) <= ord(" "):
-				self.pos += 1
-			elif c == "/" and nc == "/":
-				while True:
-					if self.eof() or self.data[self.pos] == "\n":
-						break
-					self.pos += 1
-			elif c == "/" and nc == "*":
-				while True:
-					if self.eof():
-						break
-					c = self.data[self.pos]
-					nc = self.data[self.pos + 1] if self.pos + 1 < len(self.data) else None
-					if c == "*" and nc == "/":
-						self.pos += 2
-						break
-					self.pos += 1
-			else:
-				break
+		self.pos = _skip_whitespace.match(self.data, self.pos).end()
 				
 if __name__ == "__main__":
 	'''
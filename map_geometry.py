@@ -0,0 +1,187 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# mesh arrays of imported map primitives: brushes - convex solids bounded by planes - and Bezier patches
+# the corners of a brush are where three of its planes meet inside all the others. they're found for all brushes
+# with the same number of sides at once: every combination of three planes is solved as one batch of 3x3 systems,
+# in chunks of brushes so memory stays bounded for brushes with a lot of sides.
+# arrays are (x y z, loop vertex indices, loop totals, material indices, loop uvs, material names) in game units, see mesh_utils.create_mesh
+# doesn't use bpy
+
+import itertools
+import numpy as np
+
+_epsilon = 1e-3 # game units, how far a corner can be outside a plane
+_weld = 1e-2 # game units, corners closer than this are one vertex
+_min_determinant = 1e-6 # planes are unit length, smaller determinants are (nearly) parallel planes
+_max_batch_elements = 1 << 22 # corner distances - brushes * combinations of three planes * planes - solved at once, bounds memory
+_default_patch_subdivisions = 4 # per 3x3 section, for patches without explicit subdivisions (patchDef2)
+
+class Side:
+	def __init__(self, plane, material, texture_matrix):
+		self.plane = plane # a b c d, ax + by + cz + d = 0 on the plane and the normal faces out
+		self.material = material
+		self.texture_matrix = texture_matrix # ((a b c) (d e f)), see texture_coordinates
+
+def compute_axis_bases(normals):
+	"""map_writer.compute_axis_base of each row of a (n, 3) array"""
+	n = np.where(np.abs(normals) < 1e-6, 0.0, normals)
+	rot_y = -np.arctan2(n[:, 2], np.sqrt(n[:, 1] * n[:, 1] + n[:, 0] * n[:, 0]))
+	rot_z = np.arctan2(n[:, 1], n[:, 0])
+	tex_s = np.column_stack((-np.sin(rot_z), np.cos(rot_z), np.zeros(len(n))))
+	tex_t = np.column_stack((-np.sin(rot_y) * np.cos(rot_z), -np.sin(rot_y) * np.sin(rot_z), -np.cos(rot_y)))
+	return (tex_s, tex_t)
+
+def texture_coordinates(positions, normals, texture_matrices, origin):
+	"""The uvs of points on brush sides: st = texture matrix * (p.s, p.t, 1), with s and t the texture axes of the side
+	Doom 3 maps put brush entity geometry in entity space and texture it in world space, the origin is the entity's."""
+	(tex_s, tex_t) = compute_axis_bases(normals)
+	p = positions + origin
+	coords = np.column_stack(((p * tex_s).sum(axis=1), (p * tex_t).sum(axis=1), np.ones(len(p))))
+	st = np.einsum("nij,nj->ni", texture_matrices, coords)
+	st[:, 1] = 1.0 - st[:, 1]
+	return st
+
+def brushes_to_arrays(brushes, origin=(0.0, 0.0, 0.0)):
+	"""Polygons of brushes, lists of Sides. Returns a list of arrays, None for brushes that don't enclose anything."""
+	result = [None] * len(brushes)
+	groups = {}
+	for (i, sides) in enumerate(brushes):
+		if len(sides) >= 4:
+			groups.setdefault(len(sides), []).append(i)
+	for (num_sides, indices) in groups.items():
+		# memory is brushes * combinations * sides, solve brushes with a lot of sides a few at a time
+		chunk_size = max(1, _max_batch_elements // (num_sides * (num_sides - 1) * (num_sides - 2) // 6 * num_sides))
+		for start in range(0, len(indices), chunk_size):
+			chunk = indices[start:start + chunk_size]
+			for (i, arrays) in zip(chunk, brush_group_to_arrays([brushes[i] for i in chunk], num_sides, np.asarray(origin, dtype=np.float64))):
+				result[i] = arrays
+	return result
+
+def brush_group_to_arrays(brushes, n, origin):
+	# brushes all have n sides
+	planes = np.array([[side.plane for side in sides] for sides in brushes], dtype=np.float64).reshape(-1, n, 4)
+	planes /= np.linalg.norm(planes[:, :, :3], axis=2)[:, :, np.newaxis]
+	num_brushes = len(brushes)
+
+	# the point where each combination of three planes meets
+	triples = np.array(list(itertools.combinations(range(n), 3)))
+	a = planes[:, triples, :3]
+	b = -planes[:, triples, 3]
+	solvable = np.abs(np.linalg.det(a)) > _min_determinant
+	a[~solvable] = np.eye(3)
+	b[~solvable] = 0.0
+	points = np.linalg.solve(a, b[..., np.newaxis])[..., 0]
+	dists = np.einsum("btk,bnk->btn", points, planes[:, :, :3]) + planes[:, np.newaxis, :, 3]
+	(brush_indices, triple_indices) = np.nonzero(solvable & (dists < _epsilon).all(axis=2))
+
+	# corners where more than three planes meet are found more than once
+	keys = np.column_stack((brush_indices, np.round(points[brush_indices, triple_indices] / _weld))).astype(np.int64)
+	(_, first) = np.unique(keys, axis=0, return_index=True)
+	vertex_brushes = brush_indices[first]
+	positions = points[vertex_brushes, triple_indices[first]]
+	vertex_dists = dists[vertex_brushes, triple_indices[first]]
+
+	# the corners on each side, side i of brush b is polygon b * n + i
+	(loop_vertices, loop_sides) = np.nonzero(np.abs(vertex_dists) < _epsilon)
+	loop_polygons = vertex_brushes[loop_vertices] * n + loop_sides
+	normals = planes[:, :, :3].reshape(-1, 3)
+	counts = np.bincount(loop_polygons, minlength=num_brushes * n)
+	centers = np.zeros((num_brushes * n, 3))
+	np.add.at(centers, loop_polygons, positions[loop_vertices])
+	centers /= np.maximum(counts, 1)[:, np.newaxis]
+
+	# wind the corners counter-clockwise around the normal, so the polygons face out
+	# u and v are axes on the plane, u x v = normal
+	axes = np.eye(3)[np.argmin(np.abs(normals), axis=1)]
+	u = np.cross(normals, axes)
+	u /= np.linalg.norm(u, axis=1)[:, np.newaxis]
+	v = np.cross(normals, u)
+	offsets = positions[loop_vertices] - centers[loop_polygons]
+	angles = np.arctan2((offsets * v[loop_polygons]).sum(axis=1), (offsets * u[loop_polygons]).sum(axis=1))
+	order = np.lexsort((angles, loop_polygons))
+	(loop_vertices, loop_polygons) = (loop_vertices[order], loop_polygons[order])
+	# sides that only touch the brush at an edge or a corner aren't polygons
+	keep = counts[loop_polygons] >= 3
+	(loop_vertices, loop_polygons) = (loop_vertices[keep], loop_polygons[keep])
+
+	texture_matrices = np.array([[side.texture_matrix for side in sides] for sides in brushes], dtype=np.float64).reshape(-1, 2, 3)
+	uvs = texture_coordinates(positions[loop_vertices], normals[loop_polygons], texture_matrices[loop_polygons], origin)
+
+	# material slots of each brush are its materials in the order the sides use them
+	side_materials = np.empty((num_brushes, n), dtype=np.int32)
+	brush_materials = []
+	for (i, sides) in enumerate(brushes):
+		material_names = []
+		for (j, side) in enumerate(sides):
+			if not side.material in material_names:
+				material_names.append(side.material)
+			side_materials[i, j] = material_names.index(side.material)
+		brush_materials.append(material_names)
+	polygons = np.flatnonzero(counts >= 3)
+	polygon_brushes = polygons // n
+	material_indices = side_materials.ravel()[polygons]
+
+	# split into brushes, brushes are contiguous in the vertices, loops and polygons
+	vertex_bounds = np.searchsorted(vertex_brushes, np.arange(num_brushes + 1)).tolist()
+	loop_bounds = np.searchsorted(loop_polygons // n, np.arange(num_brushes + 1)).tolist()
+	polygon_bounds = np.searchsorted(polygon_brushes, np.arange(num_brushes + 1)).tolist()
+	polygon_totals = counts[polygons]
+	result = []
+	for b in range(num_brushes):
+		(first_polygon, last_polygon) = (polygon_bounds[b], polygon_bounds[b + 1])
+		if last_polygon - first_polygon < 4:
+			result.append(None)
+			continue
+		(first_loop, last_loop) = (loop_bounds[b], loop_bounds[b + 1])
+		result.append((
+			positions[vertex_bounds[b]:vertex_bounds[b + 1]],
+			loop_vertices[first_loop:last_loop] - vertex_bounds[b],
+			polygon_totals[first_polygon:last_polygon],
+			material_indices[first_polygon:last_polygon],
+			uvs[first_loop:last_loop],
+			brush_materials[b]))
+	return result
+
+def bezier_weights(subdivisions):
+	# quadratic Bernstein polynomials at subdivisions + 1 steps
+	t = np.linspace(0.0, 1.0, subdivisions + 1)
+	return np.column_stack(((1.0 - t) * (1.0 - t), 2.0 * t * (1.0 - t), t * t))
+
+def patch_to_arrays(control, material, subdivisions=None):
+	"""Tessellate a patch: a (width, height, 5) grid of x y z s t control points, width and height odd.
+	subdivisions is (horizontal, vertical) per 3x3 section of the grid."""
+	control = np.asarray(control, dtype=np.float64)
+	(width, height) = control.shape[:2]
+	if width < 3 or height < 3 or width % 2 == 0 or height % 2 == 0:
+		return None
+	(sub_x, sub_y) = subdivisions if subdivisions and subdivisions[0] > 0 and subdivisions[1] > 0 else (_default_patch_subdivisions, _default_patch_subdivisions)
+	(weights_x, weights_y) = (bezier_weights(sub_x), bezier_weights(sub_y))
+	(rows, columns) = ((width - 1) // 2 * sub_x + 1, (height - 1) // 2 * sub_y + 1)
+	grid = np.empty((rows, columns, 5))
+	# sections share their edges, which evaluate to the same points
+	for i in range(0, width - 1, 2):
+		for j in range(0, height - 1, 2):
+			section = np.einsum("ua,vb,abk->uvk", weights_x, weights_y, control[i:i + 3, j:j + 3])
+			grid[i // 2 * sub_x:i // 2 * sub_x + sub_x + 1, j // 2 * sub_y:j // 2 * sub_y + sub_y + 1] = section
+	index = np.arange(rows * columns).reshape(rows, columns)
+	quads = np.stack((index[:-1, :-1], index[:-1, 1:], index[1:, 1:], index[1:, :-1]), axis=2).reshape(-1, 4)
+	points = grid.reshape(-1, 5)
+	loop_vertices = quads.ravel()
+	uvs = points[loop_vertices, 3:5].copy()
+	uvs[:, 1] = 1.0 - uvs[:, 1]
+	return (points[:, :3], loop_vertices, np.full(len(quads), 4, dtype=np.int32), np.zeros(len(quads), dtype=np.int32), uvs, [material])
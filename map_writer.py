@@ -0,0 +1,285 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# streaming JSON map writer, the output is byte-identical to json.dump(data, f, indent=indent)
+# generators are written as arrays while they're being iterated, so entities and primitives can be produced one at a time
+# the vertices and polygons of a primitive are typed arrays, written in big formatted chunks
+# primitives are created from mesh arrays here rather than in export_map, so export worker processes can do it without bpy
+
+import io, math
+import numpy as np
+from . import csg, vertex_cache
+from collections import OrderedDict
+from json.encoder import encode_basestring_ascii
+
+_chunk_size = 4096 # vertices or polygons formatted at once
+_flush_size = 1 << 16 # characters buffered before writing to the file
+
+class Vertices:
+	"""The "verts" array of a primitive: one xyz, st and normal row per vertex"""
+	def __init__(self, xyz, st, normal):
+		self.xyz = xyz
+		self.st = st
+		self.normal = normal
+
+	def __len__(self):
+		return len(self.xyz)
+
+class Polygons:
+	"""The "polygons" array of a primitive, in mesh polygon layout: the indices of polygon i are indices[starts[i]:starts[i] + totals[i]]"""
+	def __init__(self, material_names, material_indices, starts, totals, indices):
+		self.material_names = material_names
+		self.material_indices = material_indices
+		self.starts = starts
+		self.totals = totals
+		self.indices = indices
+
+	def __len__(self):
+		return len(self.starts)
+
+class Fragment:
+	"""A value that's been serialized already, see to_string. Written verbatim, so it has to be written at the indent and level it was serialized with."""
+	def __init__(self, text):
+		self.text = text
+
+class _Placeholder:
+	# written as-is, used to build formatting templates
+	def __init__(self, text):
+		self.text = text
+
+def float_to_string(f):
+	# same as the json module
+	if f != f:
+		return "NaN"
+	if f == float("inf"):
+		return "Infinity"
+	if f == -float("inf"):
+		return "-Infinity"
+	return float.__repr__(f)
+
+class MapWriter:
+	def __init__(self, f, indent=None):
+		"""indent is the same as json.dump's: None, a number of spaces or a string"""
+		self.f = f
+		self.indent = " " * indent if isinstance(indent, int) else indent
+		self.item_separator = "," if self.indent is not None else ", "
+		self.buffer = []
+		self.buffer_size = 0
+
+	def write(self, value):
+		self.write_value(value, 0)
+		self.flush()
+
+	def flush(self):
+		self.f.write("".join(self.buffer))
+		self.buffer = []
+		self.buffer_size = 0
+
+	def emit(self, s):
+		self.buffer.append(s)
+		self.buffer_size += len(s)
+		if self.buffer_size >= _flush_size:
+			self.flush()
+
+	def newline(self, level):
+		return "\n" + self.indent * level if self.indent is not None else ""
+
+	def write_value(self, value, level):
+		if isinstance(value, str):
+			self.emit(encode_basestring_ascii(value))
+		elif value is None:
+			self.emit("null")
+		elif value is True:
+			self.emit("true")
+		elif value is False:
+			self.emit("false")
+		elif isinstance(value, int):
+			self.emit(int.__repr__(value))
+		elif isinstance(value, float):
+			self.emit(float_to_string(value))
+		elif isinstance(value, dict):
+			self.write_dict(value, level)
+		elif isinstance(value, Vertices):
+			self.write_vertices(value, level)
+		elif isinstance(value, Polygons):
+			self.write_polygons(value, level)
+		elif isinstance(value, (Fragment, _Placeholder)):
+			self.emit(value.text)
+		else:
+			self.write_array(value, level) # lists, tuples and generators
+
+	def write_dict(self, d, level):
+		if len(d) == 0:
+			self.emit("{}")
+			return
+		self.emit("{")
+		first = True
+		for (key, value) in d.items():
+			self.emit(("" if first else self.item_separator) + self.newline(level + 1) + encode_basestring_ascii(key) + ": ")
+			self.write_value(value, level + 1)
+			first = False
+		self.emit(self.newline(level) + "}")
+
+	def write_array(self, items, level):
+		first = True
+		for item in items:
+			self.emit(("[" if first else self.item_separator) + self.newline(level + 1))
+			self.write_value(item, level + 1)
+			first = False
+		self.emit("[]" if first else self.newline(level) + "]")
+
+	def format(self, value, level):
+		# the string a value would be written as
+		writer = MapWriter(io.StringIO(), self.indent)
+		writer.write_value(value, level)
+		writer.flush()
+		return writer.f.getvalue()
+
+	def write_chunks(self, rows, template, level):
+		# rows is a list of tuples, each formatted with template and written as an array item
+		if len(rows) == 0:
+			self.emit("[]")
+			return
+		separator = self.item_separator + self.newline(level + 1)
+		self.emit("[" + self.newline(level + 1))
+		for i in range(0, len(rows), _chunk_size):
+			if i > 0:
+				self.emit(separator)
+			self.emit(separator.join([template % row for row in rows[i:i + _chunk_size]]))
+		self.emit(self.newline(level) + "]")
+
+	def write_vertices(self, vertices, level):
+		data = np.hstack((vertices.xyz, vertices.st, vertices.normal)).astype(np.float64)
+		if not np.isfinite(data).all():
+			# %r doesn't format these like json, write them one at a time
+			self.write_array([OrderedDict([("xyz", row[0:3]), ("st", row[3:5]), ("normal", row[5:8])]) for row in data.tolist()], level)
+			return
+		r = _Placeholder("%r")
+		template = self.format(OrderedDict([("xyz", [r, r, r]), ("st", [r, r]), ("normal", [r, r, r])]), level + 1)
+		self.write_chunks([tuple(row) for row in data.tolist()], template, level)
+
+	def write_polygons(self, polygons, level):
+		s = _Placeholder("%s")
+		template = self.format(OrderedDict([("material", s), ("indices", s)]), level + 1)
+		index_separator = self.item_separator + self.newline(level + 3)
+		(index_begin, index_end) = ("[" + self.newline(level + 3), self.newline(level + 2) + "]")
+		material_names = [encode_basestring_ascii(name) for name in polygons.material_names]
+		indices = np.asarray(polygons.indices).tolist()
+		rows = []
+		for (start, total, material_index) in zip(np.asarray(polygons.starts).tolist(), np.asarray(polygons.totals).tolist(), np.asarray(polygons.material_indices).tolist()):
+			poly_indices = (index_begin + index_separator.join(map(str, indices[start:start + total])) + index_end) if total > 0 else "[]"
+			rows.append((material_names[material_index], poly_indices))
+		self.write_chunks(rows, template, level)
+
+# vertices are welded when their position, uv and normal are the same after rounding to these steps
+_weld_xyz = 1e-3 # game units
+_weld_st = 1e-5
+_weld_normal = 1e-4
+
+def primitive_from_arrays(index, arrays, optimize_vertex_cache=False, stats=None):
+	"""Create a primitive from the arrays of a triangulated mesh, see export_map.get_primitive_arrays
+	If optimize_vertex_cache is set, triangles and vertices are reordered for the GPU's vertex cache and the cache misses are added to stats, a vertex_cache.Stats."""
+	# vertex position and normal are decoupled from uvs
+	# every loop is a (xyz, st, normal) vertex, loops with the same one are welded
+	xyz = arrays["positions"][arrays["loop_vertices"]]
+	st = arrays["uvs"].reshape(-1, 2).astype(np.float64)
+	st[:, 1] = 1.0 - st[:, 1]
+	normals = arrays["normals"].reshape(-1, 3).astype(np.float64)
+	keys = np.hstack((np.round(xyz / _weld_xyz), np.round(st / _weld_st), np.round(normals / _weld_normal))).astype(np.int64)
+	(_, first, inverse) = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+	# keep the vertices in the order they're first used
+	order = np.argsort(first)
+	remap = np.empty(len(order), dtype=np.int64)
+	remap[order] = np.arange(len(order))
+	first = first[order]
+	loop_indices = remap[inverse.ravel()]
+	(material_indices, loop_starts, loop_totals) = (arrays["material_indices"], arrays["loop_starts"], arrays["loop_totals"])
+	
+	if optimize_vertex_cache and (loop_totals == 3).all():
+		triangles = loop_indices[loop_starts[:, np.newaxis] + np.arange(3)]
+		(triangle_order, vertex_order) = vertex_cache.optimize(triangles, material_indices, len(first), stats)
+		remap = np.empty(len(first), dtype=np.int64)
+		remap[vertex_order] = np.arange(len(vertex_order))
+		first = first[vertex_order]
+		loop_indices = remap[triangles[triangle_order]].ravel()
+		material_indices = material_indices[triangle_order]
+		loop_starts = np.arange(0, len(loop_indices), 3)
+		loop_totals = np.full(len(triangle_order), 3, dtype=np.int32)
+	
+	prim = OrderedDict()
+	prim["primitive"] = index
+	prim["verts"] = Vertices(xyz[first], st[first], normals[first])
+	prim["polygons"] = Polygons(arrays["material_names"], material_indices, loop_starts, loop_totals, loop_indices)
+	return prim
+
+_brush_scale = 64.0 # game units per blender unit, the same as core._scale_to_game
+_brush_uv_epsilon = 1e-4 # how far the UVs of a brush side can be from a single texture matrix
+
+def compute_axis_base(normal):
+	"""The texture axes of a brush side plane, the same as idlib's ComputeAxisBase"""
+	n = [0.0 if abs(c) < 1e-6 else c for c in normal]
+	rot_y = -math.atan2(n[2], math.sqrt(n[1] * n[1] + n[0] * n[0]))
+	rot_z = math.atan2(n[1], n[0])
+	tex_s = np.array([-math.sin(rot_z), math.cos(rot_z), 0.0])
+	# the sign is reversed
+	tex_t = np.array([-math.sin(rot_y) * math.cos(rot_z), -math.sin(rot_y) * math.sin(rot_z), -math.cos(rot_y)])
+	return (tex_s, tex_t)
+
+def brush_from_arrays(index, arrays):
+	"""Create a brush primitive - planes with materials and texture matrices - from the arrays of a triangulated mesh
+	Returns None if the mesh isn't convex, or the faces on a plane don't share a material and UV mapping."""
+	# csg works in blender units
+	positions = arrays["positions"] / _brush_scale
+	solid = csg.solid_from_arrays(positions, arrays["loop_vertices"], arrays["loop_totals"], arrays["material_indices"], arrays["uvs"], arrays["material_names"])
+	if not solid:
+		return None
+	# group the polygons by plane
+	sides = [[] for _ in solid.planes]
+	for polygon in solid.polygons:
+		plane = np.append(polygon.normal, polygon.normal.dot(polygon.verts.mean(axis=0)))
+		sides[np.argmin(np.abs(solid.planes - plane).sum(axis=1))].append(polygon)
+	brush = []
+	for (plane, polygons) in zip(solid.planes, sides):
+		if len(polygons) == 0 or len(set([p.material for p in polygons])) > 1:
+			return None
+		# one UV mapping for the whole side
+		verts = np.concatenate([p.verts for p in polygons])
+		uvs = np.concatenate([p.verts.dot(p.uv_matrix[:, :3].T) + p.uv_matrix[:, 3] for p in polygons])
+		uv_matrix = csg.fit_uv_matrix(verts, uvs)
+		if np.abs(verts.dot(uv_matrix[:, :3].T) + uv_matrix[:, 3] - uvs).max() > _brush_uv_epsilon:
+			return None
+		# st = (u, 1 - v) of a game unit position p
+		st_matrix = np.array([np.append(uv_matrix[0, :3] / _brush_scale, uv_matrix[0, 3]), np.append(-uv_matrix[1, :3] / _brush_scale, 1.0 - uv_matrix[1, 3])])
+		# express it in the texture axes of the plane: p = (p.s)s + (p.t)t + dist n
+		(normal, dist) = (plane[:3], plane[3] * _brush_scale)
+		(tex_s, tex_t) = compute_axis_base(normal)
+		side = OrderedDict()
+		side["plane"] = np.append(normal, -dist).tolist() # a b c d, ax + by + cz + d = 0 on the plane
+		side["material"] = polygons[0].material or ""
+		side["textureMatrix"] = [[float(row[:3].dot(tex_s)), float(row[:3].dot(tex_t)), float(row[:3].dot(normal) * dist + row[3])] for row in st_matrix]
+		brush.append(side)
+	prim = OrderedDict()
+	prim["primitive"] = index
+	prim["brush"] = brush
+	return prim
+
+def dump(data, f, indent=None):
+	MapWriter(f, indent).write(data)
+
+def to_string(value, indent=None, level=0):
+	"""Serialize a value as it would be written at a nesting level, e.g. to make a Fragment"""
+	return MapWriter(None, indent).format(value, level)
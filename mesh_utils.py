@@ -0,0 +1,104 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import numpy as np
+
+def get_or_create_material(name):
+	mat = bpy.data.materials.get(name)
+	if not mat:
+		mat = bpy.data.materials.new(name)
+	return mat
+
+def create_mesh(name, positions, loop_vertices, loop_totals, material_indices=None, uvs=None, materials=None):
+	"""Create a mesh in bulk from flat arrays
+	positions: x y z per vertex
+	loop_vertices: vertex index per loop
+	loop_totals: number of loops per polygon
+	material_indices: material index per polygon
+	uvs: u v per loop
+	materials: material names, created if they don't exist. None for an empty slot."""
+	positions = np.asarray(positions, dtype=np.float32).ravel()
+	loop_vertices = np.asarray(loop_vertices, dtype=np.int32).ravel()
+	loop_totals = np.asarray(loop_totals, dtype=np.int32).ravel()
+	loop_starts = np.zeros(len(loop_totals), dtype=np.int32)
+	if len(loop_totals) > 1:
+		np.cumsum(loop_totals[:-1], out=loop_starts[1:])
+	mesh = bpy.data.meshes.new(name)
+	mesh.vertices.add(len(positions) // 3)
+	mesh.vertices.foreach_set("co", positions)
+	mesh.loops.add(len(loop_vertices))
+	mesh.loops.foreach_set("vertex_index", loop_vertices)
+	mesh.polygons.add(len(loop_totals))
+	mesh.polygons.foreach_set("loop_start", loop_starts)
+	mesh.polygons.foreach_set("loop_total", loop_totals)
+	if material_indices is not None:
+		mesh.polygons.foreach_set("material_index", np.asarray(material_indices, dtype=np.int32).ravel())
+	if uvs is not None:
+		mesh.uv_textures.new()
+		mesh.uv_layers[0].data.foreach_set("uv", np.asarray(uvs, dtype=np.float32).ravel())
+	if materials:
+		for mat_name in materials:
+			mesh.materials.append(get_or_create_material(mat_name) if mat_name else None)
+	mesh.update(calc_edges=True)
+	mesh.validate()
+	return mesh
+
+def get_mesh_arrays(mesh):
+	"""The inverse of create_mesh
+	return a tuple of (x y z, loop vertex indices, loop totals, material indices, loop uvs or None, material names)"""
+	positions = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+	mesh.vertices.foreach_get("co", positions)
+	loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+	mesh.loops.foreach_get("vertex_index", loop_vertices)
+	loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+	mesh.polygons.foreach_get("loop_total", loop_totals)
+	material_indices = np.empty(len(mesh.polygons), dtype=np.int32)
+	mesh.polygons.foreach_get("material_index", material_indices)
+	uvs = None
+	if len(mesh.uv_layers) > 0:
+		uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+		mesh.uv_layers[0].data.foreach_get("uv", uvs)
+	material_names = [mat.name if mat else None for mat in mesh.materials]
+	return (positions, loop_vertices, loop_totals, material_indices, uvs, material_names)
+
+def join_meshes(name, meshes):
+	"""Concatenate meshes into a new mesh, merging their materials by name"""
+	arrays = [get_mesh_arrays(mesh) for mesh in meshes]
+	material_names = []
+	for a in arrays:
+		for mat_name in a[5]:
+			if not mat_name in material_names:
+				material_names.append(mat_name)
+	has_uvs = any([a[4] is not None for a in arrays])
+	positions = []
+	loop_vertices = []
+	material_indices = []
+	uvs = []
+	num_vertices = 0
+	for (a_positions, a_loop_vertices, _, a_material_indices, a_uvs, a_material_names) in arrays:
+		positions.append(a_positions)
+		loop_vertices.append(a_loop_vertices + num_vertices)
+		num_vertices += len(a_positions) // 3
+		if len(a_material_names) > 0:
+			remap = np.array([material_names.index(mat_name) for mat_name in a_material_names], dtype=np.int32)
+			material_indices.append(remap[np.clip(a_material_indices, 0, len(remap) - 1)])
+		else:
+			material_indices.append(np.zeros(len(a_material_indices), dtype=np.int32))
+		if has_uvs:
+			uvs.append(a_uvs if a_uvs is not None else np.zeros(len(a_loop_vertices) * 2, dtype=np.float32))
+	return create_mesh(name, np.concatenate(positions), np.concatenate(loop_vertices), np.concatenate([a[2] for a in arrays]), np.concatenate(material_indices), np.concatenate(uvs) if has_uvs else None, material_names)
@@ -0,0 +1,102 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# scoped lifetime of temporary meshes and objects
+#
+# with TempData("Build Map") as temp:
+#     obj = temp.track(bpy.data.objects.new(...)) # freed when the scope ends
+#     keep(mesh) # created in the scope, but outlives it
+#
+# when check_leaks is set, any other mesh or object created in the scope is a leak: it's counted, reported and freed
+# datablocks are referred to by pointer, so ones that were removed early are never touched
+
+import bpy
+
+_collections = ["meshes", "objects"]
+_active_scopes = []
+
+def keep(datablock):
+	"""Mark a datablock created in the active scopes as one that outlives them"""
+	for scope in _active_scopes:
+		scope.keep(datablock)
+	return datablock
+
+def find_datablock(collection, pointer, name):
+	# fast path: it hasn't been renamed
+	datablock = getattr(bpy.data, collection).get(name)
+	if datablock and datablock.as_pointer() == pointer:
+		return datablock
+	for datablock in getattr(bpy.data, collection):
+		if datablock.as_pointer() == pointer:
+			return datablock
+	return None
+
+def free_datablock(collection, datablock):
+	if collection == "objects":
+		for scene in bpy.data.scenes:
+			if datablock.name in scene.objects:
+				scene.objects.unlink(datablock)
+		bpy.data.objects.remove(datablock)
+	elif datablock.users == 0:
+		bpy.data.meshes.remove(datablock)
+	else:
+		return False
+	return True
+
+class TempData:
+	def __init__(self, name, check_leaks=True):
+		self.name = name
+		self.check_leaks = check_leaks
+		self.tracked = [] # (collection, pointer, name)
+		self.kept = set() # pointers
+		self.snapshot = None # collection: set of pointers
+		self.leaks = {} # collection: number of leaked datablocks
+
+	def track(self, datablock):
+		collection = "objects" if isinstance(datablock, bpy.types.Object) else "meshes"
+		self.tracked.append((collection, datablock.as_pointer(), datablock.name))
+		return datablock
+
+	def keep(self, datablock):
+		self.kept.add(datablock.as_pointer())
+		return datablock
+
+	def __enter__(self):
+		if self.check_leaks:
+			self.snapshot = {c: set([d.as_pointer() for d in getattr(bpy.data, c)]) for c in _collections}
+		_active_scopes.append(self)
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		_active_scopes.remove(self)
+		# objects first, they're users of meshes
+		for collection in _collections[::-1]:
+			for (c, pointer, name) in reversed(self.tracked):
+				if c == collection and not pointer in self.kept:
+					datablock = find_datablock(collection, pointer, name)
+					if datablock:
+						free_datablock(collection, datablock)
+		if self.check_leaks:
+			tracked = set([t[1] for t in self.tracked])
+			for collection in _collections[::-1]:
+				leaked = [d for d in getattr(bpy.data, collection) if not d.as_pointer() in self.snapshot[collection] and not d.as_pointer() in self.kept and not d.as_pointer() in tracked]
+				self.leaks[collection] = len(leaked)
+				for datablock in leaked:
+					free_datablock(collection, datablock)
+			if sum(self.leaks.values()) > 0:
+				print("%s leaked %s" % (self.name, ", ".join(["%d %s" % (n, c) for (c, n) in self.leaks.items() if n > 0])))
+		return False
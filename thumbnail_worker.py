@@ -0,0 +1,92 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# renders model thumbnails in a background blender process, see thumbnails.py
+# usage: blender -b --factory-startup --python thumbnail_worker.py -- addon_parent_dir addon_package job_file.json
+
+import bpy, importlib, json, sys
+from mathutils import Vector
+
+_resolution = 128
+
+def setup_scene(scene):
+	# the factory startup scene has a cube, a camera and a lamp. only keep the camera.
+	for obj in list(scene.objects):
+		if obj.type != 'CAMERA':
+			scene.objects.unlink(obj)
+			bpy.data.objects.remove(obj)
+	lamp = bpy.data.objects.new("sun", bpy.data.lamps.new("sun", type='SUN'))
+	lamp.rotation_euler = (0.8, 0.2, 0.6)
+	scene.objects.link(lamp)
+	scene.world.horizon_color = (0.2, 0.2, 0.2)
+	scene.render.engine = 'BLENDER_RENDER'
+	scene.render.resolution_x = _resolution
+	scene.render.resolution_y = _resolution
+	scene.render.resolution_percentage = 100
+	scene.render.alpha_mode = 'TRANSPARENT'
+	scene.render.image_settings.file_format = 'PNG'
+	scene.render.image_settings.color_mode = 'RGBA'
+	return scene.camera
+
+def frame_objects(camera, objects):
+	corners = [obj.matrix_world * Vector(c) for obj in objects for c in obj.bound_box]
+	mins = Vector([min([c[i] for c in corners]) for i in range(3)])
+	maxs = Vector([max([c[i] for c in corners]) for i in range(3)])
+	center = (mins + maxs) / 2.0
+	radius = max((maxs - mins).length / 2.0, 0.001)
+	direction = Vector((1.0, -1.0, 0.6)).normalized()
+	camera.data.type = 'PERSP'
+	camera.data.angle = 0.8
+	camera.data.clip_start = radius * 0.01
+	camera.data.clip_end = radius * 10.0
+	camera.location = center + direction * radius * 2.6
+	camera.rotation_mode = 'QUATERNION'
+	camera.rotation_quaternion = (-direction).to_track_quat('-Z', 'Y')
+
+def clear_objects(scene, keep):
+	for obj in list(scene.objects):
+		if not obj in keep:
+			data = obj.data
+			scene.objects.unlink(obj)
+			bpy.data.objects.remove(obj)
+			if data and data.users == 0 and isinstance(data, bpy.types.Mesh):
+				bpy.data.meshes.remove(data)
+
+def main():
+	args = sys.argv[sys.argv.index("--") + 1:]
+	(addon_parent_dir, package, job_filename) = args
+	sys.path.insert(0, addon_parent_dir)
+	addon = importlib.import_module(package)
+	with open(job_filename) as f:
+		jobs = json.load(f)
+	scene = bpy.context.scene
+	camera = setup_scene(scene)
+	keep = list(scene.objects)
+	for (model_filename, thumbnail_filename) in jobs:
+		try:
+			addon.core.import_model(model_filename)
+			objects = [obj for obj in scene.objects if not obj in keep and obj.type == 'MESH']
+			if len(objects) > 0:
+				frame_objects(camera, objects)
+				scene.render.filepath = thumbnail_filename
+				bpy.ops.render.render(write_still=True)
+		except Exception as e:
+			print("Thumbnail for \"%s\" failed: %s" % (model_filename, e))
+		clear_objects(scene, keep)
+
+if __name__ == "__main__":
+	main()
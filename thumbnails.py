@@ -0,0 +1,64 @@
+# BFG Forge
+# Based on Level Buddy by Matt Lucas
+# https://matt-lucas.itch.io/level-buddy
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.
+
+# model thumbnails are rendered by a pool of background blender processes running thumbnail_worker.py
+# they are cached on disk, keyed by model path and modification time
+
+import bpy, hashlib, json, os, subprocess, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# models per worker process, amortizes blender startup
+_batch_size = 16
+
+def get_cache_dir():
+	return bpy.utils.user_resource('CONFIG', "bfg_forge_thumbnails", create=True)
+
+def get_thumbnail_path(filename):
+	"""Return the cache filename for a model thumbnail. It changes when the model file is modified."""
+	key = "%s|%d" % (os.path.normcase(os.path.realpath(filename)), int(os.path.getmtime(filename)))
+	return os.path.join(get_cache_dir(), hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+def run_worker(jobs):
+	"""Render a batch of (model filename, thumbnail filename) jobs in a background blender process"""
+	addon_dir = os.path.dirname(os.path.realpath(__file__))
+	with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+		json.dump(jobs, f)
+		job_filename = f.name
+	try:
+		args = [bpy.app.binary_path, "-b", "--factory-startup", "--python", os.path.join(addon_dir, "thumbnail_worker.py"), "--", os.path.dirname(addon_dir), __package__, job_filename]
+		subprocess.call(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	finally:
+		os.remove(job_filename)
+	return len([j for j in jobs if os.path.exists(j[1])])
+
+def render_thumbnails(filenames, num_workers, progress=None):
+	"""Render the thumbnails missing from the cache. Returns the number rendered."""
+	jobs = []
+	for filename in filenames:
+		thumbnail = get_thumbnail_path(filename)
+		if not os.path.exists(thumbnail):
+			jobs.append((filename, thumbnail))
+	if len(jobs) == 0:
+		return 0
+	batches = [jobs[i:i + _batch_size] for i in range(0, len(jobs), _batch_size)]
+	num_rendered = 0
+	with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+		for i, n in enumerate(executor.map(run_worker, batches)):
+			num_rendered += n
+			if progress:
+				progress(i + 1, len(batches))
+	return num_rendered